@@ -0,0 +1,214 @@
+# /api/autotag.py
+"""
+タグ付け済みの投稿から学習し、タグのない投稿にタグ候補を付けるバッチ処理。
+本文の文字 n-gram (日本語でも分かち書き不要) と著者を TF-IDF でベクトル化し、
+タグごとの重心ベクトルとのコサイン類似度で全投稿 × 全タグをまとめて採点する
+"""
+import re
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.orm import Session
+
+from . import models, counters
+
+NGRAM_SIZES = (2, 3)
+TEXT_DIMENSIONS = 1 << 20  # 文字 n-gram をハッシュで割り当てる次元数
+AUTHOR_DIMENSIONS = 1 << 16
+AUTHOR_WEIGHT = 2.0  # 著者の特徴を本文よりどれだけ重く見るか
+MIN_TAG_SUPPORT = 2  # 学習に使うタグの最小投稿数
+SCORE_CHUNK_SIZE = 2048
+
+_post_table = models.Post.__table__
+_post_tag = models.post_tag_association
+_suggestion_table = models.TagSuggestion.__table__
+_whitespace = re.compile(r"\s+")
+_FNV_PRIME = np.uint64(1099511628211)
+
+
+def _int_pairs(result) -> np.ndarray:
+    """2 列の整数の結果を (n, 2) の配列にする (Row のまま numpy に渡すと遅い)"""
+    return np.array([tuple(row) for row in result], dtype=np.int64).reshape(-1, 2)
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    text = unicodedata.normalize("NFKC", text or "").casefold().replace("\x00", "")
+    return _whitespace.sub(" ", text).strip()
+
+
+def vectorize(texts: Sequence[str], author_ids: Sequence[Optional[int]]) -> sparse.csr_matrix:
+    """
+    投稿ごとの TF-IDF ベクトル (行を L2 正規化した疎行列) を作る。
+    全文を 1 つの配列につなげ、n-gram のハッシュを位置ごとにまとめて計算する
+    """
+    n = len(texts)
+    joined = "\x00".join(_normalize_text(t) for t in texts)
+    codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    # 区切り文字 (\x00) の数を数えれば各文字がどの投稿のものか分かる
+    doc = np.cumsum(codes == 0)
+
+    rows: List[np.ndarray] = []
+    cols: List[np.ndarray] = []
+    for size in NGRAM_SIZES:
+        if len(codes) < size:
+            continue
+        span = len(codes) - size + 1
+        valid = np.ones(span, dtype=bool)
+        hashes = np.full(span, np.uint64(14695981039346656037) ^ np.uint64(size), dtype=np.uint64)
+        for offset in range(size):
+            window = codes[offset:offset + span]
+            valid &= window != 0
+            hashes = (hashes ^ window) * _FNV_PRIME
+        rows.append(doc[:span][valid])
+        cols.append((hashes[valid] % np.uint64(TEXT_DIMENSIONS)).astype(np.int64))
+
+    text_matrix = sparse.csr_matrix(
+        (np.ones(sum(len(r) for r in rows)), (np.concatenate(rows or [np.empty(0, np.int64)]),
+                                               np.concatenate(cols or [np.empty(0, np.int64)]))),
+        shape=(n, TEXT_DIMENSIONS),
+    )
+    # 長い投稿に引きずられないよう出現回数は対数で抑える
+    text_matrix.data = 1.0 + np.log(text_matrix.data)
+
+    authors = np.array([a if a is not None else -1 for a in author_ids], dtype=np.int64)
+    has_author = np.nonzero(authors >= 0)[0]
+    author_matrix = sparse.csr_matrix(
+        (np.ones(len(has_author)), (has_author, authors[has_author] % AUTHOR_DIMENSIONS)),
+        shape=(n, AUTHOR_DIMENSIONS),
+    )
+
+    matrix = sparse.hstack([text_matrix, author_matrix], format="csr")
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1.0 + n) / (1.0 + document_frequency)) + 1.0
+    idf[TEXT_DIMENSIONS:] *= AUTHOR_WEIGHT
+    matrix.data *= idf[matrix.indices]
+    return _normalize_rows(matrix)
+
+
+def _normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def generate_suggestions(db: Session, top_k: int = 3, min_score: float = 0.2) -> Dict[str, float]:
+    """
+    すべてのタグ候補を作り直して tag_suggestions に保存する。
+    タグのない投稿 1 件ごとに、類似度が min_score 以上のタグを最大 top_k 個まで残す
+    """
+    started = time.perf_counter()
+    posts = db.execute(select(_post_table.c.id, _post_table.c.text, _post_table.c.author_id)
+                       .order_by(_post_table.c.id)).all()
+    pairs = _int_pairs(db.execute(select(_post_tag.c.post_id, _post_tag.c.tag_id)))
+    summary = {"trained_posts": 0, "tags": 0, "untagged_posts": 0, "suggestions": 0, "seconds": 0.0}
+
+    db.execute(delete(models.TagSuggestion))
+    post_ids = np.array([p.id for p in posts], dtype=np.int64)
+    tagged = np.isin(post_ids, pairs[:, 0])
+    untagged_rows = np.nonzero(~tagged)[0]
+    summary["trained_posts"] = int(tagged.sum())
+    summary["untagged_posts"] = len(untagged_rows)
+
+    # 投稿数の少ないタグは学習に使わない
+    tag_ids, tag_cols, tag_support = np.unique(pairs[:, 1], return_inverse=True, return_counts=True)
+    usable = tag_support[tag_cols] >= MIN_TAG_SUPPORT
+    if not usable.any() or len(untagged_rows) == 0:
+        db.commit()
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        return summary
+
+    vectors = vectorize([p.text for p in posts], [p.author_id for p in posts])
+    row_of = np.searchsorted(post_ids, pairs[usable, 0])
+    labels = sparse.csr_matrix(
+        (np.ones(int(usable.sum())), (tag_cols[usable], row_of)), shape=(len(tag_ids), len(post_ids))
+    )
+    labels.data[:] = 1.0
+    keep_tags = np.nonzero(np.diff(labels.indptr))[0]
+    # タグごとの重心 (そのタグが付いた投稿ベクトルの和を正規化したもの)
+    centroids = _normalize_rows((labels[keep_tags] @ vectors).tocsr())
+    centroids_t = centroids.T.tocsr().astype(np.float32)
+    candidate_tags = tag_ids[keep_tags]
+    summary["tags"] = len(candidate_tags)
+
+    untagged_vectors = vectors[untagged_rows].astype(np.float32)
+    k = min(top_k, len(candidate_tags))
+    rows = []
+    for start in range(0, len(untagged_rows), SCORE_CHUNK_SIZE):
+        scores = (untagged_vectors[start:start + SCORE_CHUNK_SIZE] @ centroids_t).toarray()
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        chunk_rows, ranks = np.nonzero(top_scores >= min_score)
+        for r, rank in zip(chunk_rows.tolist(), ranks.tolist()):
+            rows.append({
+                "post_id": int(post_ids[untagged_rows[start + r]]),
+                "tag_id": int(candidate_tags[top[r, rank]]),
+                "score": float(top_scores[r, rank]),
+            })
+    for start in range(0, len(rows), 5000):
+        db.execute(insert(_suggestion_table), rows[start:start + 5000])
+    db.commit()
+    summary["suggestions"] = len(rows)
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def list_suggestions(db: Session, skip: int = 0, limit: int = 20, min_score: float = 0.0):
+    """まだタグのない投稿について、候補を投稿ごとにまとめて返す ({post_id: [(タグ, スコア), ...]})"""
+    still_untagged = ~exists().where(_post_tag.c.post_id == models.TagSuggestion.post_id)
+    page = db.execute(
+        select(models.TagSuggestion.post_id)
+        .where(still_untagged, models.TagSuggestion.score >= min_score)
+        .group_by(models.TagSuggestion.post_id)
+        .order_by(models.TagSuggestion.post_id.desc())
+        .offset(skip).limit(limit)
+    ).scalars().all()
+    grouped: Dict[int, list] = {post_id: [] for post_id in page}
+    if page:
+        rows = db.execute(
+            select(models.TagSuggestion.post_id, models.Tag, models.TagSuggestion.score)
+            .join(models.Tag, models.Tag.id == models.TagSuggestion.tag_id)
+            .where(models.TagSuggestion.post_id.in_(page), models.TagSuggestion.score >= min_score)
+            .order_by(models.TagSuggestion.score.desc())
+        )
+        for post_id, tag, score in rows:
+            grouped[post_id].append((tag, score))
+    return grouped
+
+
+def accept_suggestions(db: Session, post_ids: Sequence[int], min_score: float = 0.0) -> Dict[str, int]:
+    """指定した投稿の候補 (min_score 以上) をまとめてタグとして付ける"""
+    post_ids = list(set(post_ids))
+    if not post_ids:
+        return {"accepted": 0, "posts": 0}
+    suggested = db.execute(
+        select(models.TagSuggestion.post_id, models.TagSuggestion.tag_id)
+        .where(models.TagSuggestion.post_id.in_(post_ids), models.TagSuggestion.score >= min_score)
+    ).all()
+    existing = set(db.execute(
+        select(_post_tag.c.post_id, _post_tag.c.tag_id).where(_post_tag.c.post_id.in_(post_ids))
+    ).all())
+    links = [{"post_id": p, "tag_id": t} for p, t in suggested if (p, t) not in existing]
+    if links:
+        db.execute(insert(_post_tag), links)
+        posted_at = dict(db.execute(
+            select(models.Post.id, models.Post.posted_at).where(models.Post.id.in_({link["post_id"] for link in links}))
+        ).all())
+        deltas: Dict[str, int] = {}
+        day_deltas: Dict[tuple, int] = {}
+        for link in links:
+            scope = counters.tag_scope(link["tag_id"])
+            deltas[scope] = deltas.get(scope, 0) + 1
+            day = counters.day_of(posted_at.get(link["post_id"]))
+            if day:
+                day_deltas[(scope, day)] = day_deltas.get((scope, day), 0) + 1
+        counters.adjust_counts(db, deltas)
+        counters.adjust_day_counts(db, day_deltas)
+        counters.bump_version(db)
+        counters.bump_tag_version(db)
+    db.execute(delete(models.TagSuggestion).where(models.TagSuggestion.post_id.in_(post_ids)))
+    db.commit()
+    return {"accepted": len(links), "posts": len({link["post_id"] for link in links})}
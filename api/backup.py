@@ -0,0 +1,296 @@
+# /api/backup.py
+"""ライブラリ全体のストリーミングエクスポート (NDJSON/CSV) とリストア"""
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session, aliased
+
+from . import models, counters, dedup
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_FIELDS = [
+    "tweet_id", "url", "text", "author_name", "author_screen_name", "author_avatar_url",
+    "posted_at", "media_urls", "favorite_count", "created_at", "folder", "tags",
+    # 返信先・引用元。id は移行先の DB では変わるので tweet_id で持つ
+    "parent_tweet_id", "quoted_tweet_id",
+]
+# CSV ではリスト値を JSON 文字列として格納する
+_CSV_JSON_FIELDS = ("media_urls", "tags")
+_POST_COLUMNS = [
+    "id", "tweet_id", "url", "text", "posted_at", "media_urls", "favorite_count", "created_at", "folder_id",
+]
+_post_table = models.Post.__table__
+_post_tag = models.post_tag_association
+# (エクスポートの項目, posts のカラム)
+_RELATION_FIELDS = (("parent_tweet_id", "parent_post_id"), ("quoted_tweet_id", "quoted_post_id"))
+
+
+# --- Export ---
+
+def iter_export_records(db: Session, batch_size: int = 500) -> Iterator[Dict]:
+    """
+    投稿を id 順に batch_size 件ずつ読み出して 1 件ずつ返す。
+    ORM オブジェクトを作らず、キーセットで窓を進めるのでメモリ使用量は一定。
+    """
+    folders = dict(db.execute(select(models.Folder.id, models.Folder.name)).all())
+    parent = aliased(_post_table)
+    quoted = aliased(_post_table)
+    columns = [_post_table.c[name] for name in _POST_COLUMNS] + [
+        models.Author.name.label("author_name"),
+        models.Author.screen_name.label("author_screen_name"),
+        models.Author.avatar_url.label("author_avatar_url"),
+        parent.c.tweet_id.label("parent_tweet_id"),
+        quoted.c.tweet_id.label("quoted_tweet_id"),
+    ]
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(*columns)
+            .outerjoin(models.Author, models.Author.id == _post_table.c.author_id)
+            .outerjoin(parent, parent.c.id == _post_table.c.parent_post_id)
+            .outerjoin(quoted, quoted.c.id == _post_table.c.quoted_post_id)
+            .where(_post_table.c.id > last_id).order_by(_post_table.c.id).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            return
+        ids = [row["id"] for row in rows]
+        tags: Dict[int, List[str]] = {}
+        tag_rows = db.execute(
+            select(_post_tag.c.post_id, models.Tag.name)
+            .join(models.Tag, models.Tag.id == _post_tag.c.tag_id)
+            .where(_post_tag.c.post_id.in_(ids))
+            .order_by(_post_tag.c.post_id, models.Tag.name)
+        )
+        for post_id, name in tag_rows:
+            tags.setdefault(post_id, []).append(name)
+
+        for row in rows:
+            yield {
+                "tweet_id": row["tweet_id"],
+                "url": row["url"],
+                "text": row["text"],
+                "author_name": row["author_name"],
+                "author_screen_name": row["author_screen_name"],
+                "author_avatar_url": row["author_avatar_url"],
+                "posted_at": row["posted_at"].isoformat() if row["posted_at"] else None,
+                "media_urls": row["media_urls"] or [],
+                "favorite_count": row["favorite_count"] or 0,
+                "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+                "folder": folders.get(row["folder_id"]),
+                "tags": tags.get(row["id"], []),
+                "parent_tweet_id": row["parent_tweet_id"],
+                "quoted_tweet_id": row["quoted_tweet_id"],
+            }
+        last_id = ids[-1]
+
+
+def iter_ndjson(records: Iterable[Dict]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def iter_csv(records: Iterable[Dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for record in records:
+        row = dict(record)
+        for field in _CSV_JSON_FIELDS:
+            row[field] = json.dumps(row[field], ensure_ascii=False)
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def iter_export(db: Session, fmt: str = "ndjson", batch_size: int = 500) -> Iterator[str]:
+    records = iter_export_records(db, batch_size=batch_size)
+    return iter_csv(records) if fmt == "csv" else iter_ndjson(records)
+
+
+# --- Restore ---
+
+def read_ndjson(stream: TextIO) -> Iterator[Dict]:
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream: TextIO) -> Iterator[Dict]:
+    for row in csv.DictReader(stream):
+        record = {k: (v if v != "" else None) for k, v in row.items()}
+        for field in _CSV_JSON_FIELDS:
+            record[field] = json.loads(record[field]) if record.get(field) else []
+        if record.get("favorite_count") is not None:
+            record["favorite_count"] = int(record["favorite_count"])
+        yield record
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+def _ensure_folders(db: Session, names: Iterable[str], cache: Dict[str, int]) -> None:
+    missing = {n for n in names if n and n not in cache}
+    if not missing:
+        return
+    rows = db.execute(select(models.Folder.id, models.Folder.name).where(models.Folder.name.in_(missing)))
+    for folder_id, name in rows:
+        cache[name] = folder_id
+    for name in missing - cache.keys():
+        cache[name] = db.execute(insert(models.Folder).values(name=name).returning(models.Folder.id)).scalar_one()
+
+
+def _ensure_tags(db: Session, names: Iterable[str], cache: Dict[str, int]) -> None:
+    missing = {n for n in names if n and n not in cache}
+    if not missing:
+        return
+    for tag_id, name in db.execute(select(models.Tag.id, models.Tag.name).where(models.Tag.name.in_(missing))):
+        cache[name] = tag_id
+    new_names = sorted(missing - cache.keys())
+    if new_names:
+        rows = db.execute(insert(models.Tag).returning(models.Tag.id, models.Tag.name), [
+            {"name": n, "name_norm": models.normalize_tag_name(n)} for n in new_names
+        ])
+        for tag_id, name in rows:
+            cache[name] = tag_id
+
+
+def _ensure_authors(db: Session, records: List[Dict], cache: Dict[str, int]) -> None:
+    latest: Dict[str, Dict] = {}
+    for r in records:
+        if r.get("author_screen_name"):
+            latest[r["author_screen_name"]] = r
+    missing = set(latest) - cache.keys()
+    if not missing:
+        return
+    rows = db.execute(select(models.Author.id, models.Author.screen_name).where(models.Author.screen_name.in_(missing)))
+    for author_id, screen_name in rows:
+        cache[screen_name] = author_id
+    new_names = sorted(missing - cache.keys())
+    if new_names:
+        values = [{
+            "screen_name": n,
+            "name": latest[n].get("author_name"),
+            "avatar_url": latest[n].get("author_avatar_url"),
+        } for n in new_names]
+        inserted = db.execute(insert(models.Author).returning(models.Author.id, models.Author.screen_name), values)
+        for author_id, screen_name in inserted:
+            cache[screen_name] = author_id
+
+
+def _restore_batch(db: Session, batch: List[Dict], caches: Dict[str, Dict[str, int]], summary: Dict[str, int]) -> None:
+    # tweet_id (なければ URL) で重複を除く
+    tweet_ids = [r["tweet_id"] for r in batch if r.get("tweet_id")]
+    urls = [r["url"] for r in batch if not r.get("tweet_id")]
+    existing_ids = set()
+    existing_urls = set()
+    if tweet_ids:
+        existing_ids.update(db.execute(select(_post_table.c.tweet_id).where(_post_table.c.tweet_id.in_(tweet_ids))).scalars())
+    if urls:
+        existing_urls.update(db.execute(select(_post_table.c.url).where(_post_table.c.url.in_(urls))).scalars())
+
+    new_records = []
+    for record in batch:
+        key = record.get("tweet_id")
+        if (key and key in existing_ids) or (not key and record["url"] in existing_urls):
+            summary["skipped"] += 1
+            continue
+        (existing_ids if key else existing_urls).add(key or record["url"])
+        new_records.append(record)
+    if not new_records:
+        return
+
+    folder_cache, tag_cache, author_cache = caches["folders"], caches["tags"], caches["authors"]
+    _ensure_folders(db, (r.get("folder") for r in new_records), folder_cache)
+    _ensure_tags(db, (t for r in new_records for t in r.get("tags") or []), tag_cache)
+    _ensure_authors(db, new_records, author_cache)
+
+    rows = [{
+        "tweet_id": r.get("tweet_id"),
+        "url": r["url"],
+        "text": r.get("text"),
+        "author_id": author_cache.get(r.get("author_screen_name")) if r.get("author_screen_name") else None,
+        "posted_at": _parse_datetime(r.get("posted_at")),
+        "media_urls": r.get("media_urls") or [],
+        "favorite_count": r.get("favorite_count") or 0,
+        # エクスポートに登録日時がなければ、モデルの既定値 (func.now()) と同じく UTC の現在時刻にする
+        "created_at": _parse_datetime(r.get("created_at")) or datetime.now(timezone.utc),
+        "folder_id": folder_cache.get(r.get("folder")) if r.get("folder") else None,
+    } for r in new_records]
+    inserted = db.execute(insert(_post_table).returning(_post_table.c.id, sort_by_parameter_order=True), rows)
+    post_ids = [row[0] for row in inserted]
+
+    links = [
+        {"post_id": post_id, "tag_id": tag_cache[name]}
+        for post_id, record in zip(post_ids, new_records)
+        for name in dict.fromkeys(record.get("tags") or []) if name
+    ]
+    if links:
+        db.execute(insert(_post_tag), links)
+    # 近似重複の検出用の署名も同じトランザクションで作る (まとまりは find_clusters がバケットから求める)
+    dedup.index_posts(db, [
+        (post_id, row["text"], row["media_urls"]) for post_id, row in zip(post_ids, rows)
+    ], find_duplicates=False)
+    summary["added"] += len(new_records)
+
+
+def _restore_relations(db: Session, relations: List[Tuple[str, str, str]], batch_size: int) -> int:
+    """
+    (tweet_id, カラム, 相手の tweet_id) を id に引き直して結ぶ。相手が後ろのバッチにあることもあるので全件投入後に行う。
+    インポートと同じく、既に設定されている関係は変えない。結んだ件数を返す
+    """
+    linked = 0
+    for start in range(0, len(relations), batch_size):
+        chunk = relations[start:start + batch_size]
+        tweet_ids = {t for tweet_id, _column, target in chunk for t in (tweet_id, target)}
+        ids = dict(db.execute(
+            select(_post_table.c.tweet_id, _post_table.c.id).where(_post_table.c.tweet_id.in_(tweet_ids))
+        ).all())
+        for _field, column in _RELATION_FIELDS:
+            params = [
+                {"b_id": ids[tweet_id], "b_target": ids[target]}
+                for tweet_id, col, target in chunk
+                if col == column and tweet_id in ids and target in ids and ids[tweet_id] != ids[target]
+            ]
+            if params:
+                stmt = (
+                    update(_post_table)
+                    .where(_post_table.c.id == bindparam("b_id"), _post_table.c[column].is_(None))
+                    .values({column: bindparam("b_target")})
+                )
+                linked += db.execute(stmt, params).rowcount
+    return linked
+
+
+def restore_records(db: Session, records: Iterable[Dict], batch_size: int = 500) -> Dict[str, int]:
+    """エクスポートしたレコードを batch_size 件ずつまとめて投入する (tweet_id で重複除去)"""
+    summary = {"added": 0, "skipped": 0, "linked": 0}
+    caches: Dict[str, Dict[str, int]] = {"folders": {}, "tags": {}, "authors": {}}
+    relations: List[Tuple[str, str, str]] = []
+    batch: List[Dict] = []
+    for record in records:
+        for field, column in _RELATION_FIELDS:
+            if record.get("tweet_id") and record.get(field):
+                relations.append((record["tweet_id"], column, record[field]))
+        batch.append(record)
+        if len(batch) >= batch_size:
+            _restore_batch(db, batch, caches, summary)
+            db.commit()
+            batch = []
+    if batch:
+        _restore_batch(db, batch, caches, summary)
+        db.commit()
+    if relations:
+        summary["linked"] = _restore_relations(db, relations, batch_size)
+        db.commit()
+    # 一括投入はカウンタを経由しないので集計し直す (データバージョンも進む)
+    counters.rebuild_counts(db)
+    return summary
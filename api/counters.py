@@ -0,0 +1,255 @@
+# /api/counters.py
+"""データバージョンと投稿件数カウンタ (全体・フォルダ別・タグ別・著者別、およびそれぞれの日別) の管理"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import models, metrics
+
+COUNT_CACHE_SIZE = 256
+
+_post_tag = models.post_tag_association
+_count_cache: "OrderedDict[Hashable, int]" = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+
+def folder_scope(folder_id: int) -> str:
+    return f"folder:{folder_id}"
+
+
+_TAG_PREFIX = "tag:"
+
+
+def tag_scope(tag_id: int) -> str:
+    return f"{_TAG_PREFIX}{tag_id}"
+
+
+def author_scope(author_id: int) -> str:
+    return f"author:{author_id}"
+
+
+def day_of(posted_at: Optional[datetime]) -> Optional[str]:
+    """日別カウンタのキー (UTC の 'YYYY-MM-DD')。タイムゾーンなしの日時は UTC とみなす"""
+    if posted_at is None:
+        return None
+    if posted_at.tzinfo is not None:
+        posted_at = posted_at.astimezone(timezone.utc)
+    return posted_at.strftime("%Y-%m-%d")
+
+
+def day_expression(db: Session):
+    """day_of と同じ値を SQL で求める式"""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.strftime("%Y-%m-%d", models.Post.posted_at)
+    return func.to_char(func.timezone("UTC", models.Post.posted_at), "YYYY-MM-DD")
+
+
+# --- データバージョン ---
+
+# data_version の行。全体のバージョンと、投稿とタグの対応 (post_tag) が変わったときだけ進むバージョン
+DATA_VERSION_ID = 1
+TAG_VERSION_ID = 2
+
+
+def _get(db: Session, version_id: int) -> int:
+    version = db.execute(select(models.DataVersion.version).where(models.DataVersion.id == version_id)).scalar()
+    return version or 0
+
+
+def _bump(db: Session, version_id: int) -> None:
+    result = db.execute(
+        update(models.DataVersion).where(models.DataVersion.id == version_id)
+        .values(version=models.DataVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.execute(insert(models.DataVersion).values(id=version_id, version=1))
+
+
+def get_version(db: Session) -> int:
+    """書き込みのたびに増える全体のデータバージョン"""
+    return _get(db, DATA_VERSION_ID)
+
+
+def bump_version(db: Session) -> None:
+    """データバージョンを進める (呼び出し側のトランザクション内で実行される)"""
+    _bump(db, DATA_VERSION_ID)
+
+
+def get_tag_version(db: Session) -> int:
+    """投稿へのタグの付け外しのたびに増えるバージョン (関連投稿の索引の失効判定に使う)"""
+    return _get(db, TAG_VERSION_ID)
+
+
+def bump_tag_version(db: Session) -> None:
+    """タグのバージョンを進める。本文の編集や取り込みなど、タグの付け外しを伴わない書き込みでは進めない"""
+    _bump(db, TAG_VERSION_ID)
+
+
+# --- 件数カウンタ ---
+
+def _initialized(db: Session) -> bool:
+    return db.execute(select(models.PostCount.count).where(models.PostCount.scope == "all")).first() is not None
+
+
+def adjust_counts(db: Session, deltas: Dict[str, int]) -> None:
+    """カウンタを増減する (タグの分は tags.post_count も)。カウンタ未構築の場合は何もしない (後で rebuild_counts される)"""
+    deltas = {scope: d for scope, d in deltas.items() if d}
+    if not deltas or not _initialized(db):
+        return
+    for scope, delta in deltas.items():
+        result = db.execute(
+            update(models.PostCount).where(models.PostCount.scope == scope).values(count=models.PostCount.count + delta)
+        )
+        if result.rowcount == 0:
+            db.execute(insert(models.PostCount).values(scope=scope, count=max(delta, 0)))
+        if scope.startswith(_TAG_PREFIX):
+            db.execute(
+                update(models.Tag).where(models.Tag.id == int(scope[len(_TAG_PREFIX):]))
+                .values(post_count=models.Tag.post_count + delta)
+            )
+
+
+def adjust_day_counts(db: Session, deltas: Dict[Tuple[str, str], int]) -> None:
+    """(scope, 日) ごとの日別カウンタを増減する。カウンタ未構築の場合は何もしない"""
+    deltas = {key: d for key, d in deltas.items() if d}
+    if not deltas or not _initialized(db):
+        return
+    for (scope, day), delta in deltas.items():
+        result = db.execute(
+            update(models.PostDayCount)
+            .where(models.PostDayCount.scope == scope, models.PostDayCount.day == day)
+            .values(count=models.PostDayCount.count + delta)
+        )
+        if result.rowcount == 0:
+            db.execute(insert(models.PostDayCount).values(scope=scope, day=day, count=max(delta, 0)))
+
+
+def _on_day(deltas: Dict[str, int], posted_at: Optional[datetime]) -> Dict[Tuple[str, str], int]:
+    day = day_of(posted_at)
+    return {(scope, day): d for scope, d in deltas.items()} if day else {}
+
+
+def record_post_added(db: Session, folder_id: Optional[int], tag_ids: Iterable[int],
+                      author_id: Optional[int] = None, posted_at: Optional[datetime] = None) -> None:
+    """投稿の追加をカウンタ (日別を含む) に反映し、データバージョンを進める"""
+    deltas = {"all": 1}
+    if folder_id is not None:
+        deltas[folder_scope(folder_id)] = 1
+    if author_id is not None:
+        deltas[author_scope(author_id)] = 1
+    tag_ids = set(tag_ids)
+    for tag_id in tag_ids:
+        deltas[tag_scope(tag_id)] = 1
+    adjust_counts(db, deltas)
+    adjust_day_counts(db, _on_day(deltas, posted_at))
+    bump_version(db)
+    if tag_ids:
+        bump_tag_version(db)
+
+
+def record_tags_changed(db: Session, old_tag_ids: Iterable[int], new_tag_ids: Iterable[int],
+                        posted_at: Optional[datetime] = None) -> None:
+    """投稿のタグ変更をカウンタ (日別を含む) に反映し、データバージョンを進める"""
+    old, new = set(old_tag_ids), set(new_tag_ids)
+    deltas = {tag_scope(t): 1 for t in new - old}
+    deltas.update({tag_scope(t): -1 for t in old - new})
+    adjust_counts(db, deltas)
+    adjust_day_counts(db, _on_day(deltas, posted_at))
+    bump_version(db)
+    bump_tag_version(db)
+
+
+def rebuild_counts(db: Session) -> None:
+    """カウンタを集計し直す (初回起動時や一括投入の後)"""
+    db.execute(delete(models.PostCount))
+    rows = [{"scope": "all", "count": db.execute(select(func.count(models.Post.id))).scalar() or 0}]
+    folder_counts = db.execute(
+        select(models.Post.folder_id, func.count(models.Post.id))
+        .where(models.Post.folder_id.isnot(None))
+        .group_by(models.Post.folder_id)
+    )
+    rows.extend({"scope": folder_scope(folder_id), "count": n} for folder_id, n in folder_counts)
+    author_counts = db.execute(
+        select(models.Post.author_id, func.count(models.Post.id))
+        .where(models.Post.author_id.isnot(None))
+        .group_by(models.Post.author_id)
+    )
+    rows.extend({"scope": author_scope(author_id), "count": n} for author_id, n in author_counts)
+    tag_counts = db.execute(
+        select(_post_tag.c.tag_id, func.count(func.distinct(_post_tag.c.post_id))).group_by(_post_tag.c.tag_id)
+    )
+    tag_counts = tag_counts.all()
+    rows.extend({"scope": tag_scope(tag_id), "count": n} for tag_id, n in tag_counts)
+    db.execute(insert(models.PostCount), rows)
+    db.execute(update(models.Tag).values(post_count=0))
+    if tag_counts:
+        db.execute(update(models.Tag), [{"id": tag_id, "post_count": n} for tag_id, n in tag_counts])
+    _rebuild_day_counts(db)
+    # 一括投入・リストアの後にも呼ばれるので、タグの対応も変わったものとして扱う
+    bump_version(db)
+    bump_tag_version(db)
+    db.commit()
+
+
+def _rebuild_day_counts(db: Session) -> None:
+    db.execute(delete(models.PostDayCount))
+    day = day_expression(db).label("day")
+    dated = models.Post.posted_at.isnot(None)
+    rows = [{"scope": "all", "day": d, "count": n} for d, n in db.execute(
+        select(day, func.count(models.Post.id)).where(dated).group_by(day)
+    )]
+    for column, scope_of in ((models.Post.folder_id, folder_scope), (models.Post.author_id, author_scope)):
+        rows.extend({"scope": scope_of(key), "day": d, "count": n} for key, d, n in db.execute(
+            select(column, day, func.count(models.Post.id)).where(dated, column.isnot(None)).group_by(column, day)
+        ))
+    rows.extend({"scope": tag_scope(tag_id), "day": d, "count": n} for tag_id, d, n in db.execute(
+        select(_post_tag.c.tag_id, day, func.count(func.distinct(_post_tag.c.post_id)))
+        .join(models.Post, models.Post.id == _post_tag.c.post_id)
+        .where(dated).group_by(_post_tag.c.tag_id, day)
+    ))
+    if rows:
+        db.execute(insert(models.PostDayCount), rows)
+
+
+def ensure_counts(db: Session) -> None:
+    if not _initialized(db):
+        rebuild_counts(db)
+
+
+def get_count(db: Session, scope: str) -> int:
+    ensure_counts(db)
+    count = db.execute(select(models.PostCount.count).where(models.PostCount.scope == scope)).scalar()
+    return count or 0
+
+
+def get_counts(db: Session, scopes: Iterable[str]) -> Dict[str, int]:
+    """複数のカウンタをまとめて取得する (存在しない scope は 0)"""
+    scopes = list(scopes)
+    ensure_counts(db)
+    rows = db.execute(select(models.PostCount.scope, models.PostCount.count).where(models.PostCount.scope.in_(scopes)))
+    counts = {scope: 0 for scope in scopes}
+    counts.update(dict(rows.all()))
+    return counts
+
+
+# --- 複合条件の件数キャッシュ ---
+
+def cached_count(key: Hashable, version: int, compute) -> int:
+    """(条件, データバージョン) をキーに件数をキャッシュする。バージョンが変われば自然に失効する"""
+    cache_key = (key, version)
+    with _count_cache_lock:
+        if cache_key in _count_cache:
+            _count_cache.move_to_end(cache_key)
+            metrics.record_cache_lookup("post_count", True)
+            return _count_cache[cache_key]
+    metrics.record_cache_lookup("post_count", False)
+    count = compute()
+    with _count_cache_lock:
+        _count_cache[cache_key] = count
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return count
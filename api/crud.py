@@ -1,9 +1,12 @@
 import re
+import random
 import time
-from datetime import datetime
+from array import array
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy import func, select, literal, cast, String
+from sqlalchemy.orm import Session, selectinload
+from . import models, schemas, metrics, counters, related, dedup, page_cache
 
 # Selenium Imports
 from selenium import webdriver
@@ -114,6 +117,7 @@ def get_folders(db: Session, skip: int = 0, limit: int = 100):
 def create_folder(db: Session, folder: schemas.FolderCreate):
     db_folder = models.Folder(name=folder.name)
     db.add(db_folder)
+    counters.bump_version(db)
     db.commit()
     db.refresh(db_folder)
     return db_folder
@@ -124,48 +128,319 @@ def get_tag_by_name(db: Session, name: str):
 def get_tags(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Tag).order_by(models.Tag.name).offset(skip).limit(limit).all()
 
+def suggest_tags(db: Session, prefix: str, limit: int = 10) -> List[models.Tag]:
+    """
+    正規化した名前の前方一致でタグを探し、投稿数 (tags.post_count) の多い順に返す。
+    空の入力は (post_count, name_norm) のインデックスを先頭から読み、
+    入力があれば name_norm のインデックスを範囲検索して一致したタグだけを並べ替える
+    """
+    counters.ensure_counts(db)
+    query = db.query(models.Tag)
+    norm = models.normalize_tag_name(prefix.strip())
+    if norm:
+        # 範囲条件でインデックスを引き、照合順序に依存しないよう前方一致で確認する
+        query = query.filter(
+            models.Tag.name_norm >= norm,
+            models.Tag.name_norm < norm + "\U0010ffff",
+            models.Tag.name_norm.startswith(norm, autoescape=True),
+        )
+    return query.order_by(models.Tag.post_count.desc(), models.Tag.name_norm).limit(limit).all()
+
 def create_tag(db: Session, tag: schemas.TagCreate):
     db_tag = models.Tag(name=tag.name)
     db.add(db_tag)
+    counters.bump_version(db)
     db.commit()
     db.refresh(db_tag)
     return db_tag
+# --- Author ---
+
+def get_author_by_screen_name(db: Session, screen_name: str):
+    return db.query(models.Author).filter(models.Author.screen_name == screen_name).first()
+
+def get_or_create_author(db: Session, screen_name: Optional[str], name: Optional[str] = None,
+                         avatar_url: Optional[str] = None) -> Optional[models.Author]:
+    """screen_name で著者を取得 (なければ作成) し、表示名・アイコンを最新のものに更新する"""
+    if not screen_name:
+        return None
+    author = get_author_by_screen_name(db, screen_name)
+    if not author:
+        author = models.Author(screen_name=screen_name)
+        db.add(author)
+    if name:
+        author.name = name
+    if avatar_url:
+        author.avatar_url = avatar_url
+    return author
+
+def get_authors(db: Session, skip: int = 0, limit: int = 100):
+    """著者を投稿数の多い順に (著者, 投稿数) で返す"""
+    counters.ensure_counts(db)
+    post_count = func.coalesce(models.PostCount.count, 0)
+    return (
+        db.query(models.Author, post_count)
+        .outerjoin(models.PostCount, models.PostCount.scope == literal("author:") + cast(models.Author.id, String))
+        .order_by(post_count.desc(), models.Author.screen_name)
+        .offset(skip).limit(limit).all()
+    )
+
+# --- Media ---
+
+def get_media_asset(db: Session, sha256: str):
+    return db.query(models.MediaAsset).filter(models.MediaAsset.sha256 == sha256).first()
+
 # --- Post CRUD ---
 
+def _order_posts(query, sort_order: str = 'desc'):
+    """posted_at 順 (同時刻は id 順) に並べる。昇順・降順で同じ並びを逆にたどる"""
+    if sort_order == 'asc':
+        return query.order_by(models.Post.posted_at.asc().nullslast(), models.Post.id.asc())
+    return query.order_by(models.Post.posted_at.desc().nullslast(), models.Post.id.desc())
+
+def _normalize_datetime(db: Session, value: Optional[datetime]) -> Optional[datetime]:
+    """タイムゾーン付きの日時を UTC に揃える (SQLite はタイムゾーンなしの UTC で保存している)"""
+    if value is None or value.tzinfo is None:
+        return value
+    value = value.astimezone(timezone.utc)
+    if db.get_bind().dialect.name == 'sqlite':
+        value = value.replace(tzinfo=None)
+    return value
+
+def _plan_predicates(db: Session, filters: schemas.PostFilter) -> Optional[List[tuple]]:
+    """
+    絞り込み条件を (推定件数, 種別, 値) のリストにし、件数の少ない順に並べる。
+    推定件数はカウンタから取る。該当なしが確定した場合は None を返す
+    """
+    predicates = []
+    if filters.tag_names:
+        names = set(filters.tag_names)
+        tag_ids = [tag_id for (tag_id,) in db.query(models.Tag.id).filter(models.Tag.name.in_(names))]
+        if len(tag_ids) < len(names):
+            return None
+        tag_counts = counters.get_counts(db, [counters.tag_scope(t) for t in tag_ids])
+        predicates.extend((tag_counts[counters.tag_scope(t)], 'tag', t) for t in tag_ids)
+    if filters.folder_id is not None:
+        predicates.append((counters.get_count(db, counters.folder_scope(filters.folder_id)), 'folder', filters.folder_id))
+    if filters.author:
+        author = get_author_by_screen_name(db, filters.author)
+        if author is None:
+            return None
+        predicates.append((counters.get_count(db, counters.author_scope(author.id)), 'author', author.id))
+
+    if any(estimate == 0 for estimate, _, _ in predicates):
+        return None
+    predicates.sort(key=lambda p: p[0])
+    return predicates
+
+def build_posts_query(db: Session, filters: schemas.PostFilter, predicates: List[tuple], query=None):
+    """計画済みの条件から 1 つのクエリを組み立てる (並び順・ページングは呼び出し側)"""
+    post_tag = models.post_tag_association
+    query = query if query is not None else db.query(models.Post)
+    for i, (_estimate, kind, value) in enumerate(predicates):
+        if kind == 'tag':
+            tagged = select(post_tag.c.post_id).where(post_tag.c.tag_id == value)
+            if i == 0:
+                # 最も件数の少ないタグを起点に (tag_id, post_id) インデックスから投稿を引く
+                query = query.filter(models.Post.id.in_(tagged))
+            else:
+                query = query.filter(tagged.where(post_tag.c.post_id == models.Post.id).exists())
+        elif kind == 'folder':
+            query = query.filter(models.Post.folder_id == value)
+        elif kind == 'author':
+            query = query.filter(models.Post.author_id == value)
+    if filters.posted_from is not None:
+        query = query.filter(models.Post.posted_at >= _normalize_datetime(db, filters.posted_from))
+    if filters.posted_to is not None:
+        query = query.filter(models.Post.posted_at <= _normalize_datetime(db, filters.posted_to))
+    return query
+
+def query_posts(db: Session, filters: schemas.PostFilter, skip: int = 0, limit: int = 10, sort_order: str = 'desc',
+                before: Optional[datetime] = None, after: Optional[datetime] = None):
+    """
+    フォルダ・タグ (AND)・著者・期間を組み合わせて投稿を取得する。
+    before / after を指定するとその日時より前 / 後から始まる (大きな offset を使わずにインデックスで飛ぶ)
+    """
+    predicates = _plan_predicates(db, filters)
+    if predicates is None:
+        return []
+    query = build_posts_query(db, filters, predicates)
+    if before is not None:
+        query = query.filter(models.Post.posted_at < _normalize_datetime(db, before))
+    if after is not None:
+        query = query.filter(models.Post.posted_at > _normalize_datetime(db, after))
+    return _order_posts(query, sort_order).offset(skip).limit(limit).all()
+
+# 期間のキーは 'YYYY-MM-DD' の先頭何文字か (月・年は日別の件数を足し上げる)
+HISTOGRAM_GRANULARITIES = {
+    'day': 10,
+    'month': 7,
+    'year': 4,
+}
+
+def _rollup_scope(predicates: List[tuple]) -> Optional[str]:
+    """条件が 1 つ以下なら、その日別カウンタの scope を返す (複数の条件の組み合わせにはカウンタがない)"""
+    if not predicates:
+        return "all"
+    if len(predicates) > 1:
+        return None
+    _estimate, kind, value = predicates[0]
+    return {'tag': counters.tag_scope, 'folder': counters.folder_scope, 'author': counters.author_scope}[kind](value)
+
+def _day_counts(db: Session, filters: schemas.PostFilter, predicates: List[tuple]) -> List[tuple]:
+    """条件に合う投稿の (日, 件数) を古い順に返す。期間指定があればその範囲の日だけを読む"""
+    first_day = counters.day_of(filters.posted_from)
+    last_day = counters.day_of(filters.posted_to)
+    scope = _rollup_scope(predicates)
+    if scope is None:
+        day = counters.day_expression(db).label('day')
+        query = db.query(day, func.count(models.Post.id)).filter(models.Post.posted_at.isnot(None))
+        query = build_posts_query(db, filters, predicates, query=query)
+        return query.group_by(day).order_by(day).all()
+
+    query = db.query(models.PostDayCount.day, models.PostDayCount.count).filter(models.PostDayCount.scope == scope)
+    if first_day is not None:
+        query = query.filter(models.PostDayCount.day >= first_day)
+    if last_day is not None:
+        query = query.filter(models.PostDayCount.day <= last_day)
+    days = dict(query.all())
+
+    # 期間の端の日は途中から (途中まで) の場合があるので、その 1 日分だけ投稿を数え直す
+    edges = set()
+    if first_day is not None and counters.day_of(filters.posted_from - timedelta(microseconds=1)) == first_day:
+        edges.add(first_day)  # 0 時ちょうどから始まる日はカウンタのままでよい
+    if last_day is not None:
+        edges.add(last_day)
+    for edge in edges:
+        start = _normalize_datetime(db, datetime.strptime(edge, '%Y-%m-%d').replace(tzinfo=timezone.utc))
+        query = build_posts_query(db, filters, predicates, query=db.query(func.count(models.Post.id)))
+        days[edge] = query.filter(models.Post.posted_at >= start, models.Post.posted_at < start + timedelta(days=1)).scalar()
+    return sorted(days.items())
+
+def posts_histogram(db: Session, filters: schemas.PostFilter, granularity: str = 'month') -> List[tuple]:
+    """
+    一覧と同じ条件で、期間 (UTC の日・月・年) ごとの投稿数を古い順に返す。
+    全体・フォルダ・タグ・著者の 1 条件なら日別カウンタを足し上げるだけで投稿は読まない。
+    条件を組み合わせた場合は投稿を日ごとに集計する。結果はデータバージョン付きでキャッシュする
+    """
+    counters.ensure_counts(db)
+    predicates = _plan_predicates(db, filters)
+    if predicates is None:
+        return []
+    width = HISTOGRAM_GRANULARITIES[granularity]
+
+    def compute():
+        buckets: Dict[str, int] = {}
+        for day, count in _day_counts(db, filters, predicates):
+            if count:
+                buckets[day[:width]] = buckets.get(day[:width], 0) + count
+        return sorted(buckets.items())
+    key = ("histogram", granularity, filters.cache_key())
+    return counters.cached_count(key, counters.get_version(db), compute)
+
 def get_posts(db: Session, skip: int = 0, limit: int = 10, sort_order: str = 'desc'):
     """投稿を複数取得する（ソート対応）"""
-    query = db.query(models.Post)
-    if sort_order == 'asc':
-        query = query.order_by(models.Post.posted_at.asc().nullslast())
-    else:
-        query = query.order_by(models.Post.posted_at.desc().nullslast())
-    return query.offset(skip).limit(limit).all()
+    return query_posts(db, schemas.PostFilter(), skip=skip, limit=limit, sort_order=sort_order)
 
 def get_post(db: Session, post_id: int):
     """単一の投稿を取得する"""
     return db.query(models.Post).filter(models.Post.id == post_id).first()
 
+def get_posts_by_ids(db: Session, post_ids: List[int]) -> Dict[int, models.Post]:
+    """複数の投稿を id で取得する。タグ・フォルダも含めてクエリ数は件数によらず一定"""
+    if not post_ids:
+        return {}
+    posts = db.execute(
+        select(models.Post)
+        .where(models.Post.id.in_(set(post_ids)))
+        .options(selectinload(models.Post.tags), selectinload(models.Post.folder))
+    ).unique().scalars().all()
+    return {post.id: post for post in posts}
+
 def get_posts_by_folder(db: Session, folder_id: int, skip: int = 0, limit: int = 10, sort_order: str = 'desc'):
     """フォルダIDで投稿を絞り込み、ソートして取得する"""
-    query = db.query(models.Post).filter(models.Post.folder_id == folder_id)
-    if sort_order == 'asc':
-        query = query.order_by(models.Post.posted_at.asc().nullslast())
-    else:
-        query = query.order_by(models.Post.posted_at.desc().nullslast())
-    return query.offset(skip).limit(limit).all()
+    return query_posts(db, schemas.PostFilter(folder_id=folder_id), skip=skip, limit=limit, sort_order=sort_order)
 
 def get_posts_by_tags_and(db: Session, tag_names: List[str], skip: int = 0, limit: int = 10, sort_order: str = 'desc'):
     """複数のタグ（AND検索）で投稿を絞り込み、ソートして取得する"""
-    query = db.query(models.Post)
-    for name in tag_names:
-        query = query.filter(models.Post.tags.any(models.Tag.name == name))
-    
-    if sort_order == 'asc':
-        query = query.order_by(models.Post.posted_at.asc().nullslast())
+    return query_posts(db, schemas.PostFilter(tag_names=tag_names), skip=skip, limit=limit, sort_order=sort_order)
+
+def count_posts(db: Session, filters: schemas.PostFilter) -> int:
+    """
+    一覧と同じ条件での総件数を返す。
+    条件なし・フォルダ/タグ/著者のいずれか1つはカウンタから、それ以外はデータバージョン付きのキャッシュから取得する
+    """
+    predicates = _plan_predicates(db, filters)
+    if predicates is None:
+        return 0
+    has_dates = filters.posted_from is not None or filters.posted_to is not None
+    if not has_dates and not predicates:
+        return counters.get_count(db, "all")
+    if not has_dates and len(predicates) == 1:
+        return predicates[0][0]
+
+    def compute():
+        return build_posts_query(db, filters, predicates, query=db.query(func.count(models.Post.id))).scalar()
+    return counters.cached_count(("posts", filters.cache_key()), counters.get_version(db), compute)
+
+# id の範囲に占める投稿の割合がこれより低ければ (削除が多い)、ランダムな id の試行をやめて id の一覧から選ぶ
+RANDOM_PROBE_MIN_DENSITY = 0.05
+
+def _probe_random_ids(db: Session, k: int, rng: random.Random) -> Optional[List[int]]:
+    """
+    条件なしのランダム抽出。id の範囲から一様に選んだ候補のうち実在するものだけを採用する (棄却法)。
+    候補はまとめて主キーで引くので、全件の走査や並べ替えはしない。id の範囲がまばらなら None を返す
+    """
+    total = counters.get_count(db, "all")
+    low = db.execute(select(func.min(models.Post.id))).scalar()
+    high = db.execute(select(func.max(models.Post.id))).scalar()
+    if not total or low is None:
+        return []
+    k = min(k, total)
+    density = total / (high - low + 1)
+    if density < RANDOM_PROBE_MIN_DENSITY:
+        return None
+    chosen: List[int] = []
+    seen = set()
+    while len(chosen) < k and len(seen) < high - low + 1:
+        wanted = k - len(chosen)
+        batch = min(int(wanted / density * 1.5) + 8, 1000)
+        candidates = [rng.randint(low, high) for _ in range(batch)]
+        candidates = [c for c in dict.fromkeys(candidates) if c not in seen]
+        seen.update(candidates)
+        found = set(db.execute(select(models.Post.id).where(models.Post.id.in_(candidates))).scalars())
+        # 採用順は候補を引いた順 (seed が同じなら同じ結果になる)
+        chosen.extend(c for c in candidates if c in found)
+    return chosen[:k]
+
+def _filtered_post_ids(db: Session, filters: schemas.PostFilter, predicates: List[tuple]) -> memoryview:
+    """条件に合う投稿 id の配列。データバージョンごとにキャッシュする"""
+    cache = page_cache.random_id_cache
+    version = counters.get_version(db)
+    key = ("random_ids", filters.cache_key())
+    cached = cache.get(key, version)
+    if cached is None:
+        query = build_posts_query(db, filters, predicates, query=db.query(models.Post.id))
+        body = array('q', (post_id for (post_id,) in query.order_by(models.Post.id))).tobytes()
+        cache.put(key, version, body)
     else:
-        query = query.order_by(models.Post.posted_at.desc().nullslast())
-        
-    return query.offset(skip).limit(limit).all()
+        body, _total = cached
+    return memoryview(body).cast('q')
+
+def sample_post_ids(db: Session, filters: schemas.PostFilter, k: int, seed: Optional[int] = None) -> List[int]:
+    """
+    一覧と同じ条件に合う投稿から重複なしで k 件を一様に選び、id を選んだ順に返す。
+    seed を指定すると、データが変わらない限り同じ結果になる
+    """
+    rng = random.Random(seed)
+    predicates = _plan_predicates(db, filters)
+    if predicates is None:
+        return []
+    if not predicates and filters.posted_from is None and filters.posted_to is None:
+        ids = _probe_random_ids(db, k, rng)
+        if ids is not None:
+            return ids
+    ids = _filtered_post_ids(db, filters, predicates)
+    return [ids[i] for i in rng.sample(range(len(ids)), min(k, len(ids)))]
 
 def create_post(db: Session, post: schemas.PostCreate):
     tweet_id = extract_tweet_id_from_url(post.url)
@@ -178,6 +453,7 @@ def create_post(db: Session, post: schemas.PostCreate):
 
     # API呼び出しからスクレイピング呼び出しに変更
     scraped_data = scrape_tweet_data_with_selenium(post.url)
+    metrics.SCRAPES.inc("success" if scraped_data else "failure")
 
     if not scraped_data:
         # スクレイピング失敗時はURLとIDのみで保存
@@ -187,8 +463,11 @@ def create_post(db: Session, post: schemas.PostCreate):
             url=post.url,
             tweet_id=tweet_id,
             text=scraped_data.get("text"),
-            author_name=scraped_data.get("author_name"),
-            author_screen_name=scraped_data.get("author_screen_name"),
+            author=get_or_create_author(
+                db,
+                screen_name=scraped_data.get("author_screen_name"),
+                name=scraped_data.get("author_name"),
+            ),
             posted_at=scraped_data.get("posted_at"),
             media_urls=scraped_data.get("media_urls", []),
             favorite_count=0, # スクレイピングでは取得が難しいので0に
@@ -200,7 +479,7 @@ def create_post(db: Session, post: schemas.PostCreate):
     if post.tags:
         for tag_name in post.tags:
             tag_name_stripped = tag_name.strip()
-            if tag_name_stripped:
+            if tag_name_stripped and all(t.name != tag_name_stripped for t in tag_objects):
                 tag = get_tag_by_name(db, name=tag_name_stripped)
                 if not tag:
                     tag = models.Tag(name=tag_name_stripped)
@@ -210,7 +489,17 @@ def create_post(db: Session, post: schemas.PostCreate):
     db_post.tags = tag_objects
 
     db.add(db_post)
+    db.flush()
+    counters.record_post_added(db, db_post.folder_id, [t.id for t in db_post.tags], db_post.author_id,
+                               db_post.posted_at)
+    # 近似重複の検出用に署名を登録する (取得失敗時の定型文は署名なしとして登録する)
+    if scraped_data:
+        dedup.index_posts(db, [(db_post.id, db_post.text, db_post.media_urls)])
+    else:
+        dedup.index_posts(db, [(db_post.id, None, None)], find_duplicates=False)
     db.commit()
+    if tag_objects:
+        related.record_post_tags(db_post.id, [t.id for t in tag_objects], counters.get_tag_version(db))
     db.refresh(db_post)
     return db_post
 
@@ -220,11 +509,14 @@ def update_post_tags(db: Session, post_id: int, tags: List[str]):
     if not db_post:
         return None
 
+    old_tag_ids = [t.id for t in db_post.tags]
+
     # 新しいタグのリストを作成
     new_tags = []
     for tag_name in tags:
         tag_name_stripped = tag_name.strip()
-        if tag_name_stripped:
+        # 同じタグを二重に付けない
+        if tag_name_stripped and all(t.name != tag_name_stripped for t in new_tags):
             tag = get_tag_by_name(db, name=tag_name_stripped)
             if not tag:
                 # 存在しないタグは新しく作成し、セッションに追加
@@ -234,7 +526,10 @@ def update_post_tags(db: Session, post_id: int, tags: List[str]):
     
     # 投稿のタグを新しいリストに更新
     db_post.tags = new_tags
+    db.flush()
+    counters.record_tags_changed(db, old_tag_ids, [t.id for t in new_tags], db_post.posted_at)
     
     db.commit()
+    related.record_post_tags(post_id, [t.id for t in new_tags], counters.get_tag_version(db))
     db.refresh(db_post)
     return db_post
\ No newline at end of file
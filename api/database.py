@@ -1,8 +1,10 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from . import slowlog
+
 # 本番環境では環境変数からDATABASE_URLを読み込むように変更
 SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./x_like_manager.db")
 # connect_args is needed only for SQLite for multi-threading.
@@ -17,6 +19,110 @@ engine = create_engine(
     pool_pre_ping=True,      # 接続が生きているか確認してから使う
     pool_recycle=300,        # 5分で接続をリサイクル
 )
+# 閾値 (SLOW_QUERY_MS) を超えた文を記録する
+slowlog.instrument_engine(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+def upgrade_schema(metadata) -> None:
+    """
+    既存のテーブルに、後から定義に追加したカラムとインデックスを作成する
+    (create_all は存在しないテーブルしか作らないため)
+    """
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"
+                    )
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+
+
+def migrate_legacy_authors() -> None:
+    """
+    posts に文字列で持っていた著者情報を authors テーブルへ移し、posts.author_id で参照させる。
+    移行済みの行の旧カラムは NULL にして領域を空ける
+    """
+    inspector = inspect(engine)
+    legacy_columns = {c["name"] for c in inspector.get_columns("posts")}
+    if "author_screen_name" not in legacy_columns:
+        return
+    with engine.begin() as conn:
+        pending = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM posts WHERE author_id IS NULL AND author_screen_name IS NOT NULL"
+        ).scalar()
+        if not pending:
+            return
+        conn.exec_driver_sql(
+            "INSERT INTO authors (screen_name, name, avatar_url) "
+            "SELECT author_screen_name, MAX(author_name), MAX(author_avatar_url) FROM posts "
+            "WHERE author_id IS NULL AND author_screen_name IS NOT NULL "
+            "AND author_screen_name NOT IN (SELECT screen_name FROM authors) "
+            "GROUP BY author_screen_name"
+        )
+        conn.exec_driver_sql(
+            "UPDATE posts SET author_id = (SELECT authors.id FROM authors WHERE authors.screen_name = posts.author_screen_name) "
+            "WHERE author_id IS NULL AND author_screen_name IS NOT NULL"
+        )
+        conn.exec_driver_sql(
+            "UPDATE posts SET author_name = NULL, author_screen_name = NULL, author_avatar_url = NULL "
+            "WHERE author_id IS NOT NULL"
+        )
+        conn.exec_driver_sql("DROP INDEX IF EXISTS ix_posts_author_screen_name_posted_at")
+        # 著者別の件数を含めて集計し直させる
+        conn.exec_driver_sql("DELETE FROM post_counts")
+
+
+def backfill_tag_name_norm() -> None:
+    """name_norm 追加前に作られたタグに正規化済みの名前を埋める"""
+    from .models import normalize_tag_name
+    with engine.begin() as conn:
+        rows = conn.exec_driver_sql("SELECT id, name FROM tags WHERE name_norm IS NULL").all()
+        if rows:
+            conn.execute(
+                text("UPDATE tags SET name_norm = :name_norm WHERE id = :id"),
+                [{"id": tag_id, "name_norm": normalize_tag_name(name)} for tag_id, name in rows],
+            )
+
+
+def backfill_day_counts() -> None:
+    """日別カウンタの追加前に集計済みのデータベースは、件数カウンタごと集計し直させる"""
+    with engine.begin() as conn:
+        built = conn.exec_driver_sql("SELECT 1 FROM post_counts LIMIT 1").first()
+        has_days = conn.exec_driver_sql("SELECT 1 FROM post_day_counts LIMIT 1").first()
+        dated = conn.exec_driver_sql("SELECT 1 FROM posts WHERE posted_at IS NOT NULL LIMIT 1").first()
+        if built and dated and not has_days:
+            conn.exec_driver_sql("DELETE FROM post_counts")
+
+
+def backfill_tag_post_counts() -> None:
+    """tags.post_count 追加前のタグは 0 にし、集計済みならカウンタごと集計し直させる"""
+    with engine.begin() as conn:
+        pending = conn.exec_driver_sql("SELECT 1 FROM tags WHERE post_count IS NULL LIMIT 1").first()
+        if pending:
+            conn.exec_driver_sql("UPDATE tags SET post_count = 0 WHERE post_count IS NULL")
+            conn.exec_driver_sql("DELETE FROM post_counts")
+
+
+def init_db() -> None:
+    """テーブルを作成し、既存のデータベースを現在の定義に合わせる"""
+    from . import models  # noqa: F401  (テーブル定義を Base に登録する)
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(Base.metadata)
+    migrate_legacy_authors()
+    backfill_tag_name_norm()
+    backfill_day_counts()
+    backfill_tag_post_counts()
@@ -0,0 +1,270 @@
+# /api/dedup.py
+"""
+MinHash/LSH による近似重複 (引用・転載・同じ画像の投稿) の検出。
+本文の文字 3-gram とメディア URL のファイル名から MinHash 署名を作り、
+BANDS 個のバンドに分けたハッシュが一致する投稿だけを候補として比べる
+"""
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import models, counters
+
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# 推定 Jaccard 係数がこれ以上なら重複とみなす
+DUPLICATE_THRESHOLD = float(os.environ.get("DUPLICATE_THRESHOLD", "0.7"))
+BATCH_SIZE = 500
+
+_MERSENNE = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(0x5EED)
+# 署名の互換性のため係数は固定の乱数列から作る
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_FNV_OFFSET = np.uint64(14695981039346656037)
+_FNV_PRIME = np.uint64(1099511628211)
+
+_signature_table = models.PostSignature.__table__
+_bucket_table = models.PostLshBucket.__table__
+_url = re.compile(r"https?://\S+")
+_whitespace = re.compile(r"\s+")
+
+_clusters_cache: Dict[str, object] = {"version": None, "clusters": []}
+_clusters_lock = threading.Lock()
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _url.sub(" ", text).replace("\x00", "")
+    return _whitespace.sub(" ", text).strip()
+
+
+def _media_key(url: str) -> str:
+    """https://pbs.twimg.com/media/ABC.jpg?name=small -> abc"""
+    name = urlparse(url).path.rsplit("/", 1)[-1]
+    return name.split(".", 1)[0].lower()
+
+
+def compute_signatures(texts: Sequence[Optional[str]], media_lists: Sequence[Optional[List[str]]]
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (署名 (n, NUM_PERM) uint32, 署名を作れたか (n,) bool) を返す。
+    シングルのハッシュも MinHash の最小値もバッチ全体でまとめて計算する
+    """
+    n = len(texts)
+    normalized = [_normalize_text(t) for t in texts]
+    codes = np.frombuffer("\x00".join(normalized).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    doc = np.cumsum(codes == 0)
+
+    docs: List[np.ndarray] = []
+    hashes: List[np.ndarray] = []
+    if len(codes) >= SHINGLE_SIZE:
+        span = len(codes) - SHINGLE_SIZE + 1
+        valid = np.ones(span, dtype=bool)
+        h = np.full(span, _FNV_OFFSET, dtype=np.uint64)
+        for offset in range(SHINGLE_SIZE):
+            window = codes[offset:offset + span]
+            valid &= window != 0
+            h = (h ^ window) * _FNV_PRIME
+        docs.append(doc[:span][valid])
+        hashes.append(((h ^ (h >> np.uint64(32))) & np.uint64(0xFFFFFFFF))[valid])
+
+    # 3 文字未満の本文とメディアは文字列ごとに 1 つのシングルにする
+    extra_docs, extra_hashes = [], []
+    for i, (text, media_urls) in enumerate(zip(normalized, media_lists)):
+        if 0 < len(text) < SHINGLE_SIZE:
+            extra_docs.append(i)
+            extra_hashes.append(zlib.crc32(("text:" + text).encode("utf-8")))
+        for url in media_urls or []:
+            key = _media_key(url)
+            if key:
+                extra_docs.append(i)
+                extra_hashes.append(zlib.crc32(("media:" + key).encode("utf-8")))
+    docs.append(np.array(extra_docs, dtype=np.int64))
+    hashes.append(np.array(extra_hashes, dtype=np.uint64))
+
+    all_docs = np.concatenate(docs)
+    all_hashes = np.concatenate(hashes)
+    signatures = np.zeros((n, NUM_PERM), dtype=np.uint32)
+    present = np.zeros(n, dtype=bool)
+    if len(all_docs) == 0:
+        return signatures, present
+
+    order = np.argsort(all_docs, kind="stable")
+    all_docs, all_hashes = all_docs[order], all_hashes[order]
+    starts = np.flatnonzero(np.r_[True, all_docs[1:] != all_docs[:-1]])
+    # (NUM_PERM, シングル数) の置換ハッシュを投稿ごとの区間で最小値に畳む
+    permuted = (_PERM_A[:, None] * all_hashes[None, :] + _PERM_B[:, None]) % _MERSENNE
+    minimums = np.minimum.reduceat(permuted, starts, axis=1)
+    owners = all_docs[starts]
+    signatures[owners] = minimums.T.astype(np.uint32)
+    present[owners] = True
+    return signatures, present
+
+
+def band_keys(signatures: np.ndarray) -> np.ndarray:
+    """署名 (n, NUM_PERM) からバンドごとのバケット (n, BANDS) int64 を作る"""
+    bands = signatures.reshape(len(signatures), BANDS, ROWS_PER_BAND).astype(np.uint64)
+    h = np.full(bands.shape[:2], _FNV_OFFSET, dtype=np.uint64)
+    for j in range(ROWS_PER_BAND):
+        h = (h ^ bands[:, :, j]) * _FNV_PRIME
+    return h.view(np.int64)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """2 つの署名から Jaccard 係数を推定する"""
+    return float(np.mean(a == b))
+
+
+def _load_signatures(db: Session, post_ids: Iterable[int]) -> Dict[int, np.ndarray]:
+    post_ids = list(set(post_ids))
+    result: Dict[int, np.ndarray] = {}
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        rows = db.execute(
+            select(_signature_table.c.post_id, _signature_table.c.signature)
+            .where(_signature_table.c.post_id.in_(post_ids[start:start + BATCH_SIZE]),
+                   _signature_table.c.signature.isnot(None))
+        )
+        for post_id, blob in rows:
+            result[post_id] = np.frombuffer(blob, dtype=np.uint32)
+    return result
+
+
+def index_posts(db: Session, posts: Sequence[Tuple[int, Optional[str], Optional[List[str]]]],
+                find_duplicates: bool = True) -> Dict[int, Optional[int]]:
+    """
+    (id, text, media_urls) の投稿の署名とバケットを登録し、既存の近似重複を探す。
+    戻り値は {post_id: 最も似ている古い投稿の id (なければ None)}。コミットは呼び出し側で行う。
+    find_duplicates=False なら登録だけ行う (まとまりは find_clusters でバケットから求まる)
+    """
+    if not posts:
+        return {}
+    post_ids = [p[0] for p in posts]
+    signatures, present = compute_signatures([p[1] for p in posts], [p[2] for p in posts])
+    keys = band_keys(signatures)
+
+    bucket_rows = [
+        {"band": band, "bucket": int(keys[i, band]), "post_id": post_ids[i]}
+        for i in np.flatnonzero(present) for band in range(BANDS)
+    ]
+    if bucket_rows:
+        db.execute(insert(_bucket_table), bucket_rows)
+
+    # 同じバケットに入った投稿だけが候補 (バンドごとにインデックスで引く)
+    candidates: Dict[int, set] = {post_ids[i]: set() for i in np.flatnonzero(present)}
+    for band in range(BANDS if find_duplicates else 0):
+        key_to_posts: Dict[int, List[int]] = {}
+        for i in np.flatnonzero(present):
+            key_to_posts.setdefault(int(keys[i, band]), []).append(post_ids[i])
+        if not key_to_posts:
+            continue
+        rows = db.execute(
+            select(_bucket_table.c.bucket, _bucket_table.c.post_id)
+            .where(_bucket_table.c.band == band, _bucket_table.c.bucket.in_(list(key_to_posts)))
+        )
+        for bucket, other_id in rows:
+            for post_id in key_to_posts[bucket]:
+                if other_id < post_id:
+                    candidates[post_id].add(other_id)
+
+    candidate_signatures = _load_signatures(db, {c for cs in candidates.values() for c in cs})
+    # 同じバッチ内の投稿の署名はまだ DB にない
+    candidate_signatures.update({post_ids[i]: signatures[i] for i in np.flatnonzero(present)})
+    duplicates: Dict[int, Optional[int]] = {}
+    signature_rows = []
+    for i, post_id in enumerate(post_ids):
+        best, best_score = None, 0.0
+        for other_id in sorted(candidates.get(post_id, ())):
+            score = similarity(signatures[i], candidate_signatures[other_id])
+            if score >= DUPLICATE_THRESHOLD and score > best_score:
+                best, best_score = other_id, score
+        duplicates[post_id] = best
+        signature_rows.append({
+            "post_id": post_id,
+            "signature": signatures[i].tobytes() if present[i] else None,
+            "duplicate_of": best,
+        })
+    db.execute(insert(_signature_table), signature_rows)
+    return duplicates
+
+
+def ensure_signatures(db: Session) -> int:
+    """署名のない投稿 (機能追加前の投稿や reextract で本文が変わった投稿) に署名を作る。作った件数を返す"""
+    post_table = models.Post.__table__
+    indexed = 0
+    while True:
+        rows = db.execute(
+            select(post_table.c.id, post_table.c.text, post_table.c.media_urls)
+            .outerjoin(_signature_table, _signature_table.c.post_id == post_table.c.id)
+            .where(_signature_table.c.post_id.is_(None))
+            .order_by(post_table.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return indexed
+        index_posts(db, [tuple(row) for row in rows], find_duplicates=False)
+        db.commit()
+        indexed += len(rows)
+
+
+def _find(parent: Dict[int, int], x: int) -> int:
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def find_clusters(db: Session) -> List[List[int]]:
+    """
+    コーパス全体の近似重複のまとまりを大きい順に返す (各まとまりは id の昇順)。
+    2 件以上が入っているバケットだけを読み、バケットの先頭の投稿と比べて併合するので全組み合わせは比べない。
+    結果はデータバージョンごとにキャッシュする
+    """
+    version = counters.get_version(db)
+    with _clusters_lock:
+        if _clusters_cache["version"] == version:
+            return _clusters_cache["clusters"]
+
+    shared = (
+        select(_bucket_table.c.band, _bucket_table.c.bucket)
+        .group_by(_bucket_table.c.band, _bucket_table.c.bucket)
+        .having(func.count() > 1)
+        .subquery()
+    )
+    rows = db.execute(
+        select(_bucket_table.c.band, _bucket_table.c.bucket, _bucket_table.c.post_id)
+        .join(shared, and_(shared.c.band == _bucket_table.c.band, shared.c.bucket == _bucket_table.c.bucket))
+        .order_by(_bucket_table.c.band, _bucket_table.c.bucket, _bucket_table.c.post_id)
+    ).all()
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for band, bucket, post_id in rows:
+        buckets.setdefault((band, bucket), []).append(post_id)
+
+    signatures = _load_signatures(db, (post_id for _b, _k, post_id in rows))
+    parent: Dict[int, int] = {}
+    for members in buckets.values():
+        head = members[0]
+        parent.setdefault(head, head)
+        for other in members[1:]:
+            parent.setdefault(other, other)
+            head_root, other_root = _find(parent, head), _find(parent, other)
+            if head_root != other_root and similarity(signatures[head], signatures[other]) >= DUPLICATE_THRESHOLD:
+                parent[other_root] = head_root
+
+    groups: Dict[int, List[int]] = {}
+    for post_id in parent:
+        groups.setdefault(_find(parent, post_id), []).append(post_id)
+    clusters = sorted((sorted(g) for g in groups.values() if len(g) > 1), key=lambda g: (-len(g), -g[-1]))
+    with _clusters_lock:
+        _clusters_cache["version"] = version
+        _clusters_cache["clusters"] = clusters
+    return clusters
@@ -0,0 +1,153 @@
+# /api/extract.py
+"""保存した X のページ (HTML) から投稿の情報を取り出す。DB やファイルには触れない純粋な関数だけを置く"""
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from bs4 import BeautifulSoup
+
+# 抽出結果のうち posts / authors に保存されるフィールド
+EXTRACTED_FIELDS = (
+    "tweet_id", "text", "posted_at", "media_urls", "author_name", "author_screen_name", "author_avatar_url",
+)
+# 同じページの他の投稿との関係 (相手の tweet_id)。extract_posts だけが返す
+RELATION_FIELDS = ("reply_to_tweet_id", "quoted_tweet_id")
+
+_status_path = re.compile(r'^(?:https?://[^/]+)?/([^/?#]+)/status/(\d+)')
+
+
+class ExtractionError(Exception):
+    """ページから投稿を取り出せなかった"""
+
+
+def _inside(element, containers) -> bool:
+    return any(parent is container for parent in element.parents for container in containers)
+
+
+def _own(root, excluded, name, **attrs) -> list:
+    """root の中から excluded (引用部分) の内側にないものだけを探す"""
+    return [el for el in root.find_all(name, **attrs) if not _inside(el, excluded)]
+
+
+def _quote_containers(article) -> list:
+    """引用ツイートの枠 (投稿者名を含む role=link の div)。入れ子は外側だけ"""
+    quotes = [div for div in article.find_all("div", attrs={"role": "link"})
+              if div.find("div", attrs={"data-testid": "User-Name"})]
+    return [q for q in quotes if not _inside(q, quotes)]
+
+
+def _permalink(root, excluded) -> Optional[tuple]:
+    """投稿時刻を囲むリンク (/<screen_name>/status/<id>) から (screen_name, tweet_id) を取る"""
+    for time_tag in _own(root, excluded, "time"):
+        link = time_tag.find_parent("a", href=True)
+        match = _status_path.match(link["href"]) if link else None
+        if match:
+            return match.group(1), match.group(2)
+    return None
+
+
+def _extract_fields(root, excluded) -> dict:
+    data = {}
+    user_name_div = next(iter(_own(root, excluded, "div", attrs={"data-testid": "User-Name"})), None)
+    if user_name_div:
+        spans = user_name_div.find_all("span")
+        data['author_name'] = spans[0].text if spans else 'Unknown'
+        user_id_div = user_name_div.find_next('div')
+        if user_id_div:
+            data['author_screen_name'] = ''.join(s.text for s in user_id_div.find_all('span')).replace('@', '')
+
+    text_div = next(iter(_own(root, excluded, "div", attrs={"data-testid": "tweetText"})), None)
+    data['text'] = text_div.get_text(separator='\n', strip=True) if text_div else ""
+
+    time_tag = next((t for t in _own(root, excluded, "time") if 'datetime' in t.attrs), None)
+    if time_tag:
+        data['posted_at'] = datetime.fromisoformat(time_tag['datetime'].replace('Z', '+00:00'))
+
+    data['media_urls'] = [
+        f"{img['src'].split('?')[0]}?format=jpg&name=orig"
+        for div in _own(root, excluded, "div", attrs={"data-testid": "tweetPhoto"})
+        if (img := div.find("img")) and 'src' in img.attrs
+    ]
+
+    avatar_container = next(iter(_own(root, excluded, "div", attrs={"data-testid": re.compile(r"UserAvatar-Container-.*")})), None)
+    if avatar_container and (avatar_img := avatar_container.find("img")) and 'src' in avatar_img.attrs:
+        data['author_avatar_url'] = avatar_img['src']
+    return data
+
+
+def extract_posts(html: bytes, url: str, charset: Optional[str] = None) -> List[dict]:
+    """
+    ページ内のすべての投稿 (スレッドの前後・引用) を 1 回のパースで取り出す。先頭がページの URL の投稿。
+    各投稿の reply_to_tweet_id / quoted_tweet_id に同じページ内の返信先・引用元を入れる。
+    返信関係は画面の並びから決める: 注目の投稿より前は 1 つ前への返信、
+    後ろは同じ著者が続く間は 1 つ前への返信 (セルフスレッド)、それ以降は注目の投稿への返信とみなす
+    """
+    try:
+        soup = BeautifulSoup(html, 'lxml', from_encoding=charset or 'utf-8')
+    except Exception as e:
+        raise ExtractionError(f"Error parsing HTML: {e}") from e
+
+    tweet_id_match = re.search(r'status/(\d+)', url)
+    page_tweet_id = tweet_id_match.group(1) if tweet_id_match else None
+
+    articles = soup.find_all("article", attrs={"data-testid": "tweet"})
+    articles = [a for a in articles if not _inside(a, articles)]
+    if not articles:
+        raise ExtractionError("Could not find the main tweet article element")
+
+    try:
+        posts, quotes = [], []
+        for article in articles:
+            quote_divs = _quote_containers(article)
+            permalink = _permalink(article, quote_divs)
+            post = _extract_fields(article, quote_divs)
+            post['tweet_id'] = permalink[1] if permalink else None
+            post['url'] = f"https://x.com/{permalink[0]}/status/{permalink[1]}" if permalink else None
+            posts.append(post)
+
+            # 引用元は permalink があるものだけ投稿にできる
+            for quote_div in quote_divs[:1]:
+                quote_link = _permalink(quote_div, [])
+                if quote_link is None:
+                    continue
+                quote = _extract_fields(quote_div, [])
+                quote.update(tweet_id=quote_link[1], url=f"https://x.com/{quote_link[0]}/status/{quote_link[1]}")
+                post['quoted_tweet_id'] = quote['tweet_id']
+                quotes.append(quote)
+    except Exception as e:
+        raise ExtractionError(f"An error occurred during data extraction: {e}") from e
+
+    main = next((i for i, p in enumerate(posts) if page_tweet_id and p['tweet_id'] == page_tweet_id), None)
+    # 引用元の URL で読み直された場合 (reextract) はその引用を先頭にする
+    page_quote = None if main is not None else next(
+        (q for q in quotes if page_tweet_id and q['tweet_id'] == page_tweet_id), None)
+    if main is None:
+        main = 0
+    if page_quote is None:
+        # ページの投稿は URL を正とする (リンクが取れなくても取り込める)
+        posts[main].update(url=url, tweet_id=page_tweet_id)
+
+    for i in range(1, main + 1):
+        posts[i]['reply_to_tweet_id'] = posts[i - 1]['tweet_id']
+    in_self_thread = True
+    for i in range(main + 1, len(posts)):
+        in_self_thread = in_self_thread and posts[i].get('author_screen_name') == posts[main].get('author_screen_name')
+        posts[i]['reply_to_tweet_id'] = posts[i - 1 if in_self_thread else main]['tweet_id']
+
+    # 投稿として保存できない (id のない) ものは除き、同じ投稿はまとめる
+    head = page_quote or posts[main]
+    result, seen = [], set()
+    for post in [head] + [p for p in posts + quotes if p is not head]:
+        if post is not head and (post['tweet_id'] is None or post['tweet_id'] in seen):
+            continue
+        seen.add(post['tweet_id'])
+        result.append(post)
+    return result
+
+
+def extract_post_data(html: bytes, url: str, charset: Optional[str] = None) -> dict:
+    """HTML とページの URL から投稿のデータ (url, tweet_id, text, ...) を取り出す"""
+    post = extract_posts(html, url, charset)[0]
+    for field in RELATION_FIELDS:
+        post.pop(field, None)
+    return post
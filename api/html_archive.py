@@ -0,0 +1,95 @@
+# /api/html_archive.py
+"""
+インポートした MHTML の HTML パートを圧縮して保存するアーカイブ。
+内容の SHA-256 で名前を付けるので同じページは 1 つしか持たない。抽出処理を直したら reextract で読み直せる
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, extract
+
+try:
+    import zstandard
+except ImportError:  # zstandard がなければ gzip で保存する
+    zstandard = None
+
+ARCHIVE_ROOT = os.environ.get("HTML_ARCHIVE_ROOT", "./html_archive")
+ZSTD_LEVEL = int(os.environ.get("HTML_ARCHIVE_ZSTD_LEVEL", "10"))
+
+_EXTENSIONS = {"zstd": ".html.zst", "gzip": ".html.gz"}
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def archive_path(sha256: str, codec: str) -> str:
+    return os.path.join(ARCHIVE_ROOT, sha256[:2], sha256[2:4], sha256 + _EXTENSIONS[codec])
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This archive entry is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def store(db: Session, html: bytes, charset: Optional[str]) -> models.ArchivedHtml:
+    """HTML を圧縮して保存し、アーカイブの行を返す (同じ内容なら既存の行)。コミットは呼び出し側で行う"""
+    sha256 = hashlib.sha256(html).hexdigest()
+    entry = db.get(models.ArchivedHtml, sha256)
+    if entry is not None and os.path.exists(archive_path(sha256, entry.codec)):
+        return entry
+    codec = entry.codec if entry is not None and (entry.codec != "zstd" or zstandard) else default_codec()
+    compressed = compress(html, codec)
+    _atomic_write(archive_path(sha256, codec), compressed)
+    if entry is None:
+        entry = models.ArchivedHtml(sha256=sha256)
+        db.add(entry)
+    entry.codec = codec
+    entry.charset = charset
+    entry.size = len(html)
+    entry.compressed_size = len(compressed)
+    return entry
+
+
+def load(sha256: str, codec: str) -> bytes:
+    with open(archive_path(sha256, codec), "rb") as f:
+        return decompress(f.read(), codec)
+
+
+def extract_archived(job: Tuple[int, str, str, str, Optional[str]]) -> Tuple[int, Optional[dict], Optional[str]]:
+    """
+    (post_id, url, sha256, codec, charset) のページを読み直して抽出する。
+    プロセスプールのワーカーで呼ばれるので、HTML はワーカー側でファイルから読む
+    """
+    post_id, url, sha256, codec, charset = job
+    try:
+        return post_id, extract.extract_post_data(load(sha256, codec), url, charset), None
+    except (OSError, RuntimeError, extract.ExtractionError) as e:
+        return post_id, None, str(e)
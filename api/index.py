@@ -1,13 +1,17 @@
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Request, Response
+from fastapi.responses import PlainTextResponse, FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from pydantic import TypeAdapter
 from typing import List, Optional
+from datetime import datetime
 import tempfile
 import os
+import re
 
 from fastapi.middleware.cors import CORSMiddleware
 
-from . import models, schemas, crud
-from .database import SessionLocal, engine
+from . import models, schemas, crud, metrics, slowlog, media_store, backup, counters, page_cache, related, autotag, dedup
+from .database import SessionLocal, engine, init_db
 
 # Adjust the path to import from the `scripts` directory
 import sys
@@ -17,8 +21,12 @@ if project_root not in sys.path:
 from scripts import import_mhtml
 
 
-# Create the database tables
-models.Base.metadata.create_all(bind=engine)
+# Create the database tables (and add columns/indexes introduced later)
+init_db()
+
+# 件数カウンタが未構築なら集計する
+with SessionLocal() as _db:
+    counters.ensure_counts(_db)
 
 app = FastAPI(title="X Like Manager API")
 
@@ -34,8 +42,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Total-Count"],
 )
 
+# リクエスト計測 (METRICS_ENABLED=0 の場合は登録しない)
+if metrics.METRICS_ENABLED:
+    metrics.instrument_engine(engine)
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# スロークエリログのエンドポイント表示用 (計測の有無に関係なく登録する)
+if slowlog.SLOW_QUERY_MS > 0:
+    app.add_middleware(slowlog.RequestContextMiddleware)
+
 # Dependency to get a DB session
 def get_db():
     db = SessionLocal()
@@ -50,6 +68,27 @@ def get_db():
 def read_root():
     return {"message": "Welcome to the X-Like-Manager API"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- Debug ---
+
+@app.get("/api/debug/cache")
+def read_cache_stats():
+    return {"post_list": page_cache.post_list_cache.stats()}
+
+@app.get("/api/debug/slow_queries")
+def read_slow_queries(limit: int = 50):
+    if not slowlog.SLOW_QUERY_DEBUG:
+        raise HTTPException(status_code=404, detail="Slow query log is disabled (set SLOW_QUERY_DEBUG=1)")
+    return {
+        "threshold_ms": slowlog.SLOW_QUERY_MS,
+        "entries": slowlog.recent_entries(limit=limit),
+    }
+
 # --- Folders ---
 
 @app.post("/api/folders/", response_model=schemas.Folder)
@@ -66,38 +105,144 @@ def read_folders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db))
 
 # --- Tags ---
 
+TAG_SUGGEST_MAX = 50
+
 @app.get("/api/tags/", response_model=List[schemas.Tag])
 def read_tags(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     tags = crud.get_tags(db, skip=skip, limit=limit)
     return tags
 
+@app.get("/api/tags/suggest", response_model=List[schemas.TagWithCount])
+def suggest_tags(prefix: str = "", limit: int = 10, db: Session = Depends(get_db)):
+    """入力途中のタグ名に前方一致するタグを投稿数の多い順に返す"""
+    limit = max(1, min(limit, TAG_SUGGEST_MAX))
+    return crud.suggest_tags(db, prefix, limit=limit)
+
+# --- Tag Suggestions ---
+
+@app.get("/api/tag_suggestions", response_model=List[schemas.PostTagSuggestions])
+def read_tag_suggestions(skip: int = 0, limit: int = 20, min_score: float = 0.0, db: Session = Depends(get_db)):
+    """自動タグ付けの候補をタグのない投稿ごとに返す"""
+    grouped = autotag.list_suggestions(db, skip=skip, limit=limit, min_score=min_score)
+    posts = crud.get_posts_by_ids(db, list(grouped))
+    return [
+        {"post": posts[post_id], "suggestions": [{"tag": tag, "score": score} for tag, score in suggestions]}
+        for post_id, suggestions in grouped.items() if post_id in posts
+    ]
+
+@app.post("/api/tag_suggestions/refresh")
+def refresh_tag_suggestions(top_k: int = 3, min_score: float = 0.2, db: Session = Depends(get_db)):
+    """タグ付け済みの投稿から学習し直して候補を作り直す"""
+    return autotag.generate_suggestions(db, top_k=max(1, top_k), min_score=min_score)
+
+@app.post("/api/tag_suggestions/accept")
+def accept_tag_suggestions(accept: schemas.TagSuggestionAccept, db: Session = Depends(get_db)):
+    """指定した投稿の候補をまとめてタグとして確定する"""
+    return autotag.accept_suggestions(db, accept.post_ids, min_score=accept.min_score)
+
+# --- Authors ---
+
+@app.get("/api/authors", response_model=List[schemas.AuthorWithCount])
+def read_authors(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return [
+        schemas.AuthorWithCount.model_validate(author).model_copy(update={"post_count": count})
+        for author, count in crud.get_authors(db, skip=skip, limit=limit)
+    ]
+
 # --- Posts ---
 
 @app.post("/api/posts/", response_model=schemas.Post)
 def create_post(post: schemas.PostCreate, db: Session = Depends(get_db)):
     return crud.create_post(db=db, post=post)
 
+def get_post_filter(
+    folder_id: Optional[int] = None,
+    tag_names: Optional[str] = None, # カンマ区切り (AND)
+    author: Optional[str] = None, # screen_name
+    posted_from: Optional[datetime] = None,
+    posted_to: Optional[datetime] = None,
+) -> schemas.PostFilter:
+    """クエリパラメータから絞り込み条件を作る"""
+    tag_list = [t.strip() for t in tag_names.split(",") if t.strip()] if tag_names else []
+    author = author.strip().lstrip("@") if author else None
+    return schemas.PostFilter(
+        folder_id=folder_id, tag_names=tag_list, author=author or None,
+        posted_from=posted_from, posted_to=posted_to,
+    )
+
+post_list_adapter = TypeAdapter(List[schemas.Post])
+POST_BATCH_MAX = 100
+
 @app.get("/api/posts/", response_model=List[schemas.Post])
 def read_posts(
-    folder_id: Optional[int] = None,
-    tag_names: Optional[str] = None,
+    response: Response,
+    filters: schemas.PostFilter = Depends(get_post_filter),
     skip: int = 0,
     limit: int = 10,
     sort_order: str = 'desc', # ソート順を追加
+    with_total: bool = False, # True なら総件数を X-Total-Count ヘッダーで返す
+    before: Optional[datetime] = None, # この日時より前の投稿から (タイムラインのジャンプ用)
+    after: Optional[datetime] = None, # この日時より後の投稿から
+    db: Session = Depends(get_db)
+):
+    # シリアライズ済みのページをデータバージョン付きでキャッシュする
+    cache = page_cache.post_list_cache
+    if cache.enabled:
+        version = counters.get_version(db)
+        key = (filters.cache_key(), sort_order, skip, limit, with_total, before, after)
+        cached = cache.get(key, version)
+        if cached is None:
+            # フォルダ・タグ(AND)・著者・期間はすべて組み合わせて絞り込む
+            posts = crud.query_posts(db, filters, skip=skip, limit=limit, sort_order=sort_order, before=before, after=after)
+            body = post_list_adapter.dump_json(post_list_adapter.validate_python(posts, from_attributes=True))
+            total = crud.count_posts(db, filters) if with_total else None
+            cache.put(key, version, body, total)
+        else:
+            body, total = cached
+        headers = {"X-Total-Count": str(total)} if with_total else None
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    # フォルダ・タグ(AND)・著者・期間はすべて組み合わせて絞り込む
+    if with_total:
+        response.headers["X-Total-Count"] = str(crud.count_posts(db, filters))
+    return crud.query_posts(db, filters, skip=skip, limit=limit, sort_order=sort_order, before=before, after=after)
+
+@app.get("/api/posts/histogram", response_model=List[schemas.HistogramBucket])
+def read_posts_histogram(
+    filters: schemas.PostFilter = Depends(get_post_filter),
+    granularity: str = "month", # day / month / year
+    db: Session = Depends(get_db)
+):
+    """一覧と同じ絞り込み条件で、期間ごとの投稿数を返す"""
+    if granularity not in crud.HISTOGRAM_GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be one of: day, month, year")
+    return [{"period": period, "count": count} for period, count in crud.posts_histogram(db, filters, granularity)]
+
+@app.get("/api/posts/random", response_model=List[schemas.Post])
+def read_random_posts(
+    filters: schemas.PostFilter = Depends(get_post_filter),
+    k: int = 10,
+    seed: Optional[int] = None, # 指定すると同じデータに対して同じ結果を返す
     db: Session = Depends(get_db)
 ):
-    # 複数タグのAND検索ロジック
-    if tag_names:
-        tag_list = [t.strip() for t in tag_names.split(",") if t.strip()]
-        if tag_list:
-            return crud.get_posts_by_tags_and(db, tag_list, skip=skip, limit=limit, sort_order=sort_order)
-
-    # 既存のフォルダフィルタリング
-    if folder_id is not None:
-        return crud.get_posts_by_folder(db, folder_id=folder_id, skip=skip, limit=limit, sort_order=sort_order)
-    
-    # フィルタなし
-    return crud.get_posts(db, skip=skip, limit=limit, sort_order=sort_order)
+    """一覧と同じ絞り込み条件に合う投稿から k 件をランダムに返す"""
+    if not 1 <= k <= POST_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {POST_BATCH_MAX}")
+    post_ids = crud.sample_post_ids(db, filters, k, seed=seed)
+    posts = crud.get_posts_by_ids(db, post_ids)
+    return [posts[i] for i in post_ids if i in posts]
+
+@app.get("/api/posts/batch", response_model=schemas.PostBatch)
+def read_posts_batch(ids: str, db: Session = Depends(get_db)):
+    """カンマ区切りの id で複数の投稿を一度に取得する"""
+    try:
+        post_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    if len(post_ids) > POST_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {POST_BATCH_MAX})")
+    posts = crud.get_posts_by_ids(db, post_ids)
+    return {"posts": posts, "missing": [i for i in post_ids if i not in posts]}
 
 @app.get("/api/posts/{post_id}", response_model=schemas.Post)
 def read_post(post_id: int, db: Session = Depends(get_db)):
@@ -106,6 +251,15 @@ def read_post(post_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Post not found")
     return db_post
 
+@app.get("/api/posts/{post_id}/related", response_model=List[schemas.RelatedPost])
+def read_related_posts(post_id: int, limit: int = 10, db: Session = Depends(get_db)):
+    """タグの重なりが大きい投稿を類似度の高い順に返す"""
+    if crud.get_post(db, post_id=post_id) is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    neighbours = related.get_related(db, post_id, limit=max(1, limit))
+    posts = crud.get_posts_by_ids(db, [i for i, _score in neighbours])
+    return [{"score": score, "post": posts[i]} for i, score in neighbours if i in posts]
+
 @app.put("/api/posts/{post_id}/tags", response_model=schemas.Post)
 def update_post_tags(post_id: int, tags_update: schemas.TagsUpdate, db: Session = Depends(get_db)):
     db_post = crud.update_post_tags(db, post_id=post_id, tags=tags_update.tags)
@@ -113,6 +267,139 @@ def update_post_tags(post_id: int, tags_update: schemas.TagsUpdate, db: Session
         raise HTTPException(status_code=404, detail="Post not found")
     return db_post
 
+# --- Bootstrap ---
+
+bootstrap_adapter = TypeAdapter(schemas.Bootstrap)
+# 組み立て中に書き込みがあれば読み直す回数
+BOOTSTRAP_ATTEMPTS = 3
+
+def _build_bootstrap(db: Session, filters: schemas.PostFilter, limit: int, sort_order: str, tag_limit: int,
+                     before: Optional[datetime], after: Optional[datetime]):
+    """
+    (JSON, データバージョン) を返す。前後でデータバージョンが同じなら間に書き込みはなく、
+    すべて同じ時点のデータから作られている。読み直しても変わり続ける場合はバージョンを None にする
+    """
+    version = counters.get_version(db)
+    for _attempt in range(BOOTSTRAP_ATTEMPTS):
+        data = schemas.Bootstrap(
+            version=version,
+            posts=crud.query_posts(db, filters, skip=0, limit=limit, sort_order=sort_order, before=before, after=after),
+            total=crud.count_posts(db, filters),
+            tags=crud.suggest_tags(db, "", limit=tag_limit),
+            folders=crud.get_folders(db),
+        )
+        latest = counters.get_version(db)
+        if latest == version:
+            return bootstrap_adapter.dump_json(data), version
+        version = latest
+    return bootstrap_adapter.dump_json(data), None
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {re.sub(r'^W/', '', c.strip()) for c in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+@app.get("/api/bootstrap", response_model=schemas.Bootstrap)
+def read_bootstrap(
+    request: Request,
+    filters: schemas.PostFilter = Depends(get_post_filter),
+    limit: int = 10,
+    sort_order: str = 'desc',
+    tag_limit: int = 100, # 投稿数の多い順に返すタグの数
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    初回表示に必要な一覧の先頭ページ (総件数付き)・タグ・フォルダを 1 つのセッションでまとめて返す。
+    ETag はデータバージョンなので、書き込みがなければ再読み込みは 304 で済む
+    """
+    version = counters.get_version(db)
+    etag = f'"bootstrap-{version}"'
+    # ブラウザに毎回検証させる (変更がなければ 304 で本文は送らない)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    cache = page_cache.post_list_cache
+    key = ("bootstrap", filters.cache_key(), sort_order, limit, tag_limit, before, after)
+    cached = cache.get(key, version) if cache.enabled else None
+    if cached is not None:
+        return Response(content=cached[0], media_type="application/json", headers=headers)
+
+    body, version = _build_bootstrap(db, filters, max(1, limit), sort_order, max(0, tag_limit), before, after)
+    if version is None:
+        # 書き込みが続いていて一時点のデータと言えないので、検証に使わせない
+        return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-store"})
+    cache.put(key, version, body)
+    headers["ETag"] = f'"bootstrap-{version}"'
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# --- Duplicates ---
+
+@app.get("/api/duplicates", response_model=List[schemas.DuplicateCluster])
+def read_duplicates(skip: int = 0, limit: int = 20, db: Session = Depends(get_db)):
+    """近似重複のまとまりを大きい順に返す (署名は投稿の書き込み時に作られているので、ここでは読むだけ)"""
+    clusters = dedup.find_clusters(db)[skip:skip + limit]
+    posts = crud.get_posts_by_ids(db, [post_id for cluster in clusters for post_id in cluster])
+    return [
+        {"size": len(cluster), "posts": [posts[i] for i in cluster if i in posts]}
+        for cluster in clusters
+    ]
+
+# --- Export ---
+
+@app.get("/api/export")
+def export_library(format: str = "ndjson"):
+    if format not in backup.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+    def generate():
+        # レスポンスを流し終えるまで使うので、リクエストのセッションとは別に開く
+        db = SessionLocal()
+        try:
+            yield from backup.iter_export(db, fmt=format)
+        finally:
+            db.close()
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="x_like_manager.{format}"'}
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+# --- Media ---
+
+# ハッシュ名なので内容は変わらない。ブラウザ/CDN に長期キャッシュさせる
+IMMUTABLE_CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+def _get_media_asset_or_404(db: Session, sha256: str) -> models.MediaAsset:
+    if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        raise HTTPException(status_code=404, detail="Media not found")
+    asset = crud.get_media_asset(db, sha256)
+    if asset is None or not os.path.exists(media_store.original_path(asset.sha256, asset.content_type)):
+        raise HTTPException(status_code=404, detail="Media not found")
+    return asset
+
+@app.get("/api/media/{sha256}")
+def read_media(sha256: str, db: Session = Depends(get_db)):
+    asset = _get_media_asset_or_404(db, sha256)
+    headers = dict(IMMUTABLE_CACHE_HEADERS, ETag=f'"{asset.sha256}"')
+    return FileResponse(media_store.original_path(asset.sha256, asset.content_type),
+                        media_type=asset.content_type, headers=headers)
+
+@app.get("/api/media/{sha256}/thumb")
+def read_media_thumbnail(sha256: str, db: Session = Depends(get_db)):
+    asset = _get_media_asset_or_404(db, sha256)
+    path = media_store.thumbnail_path(asset.sha256)
+    # ワーカーがまだ生成していなければここで作る
+    if not os.path.exists(path) and not media_store.generate_thumbnail(asset.sha256, asset.content_type):
+        # 生成できない画像は元画像を返す (後で生成できるよう長期キャッシュはしない)
+        return FileResponse(media_store.original_path(asset.sha256, asset.content_type),
+                            media_type=asset.content_type, headers={"Cache-Control": "no-cache"})
+    headers = dict(IMMUTABLE_CACHE_HEADERS, ETag=f'"{asset.sha256}-thumb"')
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
 @app.post("/api/upload_mhtmls/")
 async def upload_mhtml_files(files: List[UploadFile] = File(...)):
     if not files:
@@ -0,0 +1,144 @@
+# /api/media_store.py
+"""MHTML に埋め込まれた画像をハッシュ名で保存するコンテンツアドレス型のローカルストア"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", "./media_store")
+THUMBNAIL_SIZE = int(os.environ.get("MEDIA_THUMBNAIL_SIZE", "360"))
+THUMBNAIL_WORKERS = int(os.environ.get("MEDIA_THUMBNAIL_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending: Dict[str, Future] = {}
+# 前回の wait_for_thumbnails 以降にワーカーで生成できなかったサムネイルの数
+_failures = 0
+
+
+def _shard_path(kind: str, sha256: str, ext: str) -> str:
+    return os.path.join(MEDIA_ROOT, kind, sha256[:2], sha256[2:4], sha256 + ext)
+
+
+def extension_for(content_type: str) -> str:
+    return _EXTENSIONS.get(content_type, ".bin")
+
+
+def original_path(sha256: str, content_type: str) -> str:
+    return _shard_path("originals", sha256, extension_for(content_type))
+
+
+def thumbnail_path(sha256: str) -> str:
+    return _shard_path("thumbs", sha256, ".jpg")
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def store_bytes(data: bytes, content_type: str) -> str:
+    """画像を保存してハッシュを返す。同じ内容が既にあれば書き込まない"""
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = original_path(sha256, content_type)
+    if not os.path.exists(path):
+        _atomic_write(path, data)
+    return sha256
+
+
+def generate_thumbnail(sha256: str, content_type: str) -> bool:
+    """サムネイルを生成する。読めない画像なら False"""
+    src = original_path(sha256, content_type)
+    dest = thumbnail_path(sha256)
+    if os.path.exists(dest):
+        return True
+    try:
+        with Image.open(src) as img:
+            # JPEG はデコード時に縮小させると大幅に速い
+            img.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            img = img.convert("RGB")
+            img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    img.save(f, "JPEG", quality=80, optimize=True)
+                os.replace(tmp_path, dest)
+            finally:
+                # 保存に失敗したときの書きかけを残さない (成功時は置き換え済み)
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+        return True
+    except (OSError, ValueError):
+        logger.warning("Could not generate thumbnail for %s", sha256, exc_info=True)
+        return False
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="xlm-thumb")
+        return _executor
+
+
+def _generate_in_worker(sha256: str, content_type: str) -> bool:
+    """ワーカーで生成する。失敗は結果を待つ側 (wait_for_thumbnails) が数えられるように記録する"""
+    global _failures
+    try:
+        ok = generate_thumbnail(sha256, content_type)
+    except Exception:
+        logger.exception("Thumbnail worker failed for %s", sha256)
+        ok = False
+    if not ok:
+        with _executor_lock:
+            _failures += 1
+    return ok
+
+
+def schedule_thumbnail(sha256: str, content_type: str) -> Future:
+    """サムネイル生成をワーカープールに投入する (同じハッシュの重複投入はまとめる)"""
+    executor = _get_executor()
+    with _executor_lock:
+        future = _pending.get(sha256)
+        if future is None:
+            future = _pending[sha256] = executor.submit(_generate_in_worker, sha256, content_type)
+            future.add_done_callback(lambda _f: _pending.pop(sha256, None))
+    return future
+
+
+def wait_for_thumbnails() -> int:
+    """
+    投入済みのサムネイル生成がすべて終わるまで待つ (CLI 終了前に呼ぶ)。
+    前回の呼び出し以降にワーカーで生成できなかった件数を返す
+    """
+    global _failures
+    with _executor_lock:
+        futures: List[Future] = list(_pending.values())
+    for future in futures:
+        future.result()
+    with _executor_lock:
+        failures, _failures = _failures, 0
+    return failures
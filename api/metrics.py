@@ -0,0 +1,256 @@
+# /api/metrics.py
+"""リクエスト/SQLの計測と Prometheus テキスト形式でのメトリクス出力"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# METRICS_ENABLED=0 で計測を完全に無効化する (ミドルウェアもイベントフックも登録されない)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() not in ("0", "false", "off", "no")
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """単調増加カウンタ"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(tuple(str(v) for v in labelvalues), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """累積バケット方式のヒストグラム"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [各バケットの件数..., +Inf の件数, 合計値]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(v) for v in labelvalues)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            slots = self._values.get(key)
+            if slots is None:
+                slots = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            slots[index] += 1
+            slots[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, slots in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), slots[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(slots[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+class Gauge:
+    """出力時に関数を呼んで現在値を得るゲージ"""
+
+    def __init__(self, name: str, documentation: str, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self.callback())}",
+        ]
+
+
+REQUEST_LATENCY = Histogram(
+    "xlm_http_request_duration_seconds", "HTTP request latency per endpoint.",
+    labelnames=("method", "endpoint", "status"),
+)
+REQUEST_QUERIES = Histogram(
+    "xlm_http_request_db_queries", "Number of SQL statements issued per HTTP request.",
+    labelnames=("endpoint",), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_QUERY_LATENCY = Histogram(
+    "xlm_db_query_duration_seconds", "SQL statement execution time.",
+    buckets=DEFAULT_QUERY_BUCKETS,
+)
+IMPORTS = Counter("xlm_imports_total", "MHTML imports by outcome.", labelnames=("status",))
+SCRAPES = Counter("xlm_scrapes_total", "Selenium scrapes by outcome.", labelnames=("result",))
+CACHE_LOOKUPS = Counter("xlm_cache_lookups_total", "In-process cache lookups.", labelnames=("cache", "result"))
+
+REGISTRY: List = [REQUEST_LATENCY, REQUEST_QUERIES, DB_QUERY_LATENCY, IMPORTS, SCRAPES, CACHE_LOOKUPS]
+
+
+def register(metric):
+    """他モジュールで定義したメトリクスを /metrics の出力に加える"""
+    REGISTRY.append(metric)
+    return metric
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache, "hit" if hit else "miss")
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- リクエスト単位の SQL 計測 ---
+
+class RequestStats:
+    __slots__ = ("path", "endpoint", "queries", "db_time")
+
+    def __init__(self, path: str = "", endpoint: str = ""):
+        self.path = path
+        self.endpoint = endpoint
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("xlm_current_request", default=None)
+
+
+def current_request() -> Optional[RequestStats]:
+    """実行中のリクエストの計測情報 (リクエスト外なら None)"""
+    return _current_request.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("xlm_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("xlm_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    DB_QUERY_LATENCY.observe(elapsed)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get("xlm_query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """エンジンに SQL 計測用のイベントフックを登録する"""
+    if not METRICS_ENABLED or event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    """エンドポイント毎のレイテンシを記録し、Server-Timing ヘッダーを付与する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(path=f"{scope['method']} {scope['path']}")
+        token = _current_request.set(stats)
+        start = time.perf_counter()
+        status_code = 500
+
+        def endpoint_label() -> str:
+            route = scope.get("route")
+            # 未マッチのパスはラベルの爆発を避けるためまとめる
+            return getattr(route, "path", None) or "unmatched"
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                stats.endpoint = endpoint_label()
+                app_ms = (time.perf_counter() - start) * 1000
+                timing = (
+                    f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries", '
+                    f"app;dur={app_ms:.2f}"
+                )
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = stats.endpoint or endpoint_label()
+            REQUEST_LATENCY.observe(time.perf_counter() - start, scope["method"], endpoint, str(status_code))
+            REQUEST_QUERIES.observe(stats.queries, endpoint)
+            _current_request.reset(token)
@@ -1,12 +1,16 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, DateTime, JSON, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Table, DateTime, JSON, Text, Index, Float, LargeBinary, SmallInteger
+import unicodedata
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from .database import Base
 
 # Association table for the many-to-many relationship between Post and Tag
 post_tag_association = Table('post_tag', Base.metadata,
     Column('post_id', Integer, ForeignKey('posts.id')),
-    Column('tag_id', Integer, ForeignKey('tags.id'))
+    Column('tag_id', Integer, ForeignKey('tags.id')),
+    # タグから投稿を引く (絞り込み) / 投稿からタグを引く (表示) の両方向
+    Index('ix_post_tag_tag_id_post_id', 'tag_id', 'post_id'),
+    Index('ix_post_tag_post_id', 'post_id'),
 )
 
 class Post(Base):
@@ -16,26 +20,82 @@ class Post(Base):
     url = Column(String, index=True, nullable=False)
     tweet_id = Column(String, unique=True, index=True, nullable=True)
     text = Column(Text, nullable=True) # Text型に変更
-    author_name = Column(String, nullable=True)
-    author_screen_name = Column(String, nullable=True)
-    author_avatar_url = Column(String, nullable=True)
+    # 著者は authors テーブルに正規化 (旧 author_name 等のカラムは移行後に空になる)
+    author_id = Column(Integer, ForeignKey("authors.id"), nullable=True)
     posted_at = Column(DateTime(timezone=True), nullable=True) # timezone=Trueを追加
     media_urls = Column(JSON, nullable=True) # JSON型に変更
     favorite_count = Column(Integer, default=0)
     
     folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now()) # timezone=Trueを追加
+    # 取り込んだ元の HTML (html_archive)。抽出処理を直したときに読み直す
+    raw_html_sha256 = Column(String(64), ForeignKey("archived_html.sha256"), nullable=True, index=True)
+    # 同じページから取り込んだスレッドの返信先と引用元
+    parent_post_id = Column(Integer, ForeignKey("posts.id"), nullable=True, index=True)
+    quoted_post_id = Column(Integer, ForeignKey("posts.id"), nullable=True, index=True)
 
     folder = relationship("Folder", back_populates="posts")
+    author = relationship("Author", back_populates="posts", lazy="joined")
     
     tags = relationship("Tag", secondary=post_tag_association, back_populates="posts")
+
+    # 一覧は posted_at 順なので、絞り込み条件 + posted_at の複合インデックスでソートを省く
+    __table_args__ = (
+        Index('ix_posts_posted_at_id', 'posted_at', 'id'),
+        Index('ix_posts_folder_id_posted_at', 'folder_id', 'posted_at'),
+        Index('ix_posts_author_id_posted_at', 'author_id', 'posted_at'),
+    )
+
+    # MHTML から取り出したローカル保存済みの画像
+    local_media = relationship("PostMedia", order_by="PostMedia.position", lazy="selectin",
+                               cascade="all, delete-orphan")
+
+    # API のレスポンス互換のため、著者の情報を投稿の属性としても読めるようにする
+    @property
+    def author_name(self):
+        return self.author.name if self.author else None
+
+    @property
+    def author_screen_name(self):
+        return self.author.screen_name if self.author else None
+
+    @property
+    def author_avatar_url(self):
+        return self.author.avatar_url if self.author else None
     
 
+class Author(Base):
+    __tablename__ = "authors"
+
+    id = Column(Integer, primary_key=True, index=True)
+    screen_name = Column(String, unique=True, index=True, nullable=False) # @ なし
+    name = Column(String, nullable=True)
+    avatar_url = Column(String, nullable=True)
+
+    posts = relationship("Post", back_populates="author")
+
+def normalize_tag_name(name: str) -> str:
+    """タグ検索用の正規化 (全角/半角の統一と大文字小文字の無視)"""
+    return unicodedata.normalize("NFKC", name).casefold()
+
 class Tag(Base):
     __tablename__ = "tags"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True, nullable=False)
+    name_norm = Column(String, index=True) # 前方一致サジェスト用
+    # 投稿数 (post_counts の 'tag:<id>' と同じ値を counters が更新する)。サジェストの並べ替えに使う
+    post_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # 入力が空のときの「投稿数の多い順」をインデックスの先頭から読むだけで返す
+    __table_args__ = (
+        Index('ix_tags_post_count_name_norm', post_count.desc(), name_norm),
+    )
+
+    @validates("name")
+    def _set_name_norm(self, key, value):
+        self.name_norm = normalize_tag_name(value) if value is not None else None
+        return value
 
     posts = relationship("Post", secondary=post_tag_association, back_populates="tags")
 
@@ -45,4 +105,97 @@ class Folder(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True, nullable=False)
 
-    posts = relationship("Post", back_populates="folder")
\ No newline at end of file
+    posts = relationship("Post", back_populates="folder")
+
+class MediaAsset(Base):
+    """ローカルストアに保存された画像 (SHA-256 で一意)"""
+    __tablename__ = "media_assets"
+
+    sha256 = Column(String(64), primary_key=True)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class PostMedia(Base):
+    __tablename__ = "post_media"
+
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey("posts.id"), index=True, nullable=False)
+    kind = Column(String, nullable=False) # 'photo' または 'avatar'
+    position = Column(Integer, nullable=False, default=0)
+    source_url = Column(String, nullable=False)
+    sha256 = Column(String(64), ForeignKey("media_assets.sha256"), nullable=False)
+
+    asset = relationship("MediaAsset")
+
+class ArchivedHtml(Base):
+    """圧縮して保存した取り込み元の HTML。本体は HTML_ARCHIVE_ROOT 以下に sha256 名で置く"""
+    __tablename__ = "archived_html"
+
+    sha256 = Column(String(64), primary_key=True)
+    codec = Column(String, nullable=False) # 'zstd' または 'gzip'
+    charset = Column(String, nullable=True)
+    size = Column(Integer, nullable=False)
+    compressed_size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ImportManifest(Base):
+    """CLI でインポートしたファイルの記録。変更のないファイルは再読込せずにスキップする"""
+    __tablename__ = "import_manifest"
+
+    path = Column(String, primary_key=True) # 絶対パス
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    content_hash = Column(String(64), index=True, nullable=False) # SHA-256
+    status = Column(String, nullable=False) # 'added' / 'skipped' / 'failed'
+    post_id = Column(Integer, ForeignKey("posts.id"), nullable=True)
+    imported_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class DataVersion(Base):
+    """書き込みのたびに増えるデータバージョン (id=1) とタグの付け外しで増えるバージョン (id=2)。キャッシュの失効判定に使う"""
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+class PostCount(Base):
+    """投稿件数カウンタ。scope は 'all' / 'folder:<id>' / 'tag:<id>' / 'author:<id>'"""
+    __tablename__ = "post_counts"
+
+    scope = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class PostDayCount(Base):
+    """日 (UTC) ごとの投稿件数。scope は PostCount と同じ。タイムラインはこれを月・年に足し上げて返す"""
+    __tablename__ = "post_day_counts"
+
+    scope = Column(String, primary_key=True)
+    day = Column(String(10), primary_key=True) # 'YYYY-MM-DD'
+    count = Column(Integer, nullable=False, default=0)
+
+class TagSuggestion(Base):
+    """タグの付いていない投稿に対する自動タグ付けの候補 (autotag のバッチ処理で作り直される)"""
+    __tablename__ = "tag_suggestions"
+
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id"), primary_key=True)
+    score = Column(Float, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    tag = relationship("Tag")
+
+class PostSignature(Base):
+    """近似重複検出用の MinHash 署名。本文もメディアもない投稿は signature が NULL"""
+    __tablename__ = "post_signatures"
+
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    signature = Column(LargeBinary, nullable=True) # uint32 x NUM_PERM
+    duplicate_of = Column(Integer, ForeignKey("posts.id"), nullable=True, index=True) # 登録時に見つかった近似重複 (古い投稿)
+
+class PostLshBucket(Base):
+    """MinHash 署名をバンドに分けたハッシュ。同じ (band, bucket) の投稿が重複候補になる"""
+    __tablename__ = "post_lsh_buckets"
+
+    band = Column(SmallInteger, primary_key=True)
+    bucket = Column(BigInteger, primary_key=True)
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
@@ -0,0 +1,110 @@
+# /api/page_cache.py
+"""投稿一覧のレスポンス (シリアライズ済み JSON) をデータバージョン付きで保持する LRU キャッシュ"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from . import metrics
+
+# 0 でキャッシュを無効化する
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RANDOM_ID_CACHE_MAX_BYTES = int(os.environ.get("RANDOM_ID_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+class PageCache:
+    """
+    キーには必ずデータバージョンを含める。新しいバージョンを見たら古いエントリは捨てるので、
+    書き込み後に古いページを返すことはない。上限はエントリのバイト数の合計で管理する
+    """
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, Optional[int]]]" = OrderedDict()
+        self._bytes = 0
+        self._version = -1
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _entry_size(key: Hashable, body: bytes) -> int:
+        return len(body) + sys.getsizeof(key) + 64
+
+    def _clear_locked(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def get(self, key: Hashable, version: int) -> Optional[Tuple[bytes, Optional[int]]]:
+        with self._lock:
+            entry = self._entries.get((key, version)) if version == self._version else None
+            if entry is not None:
+                self._entries.move_to_end((key, version))
+                self._hits += 1
+            else:
+                self._misses += 1
+        metrics.record_cache_lookup(self.name, entry is not None)
+        return entry
+
+    def put(self, key: Hashable, version: int, body: bytes, total: Optional[int] = None) -> None:
+        size = self._entry_size(key, body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if version < self._version:
+                return
+            if version > self._version:
+                # 書き込みがあったので以前のバージョンのページはすべて不要
+                self._clear_locked()
+                self._version = version
+            previous = self._entries.pop((key, version), None)
+            if previous is not None:
+                self._bytes -= self._entry_size(key, previous[0])
+            self._entries[(key, version)] = (body, total)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                (old_key, _v), (old_body, _t) = self._entries.popitem(last=False)
+                self._bytes -= self._entry_size(old_key, old_body)
+
+    def clear(self) -> None:
+        """すべて捨て、どのバージョンでも受け付ける状態に戻す (DB を作り直したときなど)"""
+        with self._lock:
+            self._clear_locked()
+            self._version = -1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "version": self._version,
+            }
+
+
+post_list_cache = PageCache("post_list", PAGE_CACHE_MAX_BYTES)
+# ランダム表示で絞り込み条件に合う投稿 id の配列 (int64 のバイト列) を持つ
+random_id_cache = PageCache("random_ids", RANDOM_ID_CACHE_MAX_BYTES)
+
+metrics.register(metrics.Gauge(
+    "xlm_post_list_cache_bytes", "Bytes held by the post list page cache.",
+    lambda: post_list_cache.stats()["bytes"],
+))
+metrics.register(metrics.Gauge(
+    "xlm_post_list_cache_entries", "Entries held by the post list page cache.",
+    lambda: post_list_cache.stats()["entries"],
+))
+metrics.register(metrics.Gauge(
+    "xlm_post_list_cache_hit_ratio", "Hit ratio of the post list page cache since startup.",
+    lambda: post_list_cache.stats()["hit_ratio"],
+))
@@ -0,0 +1,192 @@
+# /api/related.py
+"""タグの重なりから似た投稿を探す。post_tag から作った投稿 × タグの対応をプロセス内に保持する"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, counters, metrics
+
+# 投稿ごとに保持する近傍の件数 (エンドポイントの limit の上限)
+RELATED_MAX = 50
+
+_post_tag = models.post_tag_association
+
+
+class RelatedIndex:
+    """
+    投稿ごとのタグ (行) とタグごとの投稿 (列) を保持し、タグの変更はその投稿の行と変わったタグの列だけを書き換える。
+    類似度はタグの希少度 (IDF) で重み付けした Jaccard 係数:
+        sum(w[共通タグ]) / sum(w[どちらかのタグ])
+    w[t] = log((1 + N) / (1 + df[t])) + 1 を base[t] = 1 - log(1 + df[t]) と log(1 + N) に分け、
+    投稿ごとに base の合計とタグ数を持つ。N (タグのある投稿数) が変わっても書き換えは要らず、
+    df[t] が変わったときは t の付いた投稿の合計だけを直せばよい
+    """
+
+    def __init__(self, post_col: np.ndarray, tag_col: np.ndarray, version: int):
+        self.version = version
+        # (投稿, タグ) の重複を 1 次元のキーで除く (axis=0 の unique より速い)
+        stride = int(tag_col.max()) + 1 if len(tag_col) else 1
+        keys = np.unique(post_col.astype(np.int64) * stride + tag_col)
+        pairs = np.stack([keys // stride, keys % stride], axis=1)
+        post_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+        self._size = len(post_ids)
+        self._post_ids = post_ids.astype(np.int64)
+        self._row_of = {int(post_id): i for i, post_id in enumerate(post_ids)}
+        # pairs は (投稿, タグ) 順に並んでいるので、投稿ごとのタグはそのまま切り分けられる
+        self._tags_of: List[np.ndarray] = np.split(pairs[:, 1], np.flatnonzero(np.diff(rows)) + 1) if len(rows) else []
+        by_tag = np.lexsort((rows, pairs[:, 1]))
+        tag_ids, starts, document_frequency = np.unique(pairs[by_tag, 1], return_index=True, return_counts=True)
+        self._rows_of: Dict[int, np.ndarray] = {
+            int(tag_id): col for tag_id, col in zip(tag_ids, np.split(rows[by_tag], starts[1:]))
+        }
+        base = 1.0 - np.log1p(document_frequency)
+        self._base_sum = np.bincount(rows, weights=base[np.searchsorted(tag_ids, pairs[:, 1])], minlength=self._size)
+        self._tag_count = np.bincount(rows, minlength=self._size).astype(np.int64)
+        self._tagged = self._size
+        # 行番号 -> 近傍リスト
+        self._neighbours: Dict[int, List[Tuple[int, float]]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_db(cls, db: Session) -> "RelatedIndex":
+        version = counters.get_tag_version(db)
+        rows = db.execute(select(_post_tag.c.post_id, _post_tag.c.tag_id)).all()
+        pairs = np.array([tuple(row) for row in rows], dtype=np.int64).reshape(-1, 2)
+        return cls(pairs[:, 0], pairs[:, 1], version)
+
+    def _base(self, tag_id: int) -> float:
+        col = self._rows_of.get(tag_id)
+        return 1.0 - np.log1p(len(col)) if col is not None else 0.0
+
+    def _append(self, post_id: int) -> int:
+        row = self._size
+        if row == len(self._post_ids):
+            capacity = max(16, row * 2)
+            self._post_ids = np.resize(self._post_ids, capacity)
+            self._base_sum = np.resize(self._base_sum, capacity)
+            self._tag_count = np.resize(self._tag_count, capacity)
+        self._post_ids[row] = post_id
+        self._base_sum[row] = 0.0
+        self._tag_count[row] = 0
+        self._tags_of.append(np.empty(0, dtype=np.int64))
+        self._row_of[post_id] = row
+        self._size += 1
+        return row
+
+    def _move(self, tag_id: int, row: int, add: bool) -> np.ndarray:
+        """タグ t の列に row を出し入れし、df[t] が変わった分だけ t の付いた投稿の base の合計を直す"""
+        col = self._rows_of.get(tag_id, np.empty(0, dtype=np.int64))
+        before = self._base(tag_id)
+        if add:
+            col = np.insert(col, np.searchsorted(col, row), row)
+        else:
+            col = col[col != row]
+        if len(col):
+            self._rows_of[tag_id] = col
+        else:
+            self._rows_of.pop(tag_id, None)
+        after = self._base(tag_id)
+        others = col[col != row]
+        self._base_sum[others] += after - before
+        self._base_sum[row] += after if add else -before
+        return others
+
+    def set_post_tags(self, post_id: int, tag_ids: Iterable[int], version: int) -> None:
+        """
+        1 投稿分のタグを置き換える (DB は読まない)。
+        近傍リストを捨てるのは、その投稿と古い・新しいタグのどれかを共有する投稿だけ。
+        それ以外の投稿はこの投稿と共通タグがないので候補は変わらず、IDF のわずかなずれだけを許す
+        """
+        new = np.array(sorted(set(tag_ids)), dtype=np.int64)
+        with self._lock:
+            row = self._row_of.get(post_id)
+            if row is None:
+                if not len(new):
+                    self.version = version
+                    return
+                row = self._append(post_id)
+            old = self._tags_of[row]
+            touched = [np.array([row], dtype=np.int64)]
+            touched.extend(self._move(int(t), row, add=False) for t in np.setdiff1d(old, new))
+            touched.extend(self._move(int(t), row, add=True) for t in np.setdiff1d(new, old))
+            touched.extend(self._rows_of[int(t)] for t in np.intersect1d(old, new))
+            self._tagged += (len(new) > 0) - (len(old) > 0)
+            self._tags_of[row] = new
+            self._tag_count[row] = len(new)
+
+            if self._neighbours:
+                cached = np.fromiter(self._neighbours, dtype=np.int64, count=len(self._neighbours))
+                for stale in cached[np.isin(cached, np.concatenate(touched))]:
+                    del self._neighbours[int(stale)]
+            self.version = version
+
+    def _compute(self, row: int) -> List[Tuple[int, float]]:
+        tags = self._tags_of[row]
+        if not len(tags):
+            return []
+        cols = [self._rows_of[int(t)] for t in tags]
+        bases = np.repeat([self._base(int(t)) for t in tags], [len(col) for col in cols])
+        candidates, inverse = np.unique(np.concatenate(cols), return_inverse=True)
+        shared_base = np.bincount(inverse, weights=bases)
+        shared_count = np.bincount(inverse)
+        mask = candidates != row
+        candidates, shared_base, shared_count = candidates[mask], shared_base[mask], shared_count[mask]
+        if len(candidates) == 0:
+            return []
+        offset = np.log1p(self._tagged)
+        intersection = shared_base + shared_count * offset
+        row_weight = self._base_sum[row] + self._tag_count[row] * offset
+        union = row_weight + self._base_sum[candidates] + self._tag_count[candidates] * offset - intersection
+        # 差分更新した合計の丸め誤差で同点の順序が変わらないようにそろえる
+        scores = np.round(intersection / union, 12)
+        if len(scores) > RELATED_MAX:
+            # 境界と同点の候補も残し、どれを採るかは下の並べ替えで決める
+            cutoff = np.partition(scores, len(scores) - RELATED_MAX)[len(scores) - RELATED_MAX]
+            top = np.flatnonzero(scores >= cutoff)
+        else:
+            top = np.arange(len(scores))
+        # 同点なら新しい (id の大きい) 投稿を先にする
+        post_ids, top_scores = self._post_ids[candidates[top]], scores[top]
+        order = np.lexsort((-post_ids, -top_scores))[:RELATED_MAX]
+        return [(int(post_ids[i]), float(top_scores[i])) for i in order]
+
+    def related(self, post_id: int, limit: int) -> List[Tuple[int, float]]:
+        with self._lock:
+            row = self._row_of.get(post_id)
+            if row is None:
+                return []
+            cached = self._neighbours.get(row)
+            metrics.record_cache_lookup("related_posts", cached is not None)
+            if cached is None:
+                cached = self._neighbours[row] = self._compute(row)
+        return cached[:limit]
+
+
+_index: Optional[RelatedIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_related(db: Session, post_id: int, limit: int = 10) -> List[Tuple[int, float]]:
+    """(投稿 id, スコア) をスコアの高い順に返す。タグの付け外しが他のプロセスで行われていれば索引を作り直す"""
+    global _index
+    version = counters.get_tag_version(db)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = RelatedIndex.from_db(db)
+            index = _index
+    return index.related(post_id, min(limit, RELATED_MAX))
+
+
+def record_post_tags(post_id: int, tag_ids: Iterable[int], version: int) -> None:
+    """
+    コミット済みのタグ変更 (version はコミット後のタグのバージョン) を索引に反映する。
+    索引が直前のバージョンのものでなければ (他の書き込みが挟まった)、次の参照時の再構築に任せる
+    """
+    with _index_lock:
+        if _index is not None and _index.version == version - 1:
+            _index.set_post_tags(post_id, tag_ids, version)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, field_validator
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime # datetimeを追加
 
 # --- Tag Schemas ---
@@ -14,6 +14,9 @@ class Tag(TagBase):
     
     model_config = {"from_attributes": True}
 
+class TagWithCount(Tag):
+    post_count: int = 0
+
 class TagsUpdate(BaseModel):
     tags: List[str]
 
@@ -29,6 +32,27 @@ class Folder(FolderBase):
     
     model_config = {"from_attributes": True}
 
+# --- Author Schemas ---
+class Author(BaseModel):
+    id: int
+    screen_name: str
+    name: Optional[str] = None
+    avatar_url: Optional[str] = None
+
+    model_config = {"from_attributes": True}
+
+class AuthorWithCount(Author):
+    post_count: int = 0
+
+# --- Media Schemas ---
+class PostMedia(BaseModel):
+    kind: str
+    position: int
+    source_url: str
+    sha256: str
+
+    model_config = {"from_attributes": True}
+
 # --- Post Schemas ---
 class PostBase(BaseModel):
     url: str
@@ -53,14 +77,71 @@ class PostCreate(PostBase):
 
 class Post(PostBase):
     id: int
+    author_id: Optional[int] = None
+    parent_post_id: Optional[int] = None # 返信先
+    quoted_post_id: Optional[int] = None # 引用元
     created_at: datetime # created_atを追加
 
     # Use the nested schemas for reading
     folder: Optional[Folder] = None
     tags: List[Tag] = []
+    local_media: List[PostMedia] = []
 
     model_config = {"from_attributes": True}
 
+class RelatedPost(BaseModel):
+    """似た投稿とその類似度 (0〜1)"""
+    score: float
+    post: Post
+
+class DuplicateCluster(BaseModel):
+    """近似重複とみなされた投稿のまとまり (古い順)"""
+    size: int
+    posts: List[Post] = []
+
+class HistogramBucket(BaseModel):
+    period: str # 'YYYY-MM-DD' / 'YYYY-MM' / 'YYYY' (UTC)
+    count: int
+
+class Bootstrap(BaseModel):
+    """初回表示に必要な一覧の先頭ページ・投稿数付きのタグ・フォルダをまとめたもの"""
+    version: int
+    posts: List[Post] = []
+    total: int = 0
+    tags: List[TagWithCount] = []
+    folders: List[Folder] = []
+
+class PostBatch(BaseModel):
+    """id 指定でまとめて取得した投稿と、見つからなかった id"""
+    posts: Dict[int, Post] = {}
+    missing: List[int] = []
+
+# --- Tag Suggestion Schemas ---
+class TagScore(BaseModel):
+    tag: Tag
+    score: float
+
+class PostTagSuggestions(BaseModel):
+    """タグのない投稿と、そのタグ候補 (スコアの高い順)"""
+    post: Post
+    suggestions: List[TagScore] = []
+
+class TagSuggestionAccept(BaseModel):
+    post_ids: List[int]
+    min_score: float = 0.0
+
+# --- Filter Schemas ---
+class PostFilter(BaseModel):
+    """一覧・件数で共通に使う絞り込み条件"""
+    folder_id: Optional[int] = None
+    tag_names: List[str] = []
+    author: Optional[str] = None # screen_name (@ なし)
+    posted_from: Optional[datetime] = None
+    posted_to: Optional[datetime] = None
+
+    def cache_key(self) -> tuple:
+        return (self.folder_id, tuple(sorted(set(self.tag_names))), self.author, self.posted_from, self.posted_to)
+
 # For displaying lists of folders with their posts
 class FolderWithPosts(Folder):
     posts: List[Post] = []
\ No newline at end of file
@@ -0,0 +1,174 @@
+# /api/slowlog.py
+"""閾値を超えた SQL を記録し、実行計画 (EXPLAIN) をバックグラウンドで取得するスロークエリログ"""
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("xlm.slowlog")
+
+# SLOW_QUERY_MS 以上かかった文を記録する (0 以下で無効)
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", "100"))
+# パラメータ (投稿本文などの値) の記録と /api/debug/slow_queries は SLOW_QUERY_DEBUG=1 のときだけ有効
+SLOW_QUERY_DEBUG = os.environ.get("SLOW_QUERY_DEBUG", "0").lower() in ("1", "true", "on", "yes")
+
+# EXPLAIN 用の接続に付けるオプション。自分自身の EXPLAIN を再び記録しないために使う
+_SKIP_OPTION = "xlm_skip_slowlog"
+# 記録の対象にする呼び出し元 (プロジェクトルートからの相対パス)。ここを通らない文は記録しない
+_CALLER_FILES = (os.path.join("api", "crud.py"), os.path.join("scripts", "import_mhtml.py"))
+_EXPLAINABLE = ("select", "with", "update", "delete", "insert")
+_MAX_PARAM_REPR = 500
+
+_entries: deque = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_lock = threading.Lock()
+_explain_executor: Optional[ThreadPoolExecutor] = None
+# 実行中のリクエストの ASGI scope (RequestContextMiddleware が設定する)
+_current_scope: ContextVar[Optional[dict]] = ContextVar("xlm_slowlog_scope", default=None)
+
+
+class RequestContextMiddleware:
+    """
+    実行中のリクエストを覚えておき、スロークエリにエンドポイントを付けるための ASGI ミドルウェア。
+    METRICS_ENABLED に関係なく登録する
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_scope.reset(token)
+
+
+def _source_label() -> str:
+    """スロークエリを発生させたエンドポイント (リクエスト外ならスクリプト名)"""
+    scope = _current_scope.get()
+    if scope is not None:
+        # ルーティング後はパスのテンプレート (/api/posts/{post_id}) を使う
+        route = getattr(scope.get("route"), "path", None)
+        return f"{scope['method']} {route or scope['path']}"
+    return "script:" + os.path.basename(sys.argv[0] or "python")
+
+
+def _caller_frame() -> Optional[str]:
+    """api/crud.py / scripts/import_mhtml.py の中で文を発行した位置を探す。見つからなければ None"""
+    for frame in reversed(traceback.extract_stack(limit=60)):
+        if frame.filename and frame.filename.endswith(_CALLER_FILES):
+            return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+    return None
+
+
+def _truncate(value) -> str:
+    text = repr(value)
+    return text if len(text) <= _MAX_PARAM_REPR else text[:_MAX_PARAM_REPR] + "..."
+
+
+def _explain(engine: Engine, entry: Dict, statement: str, parameters) -> None:
+    if engine.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+    try:
+        with engine.connect().execution_options(**{_SKIP_OPTION: True}) as conn:
+            rows = conn.exec_driver_sql(prefix + statement, parameters or ()).fetchall()
+            conn.rollback()
+        if engine.dialect.name == "sqlite":
+            # (id, parent, notused, detail)
+            plan = [str(row[-1]) for row in rows]
+        else:
+            plan = [str(row[0]) for row in rows]
+        with _lock:
+            entry["plan"] = plan
+    except Exception as e:
+        with _lock:
+            entry["plan_error"] = str(e)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("xlm_slowlog_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("xlm_slowlog_start")
+    if not starts:
+        return
+    elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+    if elapsed_ms < SLOW_QUERY_MS or conn.get_execution_options().get(_SKIP_OPTION):
+        return
+    caller = _caller_frame()
+    if caller is None:
+        return
+
+    entry = {
+        "logged_at": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": round(elapsed_ms, 2),
+        "statement": statement,
+        "parameters": _truncate(parameters) if SLOW_QUERY_DEBUG else None,
+        "executemany": executemany,
+        "endpoint": _source_label(),
+        "caller": caller,
+        "plan": None,
+    }
+    with _lock:
+        _entries.append(entry)
+    logger.warning(
+        "Slow query (%.1f ms) from %s [%s]: %s%s",
+        elapsed_ms, entry["endpoint"], caller, statement,
+        f" -- params={entry['parameters']}" if SLOW_QUERY_DEBUG else "",
+    )
+
+    if _explain_executor is not None and not executemany and statement.lstrip().lower().startswith(_EXPLAINABLE):
+        try:
+            _explain_executor.submit(_explain, conn.engine, entry, statement, parameters)
+        except RuntimeError as e:
+            # 終了処理でプールが閉じた後。実行計画は諦め、元のクエリは失敗させない
+            with _lock:
+                entry["plan_error"] = str(e)
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    starts = conn.info.get("xlm_slowlog_start") if conn is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """エンジンにスロークエリ検出用のイベントフックを登録する"""
+    global _explain_executor
+    if SLOW_QUERY_MS <= 0 or event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    if _explain_executor is None:
+        _explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="xlm-explain")
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def recent_entries(limit: int = SLOW_QUERY_LOG_SIZE) -> List[Dict]:
+    """新しい順にスロークエリを返す"""
+    with _lock:
+        items = [dict(e) for e in reversed(_entries)]
+    return items[:limit]
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import type { Post, PostCreate, Tag } from './types'
+import type { Author, Bootstrap, HistogramBucket, Post, PostBatch, PostCreate, RelatedPost, Tag, TagWithCount } from './types'
 
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000/api';
 
@@ -10,12 +10,22 @@ const apiClient = axios.create({
   },
 });
 
+// ローカル保存した画像のURL (thumb=true でサムネイル)
+export const getMediaUrl = (sha256: string, thumb: boolean = false): string =>
+  `${API_BASE_URL}/media/${sha256}${thumb ? '/thumb' : ''}`;
+
+// 一覧の開始位置 (ISO形式の日時)。before より前 / after より後の投稿から取得する
+export interface PostAnchor {
+  before?: string;
+  after?: string;
+}
+
 /**
  * 投稿を取得する (AND検索対応)
  * @param tagNames カンマ区切りのタグ名文字列 (例: "javascript,react")
  */
-export const getPosts = async (tagNames?: string, skip: number = 0, limit: number = 10, sortOrder: 'asc' | 'desc' = 'desc'): Promise<Post[]> => {
-  const params: { tag_names?: string, skip: number, limit: number, sort_order: 'asc' | 'desc' } = { skip, limit, sort_order: sortOrder }; 
+export const getPosts = async (tagNames?: string, skip: number = 0, limit: number = 10, sortOrder: 'asc' | 'desc' = 'desc', anchor: PostAnchor = {}): Promise<Post[]> => {
+  const params: { tag_names?: string, skip: number, limit: number, sort_order: 'asc' | 'desc' } & PostAnchor = { skip, limit, sort_order: sortOrder, ...anchor }; 
   
   if (tagNames) {
     params.tag_names = tagNames;
@@ -25,6 +35,57 @@ export const getPosts = async (tagNames?: string, skip: number = 0, limit: numbe
   return response.data;
 };
 
+/**
+ * 投稿と総件数を取得する (総件数はレスポンスヘッダー X-Total-Count から読む)
+ */
+export const getPostsWithTotal = async (tagNames?: string, skip: number = 0, limit: number = 10, sortOrder: 'asc' | 'desc' = 'desc', anchor: PostAnchor = {}): Promise<{ posts: Post[], total: number | null }> => {
+  const params: { tag_names?: string, skip: number, limit: number, sort_order: 'asc' | 'desc', with_total: boolean } & PostAnchor = { skip, limit, sort_order: sortOrder, with_total: true, ...anchor };
+
+  if (tagNames) {
+    params.tag_names = tagNames;
+  }
+
+  const response = await apiClient.get<Post[]>('/posts/', { params });
+  const totalHeader = response.headers['x-total-count'];
+  return { posts: response.data, total: totalHeader !== undefined ? Number(totalHeader) : null };
+};
+
+/**
+ * 一覧の先頭ページ (総件数付き)・タグ・フォルダを1回のリクエストで取得する。
+ * ETag 付きなので、データが変わっていなければブラウザのキャッシュが使われる (304)
+ */
+export const getBootstrap = async (tagNames?: string, limit: number = 10, sortOrder: 'asc' | 'desc' = 'desc', anchor: PostAnchor = {}): Promise<Bootstrap> => {
+  const params: { tag_names?: string, limit: number, sort_order: 'asc' | 'desc' } & PostAnchor = { limit, sort_order: sortOrder, ...anchor };
+  if (tagNames) {
+    params.tag_names = tagNames;
+  }
+  const response = await apiClient.get<Bootstrap>('/bootstrap', { params });
+  return response.data;
+};
+
+// 期間 (UTC の日・月・年) ごとの投稿数を古い順に取得する
+export const getPostsHistogram = async (granularity: 'day' | 'month' | 'year' = 'month', tagNames?: string): Promise<HistogramBucket[]> => {
+  const params: { granularity: string, tag_names?: string } = { granularity };
+  if (tagNames) {
+    params.tag_names = tagNames;
+  }
+  const response = await apiClient.get<HistogramBucket[]>('/posts/histogram', { params });
+  return response.data;
+};
+
+// 条件に合う投稿を k 件ランダムに取得する (seed を渡すと同じ結果になる)
+export const getRandomPosts = async (k: number = 10, tagNames?: string, seed?: number): Promise<Post[]> => {
+  const params: { k: number, tag_names?: string, seed?: number } = { k };
+  if (tagNames) {
+    params.tag_names = tagNames;
+  }
+  if (seed !== undefined) {
+    params.seed = seed;
+  }
+  const response = await apiClient.get<Post[]>('/posts/random', { params });
+  return response.data;
+};
+
 // 投稿を作成する
 export const createPost = async (postData: PostCreate): Promise<Post> => {
   const response = await apiClient.post<Post>('/posts/', postData);
@@ -37,6 +98,18 @@ export const getTags = async (): Promise<Tag[]> => {
   return response.data;
 };
 
+// 入力途中の文字列に前方一致するタグを投稿数の多い順に取得する
+export const suggestTags = async (prefix: string, limit: number = 10): Promise<TagWithCount[]> => {
+  const response = await apiClient.get<TagWithCount[]>('/tags/suggest', { params: { prefix, limit } });
+  return response.data;
+};
+
+// 著者を投稿数の多い順に取得する
+export const getAuthors = async (skip: number = 0, limit: number = 100): Promise<Author[]> => {
+  const response = await apiClient.get<Author[]>('/authors', { params: { skip, limit } });
+  return response.data;
+};
+
 // 他にも、タグやフォルダを取得/作成する関数をここに追加していく
 
 // IDで単一の投稿を取得する
@@ -45,6 +118,18 @@ export const getPost = async (postId: number): Promise<Post> => {
   return response.data;
 };
 
+// 複数の投稿を1回のリクエストでまとめて取得する (最大100件)
+export const getPostsBatch = async (postIds: number[]): Promise<PostBatch> => {
+  const response = await apiClient.get<PostBatch>('/posts/batch', { params: { ids: postIds.join(',') } });
+  return response.data;
+};
+
+// タグの重なりが大きい投稿を取得する
+export const getRelatedPosts = async (postId: number, limit: number = 10): Promise<RelatedPost[]> => {
+  const response = await apiClient.get<RelatedPost[]>(`/posts/${postId}/related`, { params: { limit } });
+  return response.data;
+};
+
 // 投稿のタグを更新する
 export const updatePostTags = async (postId: number, tags: string[]): Promise<Post> => {
   const response = await apiClient.put<Post>(`/posts/${postId}/tags`, { tags });
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
-import type { Post, Tag } from '../types';
-import { getTags, updatePostTags } from '../api';
+import type { Post, TagWithCount } from '../types';
+import { suggestTags, updatePostTags } from '../api';
 import './TagEditor.css';
 
 interface TagEditorProps {
@@ -10,23 +10,27 @@ interface TagEditorProps {
 
 const TagEditor: React.FC<TagEditorProps> = ({ post, onTagsUpdate }) => {
   const [currentTags, setCurrentTags] = useState<string[]>(() => post.tags.map(t => t.name));
-  const [allTags, setAllTags] = useState<Tag[]>([]);
+  const [candidateTags, setCandidateTags] = useState<TagWithCount[]>([]);
   const [newTagInput, setNewTagInput] = useState('');
   const [isSaving, setIsSaving] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
-  // 全タグリストを取得
+  // 入力中の文字列に前方一致するタグを取得 (入力が止まってから問い合わせる)
   useEffect(() => {
-    const fetchAllTags = async () => {
+    let cancelled = false;
+    const timer = setTimeout(async () => {
       try {
-        const fetchedTags = await getTags();
-        setAllTags(fetchedTags);
+        const fetchedTags = await suggestTags(newTagInput.trim(), 20);
+        if (!cancelled) setCandidateTags(fetchedTags);
       } catch (err) {
-        console.error("Failed to fetch all tags", err);
+        console.error("Failed to fetch tag suggestions", err);
       }
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
     };
-    fetchAllTags();
-  }, []);
+  }, [newTagInput]);
   
   // 編集中のタグを削除
   const handleRemoveTag = (tagToRemove: string) => {
@@ -65,7 +69,7 @@ const TagEditor: React.FC<TagEditorProps> = ({ post, onTagsUpdate }) => {
   };
   
   // サジェストするタグのリスト（現在設定されていないもの）
-  const suggestedTags = allTags.filter(tag => !currentTags.includes(tag.name));
+  const suggestedTags = candidateTags.filter(tag => !currentTags.includes(tag.name));
 
   return (
     <div className="tag-editor">
@@ -104,7 +108,7 @@ const TagEditor: React.FC<TagEditorProps> = ({ post, onTagsUpdate }) => {
             <div className="tag-suggestion-list">
                 {suggestedTags.map(tag => (
                     <button key={tag.id} onClick={() => handleAddSuggestedTag(tag.name)} className="suggested-tag-btn">
-                        + {tag.name}
+                        + {tag.name} ({tag.post_count})
                     </button>
                 ))}
             </div>
@@ -1,6 +1,7 @@
 import React from 'react';
 import { Link } from 'react-router-dom';
 import type { Post } from '../types';
+import { getMediaUrl } from '../api';
 import './TweetCard.css';
 
 const stopPropagation = (e: React.MouseEvent) => {
@@ -31,11 +32,16 @@ interface TweetCardProps {
   pageContext?: string; // 追加
   onCardClick?: (postId: number, url: string) => void; // 追加
   onTagClick?: (tagName: string) => void;
+  useThumbnails?: boolean; // 一覧表示ではローカルのサムネイルを使う
 }
 
-const TweetCard: React.FC<TweetCardProps> = ({ post, onTagClick }) => {
+const TweetCard: React.FC<TweetCardProps> = ({ post, onTagClick, useThumbnails = false }) => {
   // media_urls が配列であることを明示的に判定
   const mediaUrls = Array.isArray(post.media_urls) ? post.media_urls : [];
+  const localMedia = post.local_media || [];
+  const localPhotos = new Map(localMedia.filter(m => m.kind === 'photo').map(m => [m.position, m.sha256]));
+  const localAvatar = localMedia.find(m => m.kind === 'avatar');
+  const avatarUrl = localAvatar ? getMediaUrl(localAvatar.sha256, true) : post.author_avatar_url;
   const hasMedia = mediaUrls.length > 0;
   const mediaCount = mediaUrls.length;
 
@@ -53,8 +59,8 @@ const TweetCard: React.FC<TweetCardProps> = ({ post, onTagClick }) => {
     <Link to={`/posts/${post.id}`} className="tweet-card-link">
       <div className="tweet-card">
         <div className="tweet-header">
-          {post.author_avatar_url && (
-            <img src={post.author_avatar_url} alt={`${post.author_name}'s avatar`} className="tweet-avatar" />
+          {avatarUrl && (
+            <img src={avatarUrl} alt={`${post.author_name}'s avatar`} className="tweet-avatar" />
           )}
           <div className="tweet-author">
             <span className="author-name">{post.author_name || 'Unknown Author'}</span>
@@ -73,18 +79,25 @@ const TweetCard: React.FC<TweetCardProps> = ({ post, onTagClick }) => {
 
         {hasMedia ? (
           <div className={imageGridClass}>
-            {mediaUrls.map((url: string, index: number) => (
-              <div key={index} className="image-container">
-                <a href={url} target="_blank" rel="noopener noreferrer" onClick={stopPropagation}>
-                  <img 
-                    src={url} 
-                    alt={`Tweet media ${index + 1}`} 
-                    className="tweet-image" 
-                    style={mediaCount === 1 ? { objectFit: 'contain', backgroundColor: '#f0f2f5' } : {}}
-                  />
-                </a>
-              </div>
-            ))}
+            {mediaUrls.map((url: string, index: number) => {
+              // ローカルに保存済みならそれを使い、なければ元のURLを直接参照する
+              const sha256 = localPhotos.get(index);
+              const fullUrl = sha256 ? getMediaUrl(sha256) : url;
+              const displayUrl = sha256 ? getMediaUrl(sha256, useThumbnails) : url;
+              return (
+                <div key={index} className="image-container">
+                  <a href={fullUrl} target="_blank" rel="noopener noreferrer" onClick={stopPropagation}>
+                    <img 
+                      src={displayUrl} 
+                      loading="lazy"
+                      alt={`Tweet media ${index + 1}`} 
+                      className="tweet-image" 
+                      style={mediaCount === 1 ? { objectFit: 'contain', backgroundColor: '#f0f2f5' } : {}}
+                    />
+                  </a>
+                </div>
+              );
+            })}
           </div>
         ) : (
           post.embed_html && (
@@ -1,7 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useParams } from 'react-router-dom';
-import type { Post } from '../types';
-import { getPost } from '../api';
+import type { Post, RelatedPost } from '../types';
+import { getPost, getPostsBatch, getRelatedPosts } from '../api';
 import TweetCard from '../components/TweetCard';
 import TagEditor from '../components/TagEditor'; // 作成したコンポーネントをインポート
 
@@ -10,6 +10,9 @@ function PostDetailPage() {
   const [post, setPost] = useState<Post | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [relatedPosts, setRelatedPosts] = useState<RelatedPost[]>([]);
+  const [parentPost, setParentPost] = useState<Post | null>(null);
+  const [quotedPost, setQuotedPost] = useState<Post | null>(null);
 
   useEffect(() => {
     if (!postId) return;
@@ -31,6 +34,29 @@ function PostDetailPage() {
     fetchPost();
   }, [postId]);
 
+  // 似た投稿 (タグが変わったら取り直す)
+  useEffect(() => {
+    if (!post) return;
+    getRelatedPosts(post.id, 6)
+      .then(setRelatedPosts)
+      .catch(err => console.error("Failed to fetch related posts", err));
+  }, [post]);
+
+  // 返信先・引用元 (同じページから取り込まれていれば1回のリクエストでまとめて取得)
+  useEffect(() => {
+    setParentPost(null);
+    setQuotedPost(null);
+    if (!post) return;
+    const ids = [post.parent_post_id, post.quoted_post_id].filter((id): id is number => id != null);
+    if (ids.length === 0) return;
+    getPostsBatch(ids)
+      .then(batch => {
+        setParentPost(post.parent_post_id != null ? batch.posts[post.parent_post_id] ?? null : null);
+        setQuotedPost(post.quoted_post_id != null ? batch.posts[post.quoted_post_id] ?? null : null);
+      })
+      .catch(err => console.error("Failed to fetch thread posts", err));
+  }, [post?.id, post?.parent_post_id, post?.quoted_post_id]);
+
   // TagEditorからのコールバックでPostのStateを更新する
   const handleTagsUpdate = (updatedPost: Post) => {
     setPost(updatedPost);
@@ -50,9 +76,29 @@ function PostDetailPage() {
 
   return (
     <div className="post-detail-page">
+      {parentPost && (
+        <div className="thread-parent">
+          <h3>返信先</h3>
+          <TweetCard post={parentPost} useThumbnails />
+        </div>
+      )}
       <TweetCard post={post} />
+      {quotedPost && (
+        <div className="quoted-post">
+          <h3>引用元</h3>
+          <TweetCard post={quotedPost} useThumbnails />
+        </div>
+      )}
       <hr style={{ margin: '2rem 0' }} />
       <TagEditor post={post} onTagsUpdate={handleTagsUpdate} />
+      {relatedPosts.length > 0 && (
+        <div className="related-posts">
+          <h3>Related Posts</h3>
+          {relatedPosts.map(({ post: relatedPost }) => (
+            <TweetCard key={relatedPost.id} post={relatedPost} useThumbnails />
+          ))}
+        </div>
+      )}
     </div>
   );
 }
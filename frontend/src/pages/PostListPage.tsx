@@ -1,20 +1,34 @@
 import { useState, useEffect, useCallback, useRef } from 'react';
-import type { Post, Tag } from '../types';
-import { getPosts, getTags } from '../api';
+import type { HistogramBucket, Post, Tag } from '../types';
+import { getBootstrap, getPosts, getPostsHistogram } from '../api';
+import type { PostAnchor } from '../api';
 import TweetCard from '../components/TweetCard';
 import { useSearchParams } from 'react-router-dom';
 
 const PAGE_LIMIT = 10;
 
+// "2024-05" の月へ飛ぶための開始位置 (新しい順なら翌月の初めより前、古い順ならその月の初めから)
+const monthAnchor = (month: string | null, sortOrder: 'asc' | 'desc'): PostAnchor => {
+  if (!month) return {};
+  const [year, monthNumber] = month.split('-').map(Number);
+  if (sortOrder === 'desc') {
+    return { before: new Date(Date.UTC(year, monthNumber, 1)).toISOString() };
+  }
+  return { after: new Date(Date.UTC(year, monthNumber - 1, 1) - 1).toISOString() };
+};
+
 function PostListPage() {
   const [posts, setPosts] = useState<Post[]>([]);
   const [allTags, setAllTags] = useState<Tag[]>([]);
   const [page, setPage] = useState(1);
   const [hasMore, setHasMore] = useState(true);
+  const [totalCount, setTotalCount] = useState<number | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [isAccordionOpen, setIsAccordionOpen] = useState(false);
   const [sortOrder, setSortOrder] = useState<'asc' | 'desc'>('desc');
+  const [histogram, setHistogram] = useState<HistogramBucket[]>([]);
+  const [jumpMonth, setJumpMonth] = useState<string | null>(null);
   const [searchParams, setSearchParams] = useSearchParams();
 
   const loader = useRef<HTMLDivElement | null>(null);
@@ -23,7 +37,7 @@ function PostListPage() {
   const tagsParam = searchParams.get('tags');
   const selectedTags = tagsParam ? tagsParam.split(',') : [];
 
-  const fetchPosts = useCallback(async (currentPage: number, currentTags?: string | null, currentSortOrder?: 'asc' | 'desc') => {
+  const fetchPosts = useCallback(async (currentPage: number, currentTags?: string | null, currentSortOrder: 'asc' | 'desc' = 'desc', anchor: PostAnchor = {}) => {
     if (loadingRef.current) return;
     loadingRef.current = true;
     setLoading(true);
@@ -31,12 +45,18 @@ function PostListPage() {
     
     try {
       const skip = (currentPage - 1) * PAGE_LIMIT;
-      // @ts-ignore
-      const fetchedPosts = await getPosts(currentTags || undefined, skip, PAGE_LIMIT, currentSortOrder);
+      let fetchedPosts: Post[];
 
       if (currentPage === 1) {
+        // 最初のページでは総件数とタグ一覧も1回のリクエストでまとめて取得する
+        const result = await getBootstrap(currentTags || undefined, PAGE_LIMIT, currentSortOrder, anchor);
+        fetchedPosts = result.posts;
+        setTotalCount(result.total);
+        setAllTags(result.tags);
         setPosts(fetchedPosts);
       } else {
+        // @ts-ignore
+        fetchedPosts = await getPosts(currentTags || undefined, skip, PAGE_LIMIT, currentSortOrder, anchor);
         setPosts(prev => {
           const existingIds = new Set(prev.map(p => p.id));
           const newPosts = fetchedPosts.filter(p => !existingIds.has(p.id));
@@ -58,18 +78,12 @@ function PostListPage() {
     }
   }, []);
 
-  // タグ取得 (初回のみ)
+  // 月ごとの投稿数 (タグの絞り込みが変わるたびに取り直す)
   useEffect(() => {
-    const fetchAllTags = async () => {
-      try {
-        const tags = await getTags();
-        setAllTags(tags);
-      } catch (err) {
-        console.error('Failed to fetch tags:', err);
-      }
-    };
-    fetchAllTags();
-  }, []);
+    getPostsHistogram('month', tagsParam || undefined)
+      .then(setHistogram)
+      .catch(err => console.error('Failed to fetch histogram:', err));
+  }, [tagsParam]);
 
   // スクロール監視
   useEffect(() => {
@@ -100,7 +114,7 @@ function PostListPage() {
   // ページ変更時に追加データをフェッチ
   useEffect(() => {
     if (page > 1) {
-      fetchPosts(page, tagsParam, sortOrder);
+      fetchPosts(page, tagsParam, sortOrder, monthAnchor(jumpMonth, sortOrder));
     }
   }, [page]);
 
@@ -108,8 +122,8 @@ function PostListPage() {
   useEffect(() => {
     setPage(1);
     setHasMore(true);
-    fetchPosts(1, tagsParam, sortOrder);
-  }, [tagsParam, sortOrder, fetchPosts]);
+    fetchPosts(1, tagsParam, sortOrder, monthAnchor(jumpMonth, sortOrder));
+  }, [tagsParam, sortOrder, jumpMonth, fetchPosts]);
 
   const toggleTag = (tagName: string) => {
     let newTags: string[];
@@ -120,6 +134,7 @@ function PostListPage() {
     }
 
     const newParams: Record<string, string> = newTags.length > 0 ? { tags: newTags.join(',') } : {};
+    setJumpMonth(null);
     setSearchParams(newParams);
   };
 
@@ -163,6 +178,20 @@ function PostListPage() {
             <option value="asc">古い順</option>
           </select>
         </div>
+
+        {histogram.length > 0 && (
+          <div className="timeline-jump">
+            <label htmlFor="jump-month">移動:</label>
+            <select id="jump-month" value={jumpMonth ?? ''} onChange={e => setJumpMonth(e.target.value || null)}>
+              <option value="">{sortOrder === 'desc' ? '最新' : '最古'}</option>
+              {[...histogram].reverse().map(bucket => (
+                <option key={bucket.period} value={bucket.period}>
+                  {bucket.period} ({bucket.count})
+                </option>
+              ))}
+            </select>
+          </div>
+        )}
       </div>
 
       {selectedTags.length > 0 && (
@@ -173,10 +202,12 @@ function PostListPage() {
               {tag}
             </span>
           ))}
-          <button onClick={() => setSearchParams({})} className="clear-tags-button">Clear All</button>
+          <button onClick={() => { setJumpMonth(null); setSearchParams({}); }} className="clear-tags-button">Clear All</button>
         </div>
       )}
       
+      {totalCount !== null && <p className="post-count">{totalCount}件</p>}
+
       {error && <p className="error-message">{error}</p>}
 
       <div className="post-list-grid">
@@ -186,6 +217,7 @@ function PostListPage() {
             post={post} 
             // @ts-ignore
             onTagClick={toggleTag} 
+            useThumbnails
           />
         ))}
       </div>
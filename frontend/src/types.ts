@@ -5,17 +5,40 @@ export interface Tag {
   name: string;
 }
 
+export interface TagWithCount extends Tag {
+  post_count: number;
+}
+
+export interface Author {
+  id: number;
+  screen_name: string;
+  name?: string | null;
+  avatar_url?: string | null;
+  post_count: number;
+}
+
 export interface Folder {
   id: number;
   name: string;
 }
 
+// MHTML から取り出してローカル保存した画像
+export interface PostMedia {
+  kind: 'photo' | 'avatar';
+  position: number;
+  source_url: string;
+  sha256: string;
+}
+
 export interface Post {
   id: number;
   url: string;
   folder_id?: number | null;
   folder?: Folder | null;
   tags: Tag[];
+  author_id?: number | null;
+  parent_post_id?: number | null; // 返信先 (同じページから取り込んだスレッド)
+  quoted_post_id?: number | null; // 引用元
   created_at: string; // ISO形式の文字列として受け取る
 
   // バックエンドで追加した新しいフィールド
@@ -28,6 +51,31 @@ export interface Post {
   media_urls?: string[] | null; // URLの配列
   favorite_count?: number; // FastAPI側でdefault=0にしているので、ここではOptional
   embed_html?: string | null;
+  local_media?: PostMedia[];
+}
+
+export interface RelatedPost {
+  score: number;
+  post: Post;
+}
+
+export interface HistogramBucket {
+  period: string; // "2024-05" のような期間 (UTC)
+  count: number;
+}
+
+// 初回表示用にまとめて返されるデータ
+export interface Bootstrap {
+  version: number;
+  posts: Post[];
+  total: number;
+  tags: TagWithCount[];
+  folders: Folder[];
+}
+
+export interface PostBatch {
+  posts: Record<number, Post>;
+  missing: number[];
 }
 
 export interface FolderWithPosts extends Folder {
@@ -0,0 +1,30 @@
+# /scripts/autotag.py
+import sys
+import os
+import argparse
+
+# Add project root to the Python path to allow imports from `api`
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from api.database import SessionLocal, init_db
+from api import autotag
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Learn from tagged posts and store tag suggestions for every untagged post. "
+                    "Review them with GET /api/tag_suggestions and accept with POST /api/tag_suggestions/accept."
+    )
+    parser.add_argument("--top-k", type=int, default=3, help="max suggestions per post")
+    parser.add_argument("--min-score", type=float, default=0.2, help="minimum cosine similarity to keep")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        summary = autotag.generate_suggestions(db, top_k=args.top_k, min_score=args.min_score)
+    finally:
+        db.close()
+    print(summary)
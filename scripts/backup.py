@@ -0,0 +1,68 @@
+# /scripts/backup.py
+import sys
+import os
+import argparse
+
+# Add project root to the Python path to allow imports from `api`
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from api.database import SessionLocal, init_db
+from api import backup
+
+
+def export_library(output: str, fmt: str, batch_size: int) -> None:
+    db = SessionLocal()
+    out = sys.stdout if output == "-" else open(output, "w", encoding="utf-8", newline="")
+    try:
+        for chunk in backup.iter_export(db, fmt=fmt, batch_size=batch_size):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        db.close()
+
+
+def restore_library(input_path: str, fmt: str, batch_size: int) -> dict:
+    init_db()
+    db = SessionLocal()
+    stream = sys.stdin if input_path == "-" else open(input_path, "r", encoding="utf-8", newline="")
+    try:
+        records = backup.read_csv(stream) if fmt == "csv" else backup.read_ndjson(stream)
+        return backup.restore_records(db, records, batch_size=batch_size)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        db.close()
+
+
+def _detect_format(path: str, fmt: str) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export or restore the whole library. The database is taken from DATABASE_URL, "
+                    "so piping export into restore with different DATABASE_URLs migrates between databases."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="stream every post with its folder and tags")
+    export_parser.add_argument("output", nargs="?", default="-", help="output file ('-' for stdout)")
+    export_parser.add_argument("--format", choices=backup.EXPORT_FORMATS, help="default: from extension, else ndjson")
+    export_parser.add_argument("--batch-size", type=int, default=1000)
+
+    restore_parser = sub.add_parser("restore", help="bulk-load an export, skipping tweets that already exist")
+    restore_parser.add_argument("input", nargs="?", default="-", help="input file ('-' for stdin)")
+    restore_parser.add_argument("--format", choices=backup.EXPORT_FORMATS, help="default: from extension, else ndjson")
+    restore_parser.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_library(args.output, _detect_format(args.output, args.format), args.batch_size)
+    else:
+        summary = restore_library(args.input, _detect_format(args.input, args.format), args.batch_size)
+        print(summary, file=sys.stderr)
@@ -0,0 +1,32 @@
+# /scripts/find_duplicates.py
+import sys
+import os
+import argparse
+
+# Add project root to the Python path to allow imports from `api`
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from api.database import SessionLocal, init_db
+from api import dedup
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute MinHash signatures for posts that don't have one yet "
+                    "(posts saved before duplicate detection existed) and print the largest near-duplicate clusters."
+    )
+    parser.add_argument("--top", type=int, default=20, help="number of clusters to print")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        indexed = dedup.ensure_signatures(db)
+        clusters = dedup.find_clusters(db)
+    finally:
+        db.close()
+    print(f"Indexed {indexed} posts, found {len(clusters)} clusters")
+    for cluster in clusters[:args.top]:
+        print(len(cluster), cluster)
@@ -1,20 +1,26 @@
 # /scripts/import_mhtml.py
 import sys
 import os
-import re
 import email
+import time
+import shutil
+import hashlib
+import argparse
 from email.message import Message
-from datetime import datetime
-from bs4 import BeautifulSoup
+from typing import Dict, List, Optional
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from watchfiles import watch, Change
 
 # Add project root to the Python path to allow imports from `backend`
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if project_root not in sys.path:
     sys.path.append(project_root)
 
-from api.database import SessionLocal
-from api.models import Post, Tag
+from api.database import SessionLocal, init_db
+from api.models import Post, Tag, Author, MediaAsset, PostMedia, ImportManifest
+from api import metrics, media_store, counters, dedup, extract, html_archive
+from api.crud import get_or_create_author
 
 
 def get_post_by_url(db: Session, url: str):
@@ -25,13 +31,57 @@ def get_tag_by_name(db: Session, name: str):
     """タグ名でタグを検索する"""
     return db.query(Tag).filter(Tag.name == name).first()
 
-def parse_and_import(file_path: str) -> dict:
+def attach_local_media(db: Session, msg: Message, post_data: dict,
+                       assets: Optional[Dict[str, MediaAsset]] = None) -> List[PostMedia]:
+    """
+    MHTML に埋め込まれた投稿画像・アイコンをローカルストアに保存し、PostMedia を作る
+    (同じページの複数の投稿で画像を共有するときは assets を使い回す)
+    """
+    # 同じ画像が複数サイズで埋め込まれている場合は一番大きいパートを使う
+    parts = {}
+    for part in msg.walk():
+        location = part.get('Content-Location')
+        if part.get_content_maintype() != 'image' or not location:
+            continue
+        base = location.split('?')[0]
+        current = parts.get(base)
+        if current is None or len(part.get_payload()) > len(current.get_payload()):
+            parts[base] = part
+
+    targets = [('photo', i, url) for i, url in enumerate(post_data.get('media_urls') or [])]
+    if post_data.get('author_avatar_url'):
+        targets.append(('avatar', 0, post_data['author_avatar_url']))
+
+    assets = {} if assets is None else assets
+    local_media = []
+    for kind, position, url in targets:
+        part = parts.get(url.split('?')[0])
+        data = part.get_payload(decode=True) if part is not None else None
+        if not data:
+            continue
+        content_type = part.get_content_type()
+        sha256 = media_store.store_bytes(data, content_type)
+        if sha256 not in assets:
+            assets[sha256] = db.get(MediaAsset, sha256) or MediaAsset(sha256=sha256, content_type=content_type, size=len(data))
+            db.add(assets[sha256])
+        local_media.append(PostMedia(kind=kind, position=position, source_url=url, asset=assets[sha256]))
+    return local_media
+
+def parse_and_import(file_path: str, content: Optional[bytes] = None) -> dict:
     """
     MHTMLファイルをパースしてデータベースにインポートし、結果を返す
+    (content を渡した場合はファイルを読み直さない)
     """
+    result = _parse_and_import(file_path, content)
+    metrics.IMPORTS.inc(result.get("status", "failed"))
+    return result
+
+def _parse_and_import(file_path: str, content: Optional[bytes] = None) -> dict:
     try:
-        with open(file_path, 'rb') as f:
-            msg: Message = email.message_from_binary_file(f)
+        if content is None:
+            with open(file_path, 'rb') as f:
+                content = f.read()
+        msg: Message = email.message_from_bytes(content)
         
         html_part = next((part for part in msg.walk() if part.get_content_type() == 'text/html'), None)
         
@@ -40,7 +90,6 @@ def parse_and_import(file_path: str) -> dict:
 
         html_content = html_part.get_payload(decode=True)
         charset = html_part.get_content_charset() or 'utf-8'
-        soup = BeautifulSoup(html_content, 'lxml', from_encoding=charset)
 
         url = msg.get('Snapshot-Content-Location')
         if not url:
@@ -51,60 +100,25 @@ def parse_and_import(file_path: str) -> dict:
     except Exception as e:
         return {"status": "failed", "file_path": file_path, "error": f"Error reading or parsing file: {e}"}
 
-    # --- データ抽出ロジック ---
-    post_data = {'url': url}
+    # --- データ抽出ロジック (api/extract.py) ---
+    # スレッドの前後や引用も含め、ページ内の投稿を 1 回のパースですべて取り出す (先頭がページの投稿)
     try:
-        tweet_id_match = re.search(r'status/(\d+)', url)
-        post_data['tweet_id'] = tweet_id_match.group(1) if tweet_id_match else None
-
-        article = soup.find("article", attrs={"data-testid": "tweet"})
-        if not article:
-            return {"status": "failed", "url": url, "error": "Could not find the main tweet article element"}
-
-        user_name_div = article.find("div", attrs={"data-testid": "User-Name"})
-        if user_name_div:
-            spans = user_name_div.find_all("span")
-            post_data['author_name'] = spans[0].text if spans else 'Unknown'
-            user_id_div = user_name_div.find_next('div')
-            if user_id_div:
-                post_data['author_screen_name'] = ''.join(s.text for s in user_id_div.find_all('span')).replace('@', '')
-
-        text_div = article.find("div", attrs={"data-testid": "tweetText"})
-        post_data['text'] = text_div.get_text(separator='\n', strip=True) if text_div else ""
-
-        time_tag = article.find("time")
-        if time_tag and 'datetime' in time_tag.attrs:
-            dt_str = time_tag['datetime']
-            post_data['posted_at'] = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
-
-        media_urls = [
-            f"{img['src'].split('?')[0]}?format=jpg&name=orig"
-            for div in article.find_all("div", attrs={"data-testid": "tweetPhoto"})
-            if (img := div.find("img")) and 'src' in img.attrs
-        ]
-        post_data['media_urls'] = media_urls
-
-        avatar_container = article.find("div", attrs={"data-testid": re.compile(r"UserAvatar-Container-.*")})
-        if avatar_container and (avatar_img := avatar_container.find("img")) and 'src' in avatar_img.attrs:
-            post_data['author_avatar_url'] = avatar_img['src']
-            
-    except Exception as e:
-        return {"status": "failed", "url": url, "error": f"An error occurred during data extraction: {e}"}
+        extracted = extract.extract_posts(html_content, url, charset)
+    except extract.ExtractionError as e:
+        return {"status": "failed", "url": url, "error": str(e)}
 
     # --- データベースへの保存処理 ---
     db: Session = SessionLocal()
     try:
-        # すでに存在するかチェック
-        if get_post_by_url(db, url):
-             return {"status": "skipped", "url": url, "reason": "Post already exists"}
-
-        # tags=[] を明示的に渡す必要はありません（modelのdefaultで空になります）
-        db_post = Post(**post_data) 
-        db.add(db_post)
-        db.commit() # ここでIDエラーが出ていたはずです
-        db.refresh(db_post) # 保存後の情報を取得
-        return {"status": "added", "url": db_post.url}
-
+        for attempt in range(SAVE_ATTEMPTS):
+            try:
+                return _save_posts(db, msg, url, extracted, html_content, charset)
+            except IntegrityError:
+                # 同じ投稿 (著者・画像) を含むページを別プロセスが同時に取り込んだ。
+                # 先に入った行を読み直して、作らずに関係だけ結ぶ
+                db.rollback()
+                if attempt == SAVE_ATTEMPTS - 1:
+                    raise
     except Exception as e:
         db.rollback() # エラー時は必ずロールバック
         print(f"Import Error: {e}") # ログに出力
@@ -112,29 +126,291 @@ def parse_and_import(file_path: str) -> dict:
     finally:
         db.close()
 
+POST_FIELDS = ('url', 'tweet_id', 'text', 'posted_at', 'media_urls')
+# 同時取り込みで一意制約に当たったときに保存をやり直す回数
+SAVE_ATTEMPTS = 3
+
+def _save_posts(db: Session, msg: Message, url: str, extracted: List[dict], html_content: bytes, charset: str) -> dict:
+    """
+    1 ページ分の投稿をまとめて保存する。既存の投稿 (tweet_id、ページの投稿は URL でも) は作らずに、
+    返信先・引用元が未設定なら関係だけ補う
+    """
+    main_data = extracted[0]
+    tweet_ids = [data['tweet_id'] for data in extracted if data['tweet_id']]
+    existing = {post.tweet_id: post for post in db.query(Post).filter(Post.tweet_id.in_(tweet_ids))} if tweet_ids else {}
+    main_post = existing.get(main_data['tweet_id']) if main_data['tweet_id'] else None
+    if main_post is None:
+        main_post = get_post_by_url(db, url)
+
+    archive_sha256 = None
+    def archive() -> str:
+        nonlocal archive_sha256
+        if archive_sha256 is None:
+            archive_sha256 = html_archive.store(db, html_content, charset).sha256
+        return archive_sha256
+
+    authors: Dict[str, Optional[Author]] = {}
+    assets: Dict[str, MediaAsset] = {}
+    posts = []
+    new_posts = []
+    for data in extracted:
+        post = main_post if data is main_data else existing.get(data['tweet_id'])
+        if post is None:
+            # 著者は authors テーブルで管理する (同じページに同じ著者が何度も出てくる)
+            screen_name = data.get('author_screen_name')
+            if screen_name not in authors:
+                authors[screen_name] = get_or_create_author(db, screen_name, data.get('author_name'),
+                                                            data.get('author_avatar_url'))
+            post = Post(**{field: data.get(field) for field in POST_FIELDS}, author=authors[screen_name])
+            post.raw_html_sha256 = archive()
+            post.local_media = attach_local_media(db, msg, data, assets)
+            db.add(post)
+            new_posts.append(post)
+            if data is main_data:
+                main_post = post
+        elif post.raw_html_sha256 is None:
+            # 元の HTML を持っていない投稿なら、保存し直されたページをアーカイブしておく
+            post.raw_html_sha256 = archive()
+        posts.append(post)
+    db.flush()
+
+    # 同じページ内の返信先・引用元を id で結ぶ (既に設定されている関係は変えない)
+    by_tweet_id = {data['tweet_id']: post for data, post in zip(extracted, posts) if data['tweet_id']}
+    relinked = False
+    for data, post in zip(extracted, posts):
+        for field, column in (('reply_to_tweet_id', 'parent_post_id'), ('quoted_tweet_id', 'quoted_post_id')):
+            target = by_tweet_id.get(data.get(field)) if data.get(field) else None
+            if target is not None and target is not post and getattr(post, column) is None:
+                setattr(post, column, target.id)
+                relinked = True
+
+    duplicates = {}
+    if new_posts:
+        deltas = {"all": len(new_posts)}
+        day_deltas: Dict[tuple, int] = {}
+        for post in new_posts:
+            scopes = ["all"]
+            if post.author_id is not None:
+                scope = counters.author_scope(post.author_id)
+                deltas[scope] = deltas.get(scope, 0) + 1
+                scopes.append(scope)
+            day = counters.day_of(post.posted_at)
+            for scope in scopes if day else ():
+                day_deltas[(scope, day)] = day_deltas.get((scope, day), 0) + 1
+        counters.adjust_counts(db, deltas)
+        counters.adjust_day_counts(db, day_deltas)
+        duplicates = dedup.index_posts(db, [(post.id, post.text, post.media_urls) for post in new_posts])
+    if new_posts or relinked:
+        counters.bump_version(db)
+    db.commit()
+
+    # サムネイルはワーカープールで生成する
+    for sha256, content_type in {(m.asset.sha256, m.asset.content_type) for p in new_posts for m in p.local_media}:
+        media_store.schedule_thumbnail(sha256, content_type)
+
+    if not new_posts:
+        return {"status": "skipped", "url": url, "reason": "Post already exists", "post_id": main_post.id}
+    result = {"status": "added", "url": main_post.url, "post_id": main_post.id,
+              "added_post_ids": [post.id for post in new_posts]}
+    if duplicates.get(main_post.id) is not None:
+        # 別 URL の近似重複 (引用・転載など)。取り込みはするが知らせる
+        result["duplicate_of"] = duplicates[main_post.id]
+    return result
+
+def _is_mhtml(path: str) -> bool:
+    return path.lower().endswith(('.mhtml', '.mht'))
+
+def _load_manifest(db: Session, paths: List[str]) -> Dict[str, ImportManifest]:
+    manifest = {}
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        for entry in db.query(ImportManifest).filter(ImportManifest.path.in_(chunk)):
+            manifest[entry.path] = entry
+    return manifest
+
+def import_files(file_paths: List[str], force: bool = False) -> List[dict]:
+    """
+    MHTML ファイル群をインポートする。
+    マニフェストとサイズ・更新時刻が一致するファイルは開かずにスキップし、
+    内容 (ハッシュ) が既知のファイルもパースせずにスキップする。
+    """
+    file_paths = [os.path.abspath(p) for p in file_paths]
+    db: Session = SessionLocal()
+    try:
+        manifest = _load_manifest(db, file_paths)
+        results = []
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+
+            entry = manifest.get(file_path)
+            # 失敗したファイルは変更がなくても毎回やり直す
+            if (not force and entry and entry.status != "failed"
+                    and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns):
+                results.append({"status": "skipped", "file_path": file_path, "reason": "Unchanged since last import",
+                                "post_id": entry.post_id})
+                continue
+
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            content_hash = hashlib.sha256(content).hexdigest()
+
+            # 別名で保存し直したファイルや、更新時刻だけ変わったファイル
+            known = None
+            if not force:
+                known = db.query(ImportManifest).filter(
+                    ImportManifest.content_hash == content_hash,
+                    ImportManifest.status != "failed",
+                ).first()
+            if known:
+                result = {"status": "skipped", "file_path": file_path, "reason": "Same content already imported",
+                          "post_id": known.post_id}
+            else:
+                result = parse_and_import(file_path, content)
+
+            entry = entry or ImportManifest(path=file_path)
+            entry.size = stat.st_size
+            entry.mtime_ns = stat.st_mtime_ns
+            entry.content_hash = content_hash
+            # 既知の内容なら元の取り込み結果をそのまま引き継ぐ
+            entry.status = known.status if known else result["status"]
+            entry.post_id = result.get("post_id")
+            manifest[file_path] = db.merge(entry)
+            db.commit()
+            result.setdefault("file_path", file_path)
+            results.append(result)
+        return results
+    finally:
+        db.close()
+
+def import_directory(dir_path: str, force: bool = False) -> List[dict]:
+    """ディレクトリ直下の MHTML をすべてインポートする"""
+    file_paths = [os.path.join(dir_path, name) for name in sorted(os.listdir(dir_path)) if _is_mhtml(name)]
+    return import_files(file_paths, force=force)
+
+def _dispose_imported_file(file_path: str, archive_dir: Optional[str], delete: bool) -> None:
+    """取り込み済みのファイルを削除、またはアーカイブ先へ移動する"""
+    if delete:
+        os.unlink(file_path)
+    elif archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+        base, ext = os.path.splitext(os.path.basename(file_path))
+        dest = os.path.join(archive_dir, base + ext)
+        n = 1
+        while os.path.exists(dest):
+            dest = os.path.join(archive_dir, f"{base}-{n}{ext}")
+            n += 1
+        shutil.move(file_path, dest)
+
+def watch_directory(dir_path: str, batch_size: int = 10, settle_seconds: float = 2.0,
+                    archive_dir: Optional[str] = None, delete: bool = False,
+                    process_existing: bool = True) -> Dict[str, int]:
+    """
+    ディレクトリを監視し、新しく保存された MHTML を取り込む (Ctrl+C で終了)。
+    OS のファイル通知を使うのでディレクトリの再走査は行わない。
+    サイズと更新時刻が settle_seconds の間変化しなかったファイルを書き込み完了とみなす。
+    """
+    summary = {"added": 0, "skipped": 0, "failed": 0, "thumbnails_failed": 0}
+
+    def process(paths: List[str]) -> None:
+        for i in range(0, len(paths), batch_size):
+            for result in import_files(paths[i:i + batch_size]):
+                summary[result["status"]] += 1
+                print(result)
+                if result["status"] != "failed" and (archive_dir or delete):
+                    try:
+                        _dispose_imported_file(result["file_path"], archive_dir, delete)
+                    except OSError as e:
+                        print(f"Could not archive {result['file_path']}: {e}")
+
+    if process_existing:
+        process([os.path.join(dir_path, name) for name in sorted(os.listdir(dir_path)) if _is_mhtml(name)])
+
+    print(f"Watching directory: {dir_path} (Ctrl+C to stop)")
+    # path -> 直前に観測した (サイズ, 更新時刻)。None は未観測
+    pending: Dict[str, Optional[tuple]] = {}
+    changes_iter = watch(
+        dir_path,
+        watch_filter=lambda change, path: change != Change.deleted and _is_mhtml(path),
+        recursive=False,
+        # 書き込み途中のファイルを再確認するため、変更がなくても定期的に戻ってくる
+        rust_timeout=int(settle_seconds * 1000),
+        yield_on_timeout=True,
+    )
+    try:
+        for changes in changes_iter:
+            for _change, path in changes:
+                pending[os.path.abspath(path)] = None
+            if not pending:
+                continue
+
+            ready = []
+            now = time.time()
+            for path, last_state in list(pending.items()):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del pending[path]
+                    continue
+                state = (stat.st_size, stat.st_mtime_ns)
+                if state == last_state and now - stat.st_mtime >= settle_seconds:
+                    ready.append(path)
+                    del pending[path]
+                else:
+                    pending[path] = state
+
+            if ready:
+                process(sorted(ready))
+                summary["thumbnails_failed"] += media_store.wait_for_thumbnails()
+    except KeyboardInterrupt:
+        pass
+    return summary
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python scripts/import_mhtml.py <directory_path>")
-        sys.exit(1)
-    
-    dir_path = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Import saved X (Twitter) MHTML files.")
+    parser.add_argument("directory", help="directory containing .mhtml / .mht files")
+    parser.add_argument("--force", action="store_true", help="ignore the import manifest and re-parse every file")
+    parser.add_argument("--watch", action="store_true", help="keep running and import new files as they are saved")
+    parser.add_argument("--batch-size", type=int, default=10, help="files imported per batch in watch mode")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="seconds a file must stay unchanged before it is imported in watch mode")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="in watch mode, ignore files already in the directory at startup")
+    dispose = parser.add_mutually_exclusive_group()
+    dispose.add_argument("--archive-dir", help="in watch mode, move imported files to this directory")
+    dispose.add_argument("--delete", action="store_true", help="in watch mode, delete imported files")
+    args = parser.parse_args()
+
+    dir_path = args.directory
     if not os.path.isdir(dir_path):
         print(f"Error: Provided path is not a directory: {dir_path}")
         sys.exit(1)
 
+    # テーブル・インデックスを現在の定義に合わせる
+    init_db()
+
+    if args.watch:
+        summary = watch_directory(dir_path, batch_size=max(1, args.batch_size), settle_seconds=args.settle,
+                                  archive_dir=args.archive_dir, delete=args.delete,
+                                  process_existing=not args.skip_existing)
+        summary["thumbnails_failed"] += media_store.wait_for_thumbnails()
+        print("\n--- Summary ---")
+        print(summary)
+        sys.exit(0)
+
     print(f"Scanning directory: {dir_path}")
-    results = []
-    for filename in os.listdir(dir_path):
-        if filename.lower().endswith(('.mhtml', '.mht')):
-            file_path = os.path.join(dir_path, filename)
-            result = parse_and_import(file_path)
+    results = import_directory(dir_path, force=args.force)
+    for result in results:
+        if result.get("reason") != "Unchanged since last import":
             print(result)
-            results.append(result)
-    
+
+    thumbnails_failed = media_store.wait_for_thumbnails()
+
     print("\n--- Summary ---")
-    summary = {"added": 0, "skipped": 0, "failed": 0}
+    summary = {"added": 0, "skipped": 0, "failed": 0, "thumbnails_failed": thumbnails_failed}
     for res in results:
         summary[res["status"]] += 1
     print(summary)
     print("All files processed.")
-
@@ -0,0 +1,374 @@
+# /scripts/loadtest.py
+"""
+API 全体の負荷試験。一時ディレクトリの SQLite にデータを投入した API を別プロセスで起動し、
+一覧のスクロール・タグ絞り込み・タグ編集・MHTML アップロード・URL 登録を指定の割合と到着レートで送る。
+スクレイピング (Selenium) はスタブに差し替えるのでオフラインで動く
+"""
+import sys
+import os
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import random
+import shutil
+import socket
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+# Add project root to the Python path to allow imports from `api`
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+SCENARIOS = ("scroll", "tag_filter", "tag_edit", "upload", "create")
+DEFAULT_MIX = "scroll=55,tag_filter=25,tag_edit=10,upload=5,create=5"
+PAGE_LIMIT = 10
+SEED_BATCH_SIZE = 5000
+
+
+# --- サーバー側 (子プロセス) ---
+
+def _fake_scrape(url: str) -> dict:
+    """Selenium の代わりに URL から決まった内容を返す"""
+    tweet_id = url.rstrip("/").rsplit("/", 1)[-1]
+    return {
+        "url": url,
+        "tweet_id": tweet_id,
+        "text": f"load test post {tweet_id}",
+        "author_name": "Load Test",
+        "author_screen_name": "loadtest",
+        "posted_at": datetime.now(timezone.utc),
+        "media_urls": [],
+    }
+
+
+def seed_database(num_posts: int, num_tags: int, num_authors: int, seed: int) -> None:
+    """投稿・著者・タグをまとめて投入し、カウンタを作る (タグの付き方は少数のタグに偏らせる)"""
+    from sqlalchemy import insert
+    from api import models, counters
+    from api.database import SessionLocal
+
+    rng = random.Random(seed)
+    tag_weights = [1.0 / (i + 1) for i in range(num_tags)]
+    start = datetime(2015, 1, 1)
+    span = (datetime(2025, 1, 1) - start).total_seconds()
+    with SessionLocal() as db:
+        db.execute(insert(models.Author), [
+            {"id": i + 1, "screen_name": f"author{i}", "name": f"Author {i}"} for i in range(num_authors)
+        ])
+        db.execute(insert(models.Tag), [
+            {"id": i + 1, "name": f"tag{i}", "name_norm": models.normalize_tag_name(f"tag{i}")} for i in range(num_tags)
+        ])
+        for first in range(1, num_posts + 1, SEED_BATCH_SIZE):
+            ids = range(first, min(first + SEED_BATCH_SIZE, num_posts + 1))
+            db.execute(insert(models.Post), [{
+                "id": i,
+                "url": f"https://x.com/author{i % num_authors}/status/{i}",
+                "tweet_id": str(i),
+                "text": f"seeded post {i} " + " ".join(rng.choice(("cat", "dog", "art", "news", "memo")) for _ in range(8)),
+                "author_id": i % num_authors + 1,
+                "posted_at": start + timedelta(seconds=rng.random() * span),
+                "media_urls": [],
+                "favorite_count": 0,
+            } for i in ids])
+            pairs = set()
+            for i in ids:
+                for tag_index in rng.choices(range(num_tags), weights=tag_weights, k=rng.randint(0, 4)):
+                    pairs.add((i, tag_index + 1))
+            if pairs:
+                db.execute(insert(models.post_tag_association), [{"post_id": p, "tag_id": t} for p, t in pairs])
+        db.commit()
+        counters.rebuild_counts(db)
+
+
+def serve(port: int, num_posts: int, num_tags: int, num_authors: int, seed: int) -> None:
+    """子プロセスで API を起動する。環境変数 (DATABASE_URL など) は親プロセスで設定済み"""
+    import uvicorn
+    from api import crud
+    crud.scrape_tweet_data_with_selenium = _fake_scrape
+    from api.index import app  # テーブルはここで作られる
+
+    seed_database(num_posts, num_tags, num_authors, seed)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+# --- クライアント側 ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name.strip()}' (choose from: {', '.join(SCENARIOS)})")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _make_mhtml(tweet_id: int, rng: random.Random) -> bytes:
+    """import_mhtml が読める最小限の MHTML (本文と画像 1 枚)"""
+    from PIL import Image
+
+    url = f"https://x.com/uploader/status/{tweet_id}"
+    media_url = f"https://pbs.twimg.com/media/L{tweet_id}?format=jpg&name=small"
+    html = f'''<html><body><article data-testid="tweet">
+<div data-testid="User-Name"><span>Uploader</span><div><span>@uploader</span></div></div>
+<div data-testid="tweetText"><span>uploaded post {tweet_id}</span></div>
+<time datetime="{datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')}">now</time>
+<div data-testid="tweetPhoto"><img src="{media_url}"></div>
+</article></body></html>'''
+    image = io.BytesIO()
+    Image.new("RGB", (320, 240), tuple(rng.randrange(256) for _ in range(3))).save(image, "JPEG")
+    message = MIMEMultipart("related")
+    message["Snapshot-Content-Location"] = url
+    html_part = MIMEText(html, "html", "utf-8")
+    html_part["Content-Location"] = url
+    message.attach(html_part)
+    image_part = MIMEImage(image.getvalue(), "jpeg")
+    image_part["Content-Location"] = media_url
+    message.attach(image_part)
+    return message.as_bytes()
+
+
+class TrafficModel:
+    """シナリオごとのリクエスト (名前, メソッド, パス, httpx の引数) を作る"""
+
+    def __init__(self, num_posts: int, num_tags: int, rng: random.Random):
+        self.num_posts = num_posts
+        self.rng = rng
+        self.tag_weights = [1.0 / (i + 1) for i in range(num_tags)]
+        self.tag_names = [f"tag{i}" for i in range(num_tags)]
+        self._next_tweet_id = 10 ** 15 + rng.randrange(10 ** 12)
+
+    def _tags(self, k: int) -> List[str]:
+        return list(dict.fromkeys(self.rng.choices(self.tag_names, weights=self.tag_weights, k=k)))
+
+    def _tweet_id(self) -> int:
+        self._next_tweet_id += 1
+        return self._next_tweet_id
+
+    def scroll(self):
+        # 無限スクロール: 先頭ページ (総件数付き) が多く、深いページほど少ない
+        page = min(int(self.rng.expovariate(0.3)), 200)
+        params = {"skip": page * PAGE_LIMIT, "limit": PAGE_LIMIT, "sort_order": "desc"}
+        if page == 0:
+            params["with_total"] = "true"
+        return "GET /api/posts/ (scroll)", "GET", "/api/posts/", {"params": params}
+
+    def tag_filter(self):
+        params = {"tag_names": ",".join(self._tags(self.rng.choice((1, 1, 2)))), "limit": PAGE_LIMIT,
+                  "skip": PAGE_LIMIT * self.rng.choice((0, 0, 0, 1, 2)), "with_total": "true"}
+        return "GET /api/posts/ (tags)", "GET", "/api/posts/", {"params": params}
+
+    def tag_edit(self):
+        post_id = self.rng.randint(1, self.num_posts)
+        return "PUT /api/posts/{id}/tags", "PUT", f"/api/posts/{post_id}/tags", {"json": {"tags": self._tags(3)}}
+
+    def upload(self):
+        tweet_id = self._tweet_id()
+        files = [("files", (f"{tweet_id}.mhtml", _make_mhtml(tweet_id, self.rng), "multipart/related"))]
+        return "POST /api/upload_mhtmls/", "POST", "/api/upload_mhtmls/", {"files": files}
+
+    def create(self):
+        url = f"https://x.com/loadtest/status/{self._tweet_id()}"
+        return "POST /api/posts/", "POST", "/api/posts/", {"json": {"url": url, "tags": self._tags(2)}}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+async def run_load(base_url: str, model: TrafficModel, mix: Dict[str, float], rate: float, duration: float,
+                   max_in_flight: int, timeout: float) -> dict:
+    """
+    オープンループで送る: 到着時刻はポアソン過程で先に決まり、応答を待たずに次を送る。
+    レイテンシは予定の送信時刻から測るので、詰まったときの待ち時間も含まれる
+    """
+    names, weights = list(mix), list(mix.values())
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    statuses: Dict[str, Dict[str, int]] = {}
+    dropped = 0
+    loop = asyncio.get_running_loop()
+
+    async def send(client: httpx.AsyncClient, request: Tuple[str, str, str, dict], scheduled: float) -> None:
+        name, method, path, kwargs = request
+        try:
+            response = await client.request(method, path, **kwargs)
+            status = str(response.status_code)
+            failed = response.status_code >= 400
+        except httpx.HTTPError as e:
+            status, failed = type(e).__name__, True
+        latencies.setdefault(name, []).append((loop.time() - scheduled) * 1000)
+        statuses.setdefault(name, {})
+        statuses[name][status] = statuses[name].get(status, 0) + 1
+        if failed:
+            errors[name] = errors.get(name, 0) + 1
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        tasks = set()
+        start = loop.time()
+        scheduled = start
+        while scheduled < start + duration:
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= max_in_flight:
+                # 送れなかった分は数えるだけ (クライアント側で待つと到着レートが下がる)
+                dropped += 1
+            else:
+                request = getattr(model, model.rng.choices(names, weights=weights)[0])()
+                task = asyncio.create_task(send(client, request, scheduled))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            scheduled += model.rng.expovariate(rate)
+        sending_done = loop.time()
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = loop.time() - start
+
+    endpoints = {}
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        endpoints[name] = {
+            "requests": len(values),
+            "errors": errors.get(name, 0),
+            "error_rate": errors.get(name, 0) / len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "max_ms": values[-1],
+            "statuses": statuses[name],
+        }
+    completed = sum(e["requests"] for e in endpoints.values())
+    failed = sum(e["errors"] for e in endpoints.values())
+    return {
+        "target_rate": rate,
+        "offered_rate": (completed + dropped) / (sending_done - start) if sending_done > start else 0.0,
+        "throughput": completed / elapsed if elapsed else 0.0,
+        "completed": completed,
+        "errors": failed,
+        "error_rate": failed / completed if completed else 0.0,
+        "dropped": dropped,
+        "elapsed_s": elapsed,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\ntarget {report['target_rate']:.1f} req/s, offered {report['offered_rate']:.1f} req/s, "
+          f"throughput {report['throughput']:.1f} req/s over {report['elapsed_s']:.1f}s")
+    print(f"completed {report['completed']}, errors {report['errors']} ({report['error_rate']:.2%}), "
+          f"dropped {report['dropped']}")
+    header = f"{'endpoint':<28} {'reqs':>6} {'err%':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    print("\n" + header + "\n" + "-" * len(header))
+    for name, e in report["endpoints"].items():
+        print(f"{name:<28} {e['requests']:>6} {e['error_rate']:>7.2%} {e['p50_ms']:>7.1f}ms {e['p95_ms']:>7.1f}ms "
+              f"{e['p99_ms']:>7.1f}ms {e['max_ms']:>7.1f}ms")
+    failures = {name: {status: n for status, n in e["statuses"].items() if not status.startswith(("1", "2", "3"))}
+                for name, e in report["endpoints"].items()}
+    failures = {name: statuses for name, statuses in failures.items() if statuses}
+    if failures:
+        print("\nerrors by status:")
+        for name, statuses in failures.items():
+            print(f"  {name}: " + ", ".join(f"{status} x{n}" for status, n in sorted(statuses.items())))
+
+
+def _wait_until_ready(base_url: str, server: Optional[multiprocessing.Process], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and not server.is_alive():
+            raise RuntimeError(f"API server exited during startup (exit code {server.exitcode})")
+        try:
+            if httpx.get(base_url + "/", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"API server did not become ready within {timeout:.0f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Start the API against a freshly seeded SQLite database and replay a mixed open-loop workload."
+    )
+    parser.add_argument("--rate", type=float, default=50.0, help="target arrival rate (requests/second)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to send traffic")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--posts", type=int, default=20000, help="posts to seed")
+    parser.add_argument("--tags", type=int, default=200, help="tags to seed")
+    parser.add_argument("--authors", type=int, default=500, help="authors to seed")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="concurrent requests before arrivals are dropped")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data and traffic")
+    parser.add_argument("--url", help="use an already running API at this base URL instead of starting one "
+                                      "(its data must match --posts/--tags)")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    parser.add_argument("--keep-data", action="store_true", help="keep the temporary database and media directory")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    workdir, server = None, None
+    base_url = args.url.rstrip("/") if args.url else None
+    try:
+        if base_url is None:
+            workdir = tempfile.mkdtemp(prefix="xlm-loadtest-")
+            os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+            os.environ["MEDIA_ROOT"] = os.path.join(workdir, "media_store")
+            os.environ["HTML_ARCHIVE_ROOT"] = os.path.join(workdir, "html_archive")
+            port = _free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            # 環境変数を読んでから api を import させるため spawn で起動する
+            server = multiprocessing.get_context("spawn").Process(
+                target=serve, args=(port, args.posts, args.tags, args.authors, args.seed), daemon=True
+            )
+            print(f"Seeding {args.posts} posts into {workdir} and starting the API on {base_url} ...")
+            server.start()
+        _wait_until_ready(base_url, server, timeout=300)
+
+        model = TrafficModel(args.posts, args.tags, random.Random(args.seed))
+        print(f"Sending {args.rate:g} req/s for {args.duration:g}s with mix {mix}")
+        report = asyncio.run(run_load(base_url, model, mix, args.rate, args.duration, args.max_in_flight, args.timeout))
+        print_report(report)
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join(10)
+            if server.is_alive():
+                # 処理中のリクエストを待ちきれなければ止める (データを消す前に必ず終わらせる)
+                server.kill()
+                server.join()
+        if workdir is not None:
+            if args.keep_data:
+                print(f"Data kept in {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
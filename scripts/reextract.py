@@ -0,0 +1,224 @@
+# /scripts/reextract.py
+import sys
+import os
+import email
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone
+from typing import Dict, List
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+# Add project root to the Python path to allow imports from `api`
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from api.database import SessionLocal, init_db
+from api.models import Post, Author, ArchivedHtml, PostSignature, PostLshBucket, PostMedia, MediaAsset, ImportManifest
+from api import counters, dedup, html_archive, media_store
+from api.crud import get_or_create_author
+from scripts.import_mhtml import attach_local_media
+
+# posts のカラムと同じ名前で比較・更新するフィールド
+POST_FIELDS = ("tweet_id", "text", "posted_at", "media_urls")
+AUTHOR_FIELDS = ("author_screen_name", "author_name", "author_avatar_url")
+
+
+def _utc_naive(value):
+    """SQLite (naive) と PostgreSQL (aware) の両方で比べられるよう UTC の naive にそろえる"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _changed_fields(row, extracted: dict) -> List[str]:
+    changed = []
+    for field in POST_FIELDS:
+        old, new = getattr(row, field), extracted.get(field)
+        if field == "posted_at":
+            old, new = _utc_naive(old), _utc_naive(new)
+        elif field == "media_urls":
+            old, new = old or [], new or []
+        if old != new:
+            changed.append(field)
+    for field in AUTHOR_FIELDS:
+        new = extracted.get(field)
+        # 取り出せなかった著者情報で既存の値を消さない
+        if new is not None and getattr(row, field) != new:
+            changed.append(field)
+    return changed
+
+
+def _tweet_id_collisions(db: Session, pending) -> Dict[int, str]:
+    """新しい tweet_id が他の投稿 (DB 上、または同じバッチで同じ値になるもの) と重なる投稿を返す"""
+    new_ids = {row.id: extracted["tweet_id"] for row, extracted, changed in pending
+               if "tweet_id" in changed and extracted.get("tweet_id")}
+    if not new_ids:
+        return {}
+    owners: Dict[str, List[int]] = {}
+    for tweet_id, post_id in db.execute(select(Post.tweet_id, Post.id).where(Post.tweet_id.in_(set(new_ids.values())))):
+        owners.setdefault(tweet_id, []).append(post_id)
+    for post_id, tweet_id in new_ids.items():
+        owners.setdefault(tweet_id, []).append(post_id)
+    return {post_id: tweet_id for post_id, tweet_id in new_ids.items() if len(owners[tweet_id]) > 1}
+
+
+def _source_message(db: Session, post_id: int):
+    """
+    この投稿を取り込んだ MHTML がまだあれば読み込む (画像は HTML アーカイブには残っていない)。
+    マニフェストはページの投稿しか指さないので、同じ HTML から取り込んだ投稿 (スレッド・引用) もたどる
+    """
+    page = select(Post.raw_html_sha256).where(Post.id == post_id).scalar_subquery()
+    for (path,) in db.execute(select(ImportManifest.path).join(Post, Post.id == ImportManifest.post_id)
+                              .where(Post.raw_html_sha256 == page)):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return email.message_from_bytes(f.read())
+    return None
+
+
+def _refresh_media(db: Session, media_changes: Dict[int, list], summary: dict) -> None:
+    """
+    media_urls が変わった投稿の画像 (PostMedia) を作り直す。元の MHTML が残っていれば取り込み直し、
+    なければ同じ URL で保存済みの画像を使い回す。どちらにもない画像は数だけ報告する
+    """
+    # 消す前に引くので、残った画像は自分の古い行からも使い回せる
+    urls = {url for media_urls in media_changes.values() for url in media_urls}
+    known = {}
+    if urls:
+        known = {url: sha256 for url, sha256 in db.execute(
+            select(PostMedia.source_url, PostMedia.sha256).where(PostMedia.source_url.in_(urls)))}
+    db.execute(delete(PostMedia).where(PostMedia.post_id.in_(list(media_changes)), PostMedia.kind == "photo"))
+    assets: Dict[str, MediaAsset] = {}
+    for post_id, media_urls in media_changes.items():
+        msg = _source_message(db, post_id)
+        if msg is not None:
+            media = attach_local_media(db, msg, {"media_urls": media_urls}, assets)
+        else:
+            media = [PostMedia(kind="photo", position=i, source_url=url, sha256=known[url])
+                     for i, url in enumerate(media_urls) if url in known]
+        for item in media:
+            item.post_id = post_id
+            db.add(item)
+        summary["media_missing"] += len(media_urls) - len(media)
+    db.flush()
+    # 取り込み直した画像のサムネイル (既にあれば何もしない)
+    for asset in assets.values():
+        media_store.schedule_thumbnail(asset.sha256, asset.content_type)
+
+
+def _apply_batch(db: Session, rows, results, summary: dict, dry_run: bool) -> None:
+    rows_by_id = {row.id: row for row in rows}
+    pending = []
+    for post_id, extracted, error in results:
+        summary["scanned"] += 1
+        if error is not None:
+            summary["failed"] += 1
+            print(f"Reextract Error (post {post_id}): {error}")
+            continue
+        row = rows_by_id[post_id]
+        changed = _changed_fields(row, extracted)
+        if changed:
+            pending.append((row, extracted, changed))
+
+    # 一意な tweet_id を他の投稿と同じ値にしてしまう更新は、一括更新の前に除いて報告する
+    collisions = _tweet_id_collisions(db, pending)
+    post_updates: List[Dict] = []
+    media_changes: Dict[int, list] = {}
+    for row, extracted, changed in pending:
+        post_id = row.id
+        if post_id in collisions:
+            summary["collisions"] += 1
+            print(f"Reextract Skipped tweet_id (post {post_id}): {row.tweet_id} -> {collisions[post_id]} is already used")
+            changed = [field for field in changed if field != "tweet_id"]
+            if not changed:
+                continue
+        summary["changed"] += 1
+        for field in changed:
+            summary["fields"][field] = summary["fields"].get(field, 0) + 1
+        if dry_run:
+            continue
+        values = {"id": post_id}
+        values.update({field: extracted.get(field) for field in changed if field in POST_FIELDS})
+        if any(field in AUTHOR_FIELDS for field in changed):
+            author = get_or_create_author(
+                db,
+                extracted.get("author_screen_name") or row.author_screen_name,
+                extracted.get("author_name"),
+                extracted.get("author_avatar_url"),
+            )
+            db.flush()
+            if author is not None and author.id != row.author_id:
+                values["author_id"] = author.id
+        if len(values) > 1:
+            post_updates.append(values)
+        if "media_urls" in changed:
+            media_changes[post_id] = extracted.get("media_urls") or []
+
+    if post_updates:
+        # 変わったフィールドだけを主キー指定でまとめて更新する
+        db.execute(update(Post), post_updates)
+        # 本文やメディアが変わった投稿は近似重複の署名を作り直す
+        stale = [v["id"] for v in post_updates if "text" in v or "media_urls" in v]
+        if stale:
+            db.execute(delete(PostLshBucket).where(PostLshBucket.post_id.in_(stale)))
+            db.execute(delete(PostSignature).where(PostSignature.post_id.in_(stale)))
+    if media_changes:
+        _refresh_media(db, media_changes, summary)
+    db.commit()
+
+
+def reextract(workers: int, batch_size: int, dry_run: bool = False) -> dict:
+    """アーカイブしたすべての HTML に現在の抽出処理をかけ直し、変わったフィールドだけ更新する"""
+    init_db()
+    db = SessionLocal()
+    summary = {"scanned": 0, "changed": 0, "failed": 0, "collisions": 0, "media_missing": 0,
+               "thumbnails_failed": 0, "fields": {}}
+    columns = [
+        Post.id, Post.url, Post.raw_html_sha256, ArchivedHtml.codec, ArchivedHtml.charset, Post.author_id,
+        *(getattr(Post, field) for field in POST_FIELDS),
+        Author.screen_name.label("author_screen_name"),
+        Author.name.label("author_name"),
+        Author.avatar_url.label("author_avatar_url"),
+    ]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            last_id = 0
+            while True:
+                rows = db.execute(
+                    select(*columns)
+                    .join(ArchivedHtml, ArchivedHtml.sha256 == Post.raw_html_sha256)
+                    .outerjoin(Author, Author.id == Post.author_id)
+                    .where(Post.id > last_id).order_by(Post.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                jobs = [(row.id, row.url, row.raw_html_sha256, row.codec, row.charset) for row in rows]
+                results = list(pool.map(html_archive.extract_archived, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+                _apply_batch(db, rows, results, summary, dry_run)
+                last_id = rows[-1].id
+
+        if summary["changed"] and not dry_run:
+            # 著者別の件数やキャッシュのため集計し直す (データバージョンも進む)
+            counters.rebuild_counts(db)
+            dedup.ensure_signatures(db)
+    finally:
+        db.close()
+        summary["thumbnails_failed"] = media_store.wait_for_thumbnails()
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-run the current extractor over every archived page and update only the fields that changed."
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extractor processes")
+    parser.add_argument("--batch-size", type=int, default=500, help="posts per database round trip")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    summary = reextract(args.workers, args.batch_size, dry_run=args.dry_run)
+    print("\n--- Summary ---")
+    print(summary)
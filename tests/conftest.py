@@ -0,0 +1,121 @@
+# /tests/conftest.py
+"""テスト用の設定。api を import する前に、DB・メディア・HTML アーカイブの置き場所を一時ディレクトリへ向ける"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, Optional
+
+import pytest
+
+_tmp_root = tempfile.mkdtemp(prefix="xlm-test-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp_root, "test.db")
+os.environ["MEDIA_ROOT"] = os.path.join(_tmp_root, "media")
+os.environ["HTML_ARCHIVE_ROOT"] = os.path.join(_tmp_root, "html_archive")
+os.environ["SLOW_QUERY_MS"] = "0"
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from api import counters, database, dedup, models, page_cache, related  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _cleanup_tmp_root():
+    yield
+    database.engine.dispose()
+    shutil.rmtree(_tmp_root, ignore_errors=True)
+
+
+def clear_caches() -> None:
+    """データバージョンをキーにしたプロセス内キャッシュを捨てる (作り直した DB ではバージョンが 0 に戻るため)"""
+    counters._count_cache.clear()
+    page_cache.post_list_cache.clear()
+    page_cache.random_id_cache.clear()
+    dedup._clusters_cache.update(version=None, clusters=[])
+    related._index = None
+
+
+def reset_database() -> None:
+    """全テーブルを現在の定義で作り直す"""
+    database.Base.metadata.drop_all(database.engine)
+    database.init_db()
+    clear_caches()
+
+
+@pytest.fixture
+def db():
+    reset_database()
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def add_post(db, tweet_id: str, posted_at: Optional[datetime] = None, tags=(), folder_id=None, author=None,
+             commit: bool = True) -> models.Post:
+    """カウンタと関連投稿の索引を通して投稿を 1 件追加する (スクレイピングなしの create_post 相当)"""
+    from api import crud
+    post = models.Post(
+        url=f"https://x.com/{author or 'someone'}/status/{tweet_id}",
+        tweet_id=tweet_id,
+        text=f"post {tweet_id}",
+        posted_at=posted_at,
+        folder_id=folder_id,
+        author=crud.get_or_create_author(db, author) if author else None,
+    )
+    post.tags = [crud.get_tag_by_name(db, name) or models.Tag(name=name) for name in tags]
+    db.add(post)
+    db.flush()
+    counters.record_post_added(db, post.folder_id, [t.id for t in post.tags], post.author_id, post.posted_at)
+    if commit:
+        db.commit()
+        if post.tags:
+            related.record_post_tags(post.id, [t.id for t in post.tags], counters.get_tag_version(db))
+    return post
+
+
+def tweet_article(tweet_id: str, text: str, author: str = "alice", posted_at: str = "2023-03-01T10:00:00.000Z",
+                  quote: str = "", photos=(), avatar: Optional[str] = None) -> str:
+    """保存した X のページにある投稿 1 件分の article。quote には引用の枠 (quote_box) を入れる"""
+    images = "".join(f'<div data-testid="tweetPhoto"><img src="{url}"></div>' for url in photos)
+    if avatar:
+        images += f'<div data-testid="UserAvatar-Container-{author}"><img src="{avatar}"></div>'
+    return f"""<article data-testid="tweet">
+<div data-testid="User-Name"><a href="/{author}"><span>{author.title()}</span></a><div><a href="/{author}"><span>@{author}</span></a></div></div>
+<div data-testid="tweetText"><span>{text}</span></div>{quote}{images}
+<a href="/{author}/status/{tweet_id}"><time datetime="{posted_at}">t</time></a>
+</article>"""
+
+
+def quote_box(tweet_id: str, text: str, author: str = "bob", posted_at: str = "2023-02-01T10:00:00.000Z") -> str:
+    return f"""<div role="link">
+<div data-testid="User-Name"><span>{author.title()}</span><div><span>@{author}</span></div></div>
+<div data-testid="tweetText"><span>{text}</span></div>
+<a href="/{author}/status/{tweet_id}"><time datetime="{posted_at}">t</time></a>
+</div>"""
+
+
+def make_page_mhtml(url: str, articles: str, images: Optional[Dict[str, bytes]] = None) -> bytes:
+    """article を並べたページを MHTML にする。images は {Content-Location: 画像のバイト列} (PNG として埋め込む)"""
+    message = MIMEMultipart("related")
+    message["Snapshot-Content-Location"] = url
+    part = MIMEText(f"<html><body>{articles}</body></html>", "html", "utf-8")
+    part["Content-Location"] = url
+    message.attach(part)
+    for location, data in (images or {}).items():
+        image = MIMEImage(data, "png")
+        image["Content-Location"] = location
+        message.attach(image)
+    return message.as_bytes()
+
+
+def make_mhtml(tweet_id: str, text: str, author: str = "alice", posted_at: str = "2023-03-01T10:00:00.000Z") -> bytes:
+    """保存した X の投稿ページと同じ形の MHTML (画像なし) を作る"""
+    return make_page_mhtml(f"https://x.com/{author}/status/{tweet_id}", tweet_article(tweet_id, text, author, posted_at))
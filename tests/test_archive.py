@@ -0,0 +1,111 @@
+# /tests/test_archive.py
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from api import dedup, html_archive, media_store, models
+from conftest import make_mhtml, make_page_mhtml, tweet_article
+from scripts import import_mhtml, reextract
+
+PAGE = ("<html><body>" + "<div class='row'>repeated markup</div>" * 200 + "</body></html>").encode()
+
+
+@pytest.mark.parametrize("codec", ["zstd", "gzip"])
+def test_store_compresses_once_per_content(db, codec, monkeypatch):
+    if codec == "gzip":
+        # zstandard がない環境
+        monkeypatch.setattr(html_archive, "zstandard", None)
+    entry = html_archive.store(db, PAGE, "utf-8")
+    db.commit()
+    assert entry.codec == codec
+    assert entry.size == len(PAGE) and entry.compressed_size < len(PAGE) // 10
+    assert html_archive.load(entry.sha256, entry.codec) == PAGE
+
+    path = html_archive.archive_path(entry.sha256, entry.codec)
+    mtime = os.stat(path).st_mtime_ns
+    assert html_archive.store(db, PAGE, "utf-8") is entry
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def _import(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return import_mhtml.parse_and_import(str(path))
+
+
+def _post(db, post_id):
+    db.expire_all()
+    return db.get(models.Post, post_id)
+
+
+def test_reextract_updates_only_changed_fields(db, tmp_path):
+    first = _import(tmp_path, "a.mhtml", make_mhtml("101", "correct text"))["post_id"]
+    second = _import(tmp_path, "b.mhtml", make_mhtml("102", "untouched", author="bob"))["post_id"]
+    # 古い抽出処理が本文を取り違えて保存していた
+    post = db.get(models.Post, first)
+    post.text = "garbled"
+    db.commit()
+
+    summary = reextract.reextract(workers=1, batch_size=1, dry_run=True)
+    assert summary["scanned"] == 2 and summary["changed"] == 1
+    assert summary["fields"] == {"text": 1}
+    assert _post(db, first).text == "garbled"
+
+    summary = reextract.reextract(workers=2, batch_size=1)
+    assert summary["changed"] == 1 and summary["failed"] == 0
+    assert _post(db, first).text == "correct text"
+    assert _post(db, second).text == "untouched"
+    # 本文が変わった投稿の近似重複の署名は作り直される
+    assert db.get(models.PostSignature, first).signature is not None
+    assert reextract.reextract(workers=1, batch_size=10)["changed"] == 0
+
+
+def test_reextract_skips_tweet_id_collisions(db, tmp_path):
+    kept = _import(tmp_path, "a.mhtml", make_mhtml("101", "first"))["post_id"]
+    # 別のページが取り違えた tweet_id で保存されていて、正しい値は既存の投稿のもの
+    other = _import(tmp_path, "b.mhtml", make_page_mhtml("https://x.com/alice/status/101",
+                                                         tweet_article("101", "second copy")))
+    assert other["status"] == "skipped"
+    moved = _import(tmp_path, "c.mhtml", make_mhtml("103", "third"))["post_id"]
+    post = db.get(models.Post, moved)
+    post.url = "https://x.com/alice/status/101"
+    db.commit()
+
+    summary = reextract.reextract(workers=1, batch_size=10)
+    assert summary["collisions"] == 1
+    assert _post(db, moved).tweet_id == "103"
+    assert _post(db, kept).tweet_id == "101"
+
+
+def test_reextract_refreshes_photos_from_the_source_file(db, tmp_path):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (10, 200, 10)).save(buffer, "PNG")
+    photo_url = "https://pbs.twimg.com/media/NEW.jpg?name=small"
+    data = make_page_mhtml("https://x.com/alice/status/101", tweet_article("101", "photo", photos=[photo_url]),
+                           images={photo_url: buffer.getvalue()})
+    path = tmp_path / "a.mhtml"
+    path.write_bytes(data)
+    # マニフェストから元の MHTML をたどれるように import_files で取り込む
+    post_id = import_mhtml.import_files([str(path)])[0]["post_id"]
+    media_store.wait_for_thumbnails()
+    # 古い抽出処理では画像を取り出せていなかった
+    post = db.get(models.Post, post_id)
+    post.media_urls = []
+    post.local_media = []
+    db.commit()
+
+    summary = reextract.reextract(workers=1, batch_size=10)
+    assert summary["fields"] == {"media_urls": 1}
+    assert summary["media_missing"] == 0 and summary["thumbnails_failed"] == 0
+    post = _post(db, post_id)
+    assert [m.source_url for m in post.local_media] == [photo_url.split("?")[0] + "?format=jpg&name=orig"]
+    assert dedup.ensure_signatures(db) == 0
+
+    # 元のファイルがなくなっていれば、保存済みの画像がない分を数えて報告する
+    path.unlink()
+    post.media_urls = []
+    post.local_media = []
+    db.commit()
+    assert reextract.reextract(workers=1, batch_size=10)["media_missing"] == 1
@@ -0,0 +1,93 @@
+# /tests/test_autotag.py
+import pytest
+from fastapi.testclient import TestClient
+
+from api import autotag, counters, crud, models, schemas
+from conftest import add_post
+
+CAT = ["猫がソファで寝ている", "うちの猫が箱に入った", "子猫の寝顔がかわいい", "猫じゃらしで遊ぶ猫"]
+DOG = ["犬の散歩で公園へ行った", "柴犬が雪の中を走る", "犬がボールを持ってきた", "散歩のあとの犬"]
+
+
+def _post(db, tweet_id, text, tags=(), author=None):
+    post = add_post(db, tweet_id, tags=tags, author=author, commit=False)
+    post.text = text
+    return post
+
+
+@pytest.fixture
+def library(db):
+    counters.ensure_counts(db)
+    for i, text in enumerate(CAT):
+        _post(db, f"c{i}", text, tags=["cat"], author="catlover")
+    for i, text in enumerate(DOG):
+        _post(db, f"d{i}", text, tags=["dog"])
+    _post(db, "once", "一度だけのタグ", tags=["rare"])
+    posts = {
+        "cat": _post(db, "u1", "猫が窓の外を見ている", author="catlover"),
+        "dog": _post(db, "u2", "犬と散歩して公園で遊んだ"),
+        "other": _post(db, "u3", "今日の夕飯はカレーライス"),
+    }
+    db.commit()
+    return posts
+
+
+def _suggested(db, min_score=0.0):
+    return {post_id: [(tag.name, score) for tag, score in suggestions]
+            for post_id, suggestions in autotag.list_suggestions(db, min_score=min_score).items()}
+
+
+def test_refresh_suggests_the_closest_tags(db, library):
+    summary = autotag.generate_suggestions(db, top_k=2, min_score=0.05)
+    assert summary["trained_posts"] == 9
+    assert summary["untagged_posts"] == 3
+    # 1 件にしか付いていないタグは学習に使わない
+    assert summary["tags"] == 2
+
+    suggested = _suggested(db)
+    assert suggested[library["cat"].id][0][0] == "cat"
+    assert suggested[library["dog"].id][0][0] == "dog"
+    assert all(name != "rare" for items in suggested.values() for name, _ in items)
+    for items in suggested.values():
+        assert [score for _, score in items] == sorted((score for _, score in items), reverse=True)
+        assert len(items) <= 2
+
+    # 作り直すと前回の候補は残らない
+    autotag.generate_suggestions(db, top_k=1, min_score=0.99)
+    assert _suggested(db) == {}
+
+
+def test_posts_tagged_by_hand_drop_out_of_the_list(db, library):
+    autotag.generate_suggestions(db, top_k=2, min_score=0.05)
+    crud.update_post_tags(db, library["cat"].id, ["cat"])
+    assert library["cat"].id not in _suggested(db)
+
+
+def test_accept_tags_posts_and_updates_counters(db, library):
+    autotag.generate_suggestions(db, top_k=1, min_score=0.05)
+    version = counters.get_version(db)
+    result = autotag.accept_suggestions(db, [library["cat"].id, library["dog"].id])
+    assert result == {"accepted": 2, "posts": 2}
+
+    db.expire_all()
+    assert [t.name for t in db.get(models.Post, library["cat"].id).tags] == ["cat"]
+    assert [t.name for t in db.get(models.Post, library["dog"].id).tags] == ["dog"]
+    assert crud.count_posts(db, schemas.PostFilter(tag_names=["cat"])) == 5
+    assert crud.get_tag_by_name(db, "cat").post_count == 5
+    assert counters.get_version(db) > version
+    assert set(_suggested(db)) <= {library["other"].id}
+    # 受け入れ済みの投稿をもう一度指定しても何も起きない
+    assert autotag.accept_suggestions(db, [library["cat"].id]) == {"accepted": 0, "posts": 0}
+
+
+def test_suggestion_endpoints(db, library):
+    from api.index import app
+    client = TestClient(app)
+    assert client.post("/api/tag_suggestions/refresh", params={"min_score": 0.05}).json()["untagged_posts"] == 3
+    listed = client.get("/api/tag_suggestions", params={"min_score": 0.05}).json()
+    by_post = {item["post"]["id"]: item["suggestions"] for item in listed}
+    assert by_post[library["cat"].id][0]["tag"]["name"] == "cat"
+
+    response = client.post("/api/tag_suggestions/accept", json={"post_ids": [library["cat"].id]})
+    assert response.json()["accepted"] >= 1
+    assert library["cat"].id not in {item["post"]["id"] for item in client.get("/api/tag_suggestions").json()}
@@ -0,0 +1,108 @@
+# /tests/test_backup.py
+import io
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from api import backup, counters, crud, models, schemas
+from conftest import add_post, make_page_mhtml, quote_box, reset_database, tweet_article
+from scripts import import_mhtml
+
+
+def _post(db, tweet_id):
+    return db.query(models.Post).filter(models.Post.tweet_id == tweet_id).one()
+
+
+def _export(db, fmt):
+    return "".join(backup.iter_export(db, fmt=fmt, batch_size=2))
+
+
+def _read(text, fmt):
+    stream = io.StringIO(text, newline="")
+    return backup.read_csv(stream) if fmt == "csv" else backup.read_ndjson(stream)
+
+
+@pytest.mark.parametrize("fmt", backup.EXPORT_FORMATS)
+def test_thread_and_quote_links_survive_a_round_trip(db, tmp_path, fmt):
+    path = tmp_path / "thread.mhtml"
+    path.write_bytes(make_page_mhtml("https://x.com/alice/status/102", "".join([
+        tweet_article("101", "first"),
+        tweet_article("102", "second", quote=quote_box("50", "quoted")),
+        tweet_article("103", "third"),
+    ])))
+    import_mhtml.parse_and_import(str(path))
+    exported = _export(db, fmt)
+    db.close()
+
+    reset_database()
+    # 引用元が最後に来るように逆順で、返信先より先に返信を投入する
+    records = list(_read(exported, fmt))[::-1]
+    summary = backup.restore_records(db, records, batch_size=2)
+    assert summary == {"added": 4, "skipped": 0, "linked": 3}
+
+    posts = {p.tweet_id: p for p in db.query(models.Post)}
+    assert posts["102"].parent_post_id == posts["101"].id
+    assert posts["102"].quoted_post_id == posts["50"].id
+    assert posts["103"].parent_post_id == posts["102"].id
+    assert posts["101"].parent_post_id is None
+
+
+def _library(db):
+    """フォルダ・タグ・著者・メディア URL を持つ投稿と、何もない投稿"""
+    folder = crud.create_folder(db, schemas.FolderCreate(name="inbox"))
+    add_post(db, "1", posted_at=datetime(2022, 1, 5, 10), tags=["cat", "Ｃａｔ"], folder_id=folder.id, author="alice")
+    add_post(db, "2", posted_at=datetime(2022, 2, 5, 10), tags=["dog"], author="bob")
+    post = add_post(db, "3")
+    post.media_urls = ["https://pbs.twimg.com/media/A.jpg?format=jpg&name=orig"]
+    post.text = 'quote "and", comma\nnewline'
+    db.commit()
+
+
+@pytest.mark.parametrize("fmt", backup.EXPORT_FORMATS)
+def test_round_trip_keeps_every_field(db, fmt):
+    _library(db)
+    exported = _export(db, fmt)
+    db.close()
+
+    reset_database()
+    assert backup.restore_records(db, _read(exported, fmt), batch_size=2) == {"added": 3, "skipped": 0, "linked": 0}
+    assert _export(db, fmt) == exported
+    # 一括投入の後でカウンタは集計し直されている
+    assert counters.get_count(db, "all") == 3
+    assert crud.count_posts(db, schemas.PostFilter(tag_names=["cat"], author="alice")) == 1
+
+
+def test_restore_skips_existing_and_repeated_tweets(db):
+    _library(db)
+    records = list(backup.iter_export_records(db))
+    assert backup.restore_records(db, records) == {"added": 0, "skipped": 3, "linked": 0}
+
+    # ファイル内で同じ tweet_id が続く場合は最初の 1 件だけ、tweet_id のない投稿は URL で見分ける
+    new = dict(records[0], tweet_id="9", url="https://x.com/alice/status/9")
+    no_id = dict(records[0], tweet_id=None, url="https://example.com/page")
+    summary = backup.restore_records(db, [new, dict(new, text="changed"), no_id, no_id], batch_size=2)
+    assert summary == {"added": 2, "skipped": 2, "linked": 0}
+    assert _post(db, "9").text == records[0]["text"]
+    assert counters.get_count(db, "all") == 5
+
+
+@pytest.fixture
+def local_time_in_tokyo():
+    """サーバーのタイムゾーンが UTC でない環境を再現する"""
+    original = os.environ.get("TZ")
+    os.environ["TZ"] = "Asia/Tokyo"
+    time.tzset()
+    yield
+    if original is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = original
+    time.tzset()
+
+
+def test_missing_created_at_is_restored_as_utc(db, local_time_in_tokyo):
+    backup.restore_records(db, [{"tweet_id": "1", "url": "https://x.com/a/status/1", "created_at": None}])
+    created_at = _post(db, "1").created_at.replace(tzinfo=timezone.utc)
+    assert abs(created_at - datetime.now(timezone.utc)) < timedelta(minutes=5)
@@ -0,0 +1,48 @@
+# /tests/test_batch.py
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import crud, schemas
+from conftest import add_post
+
+
+@pytest.fixture
+def client(db):
+    from api.index import app
+    return TestClient(app)
+
+
+def _queries(response) -> int:
+    return int(re.search(r'desc="(\d+) queries"', response.headers["server-timing"]).group(1))
+
+
+def test_returns_posts_by_id_and_the_missing_ids(client, db):
+    folder = crud.create_folder(db, schemas.FolderCreate(name="inbox"))
+    first = add_post(db, "1", tags=["cat", "dog"], folder_id=folder.id, author="alice")
+    second = add_post(db, "2")
+
+    response = client.get("/api/posts/batch", params={"ids": f"{second.id}, {first.id},999,{first.id}"})
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body["posts"]) == {str(first.id), str(second.id)}
+    assert sorted(t["name"] for t in body["posts"][str(first.id)]["tags"]) == ["cat", "dog"]
+    assert body["posts"][str(first.id)]["author_screen_name"] == "alice"
+    assert body["missing"] == [999]
+
+
+def test_query_count_does_not_grow_with_the_batch(client, db):
+    folder = crud.create_folder(db, schemas.FolderCreate(name="inbox"))
+    ids = [add_post(db, str(i), tags=[f"t{i % 4}"], folder_id=folder.id, author=f"user{i % 3}", commit=False).id
+           for i in range(30)]
+    db.commit()
+    small = client.get("/api/posts/batch", params={"ids": ",".join(map(str, ids[:2]))})
+    large = client.get("/api/posts/batch", params={"ids": ",".join(map(str, ids))})
+    assert len(large.json()["posts"]) == 30
+    assert _queries(large) == _queries(small)
+
+
+@pytest.mark.parametrize("ids", ["1,two", ",".join(str(i) for i in range(101))])
+def test_rejects_bad_or_too_many_ids(client, ids):
+    assert client.get("/api/posts/batch", params={"ids": ids}).status_code == 400
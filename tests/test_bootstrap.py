@@ -0,0 +1,93 @@
+# /tests/test_bootstrap.py
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import counters, crud
+from conftest import add_post
+
+
+@pytest.fixture
+def client(db):
+    from api.index import app
+    # 起動時と同じくカウンタを作っておく (初回の集計でもデータバージョンが進むため)
+    counters.ensure_counts(db)
+    return TestClient(app)
+
+
+def test_bootstrap_returns_the_first_page_with_counts(client, db):
+    for i in range(3):
+        add_post(db, str(i), posted_at=datetime(2022, 1, 1 + i), tags=["cat"])
+    response = client.get("/api/bootstrap", params={"limit": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert [p["tweet_id"] for p in data["posts"]] == ["2", "1"]
+    assert data["total"] == 3
+    assert [(t["name"], t["post_count"]) for t in data["tags"]] == [("cat", 3)]
+    assert response.headers["ETag"] == f'"bootstrap-{data["version"]}"'
+    assert data["version"] == counters.get_version(db)
+
+
+@pytest.mark.parametrize("if_none_match", ["{etag}", "W/{etag}", '"other", {etag}', "*"])
+def test_unchanged_data_revalidates_with_304(client, db, if_none_match):
+    add_post(db, "1")
+    etag = client.get("/api/bootstrap").headers["ETag"]
+    response = client.get("/api/bootstrap", headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_a_write_changes_the_etag(client, db):
+    post = add_post(db, "1", tags=["cat"])
+    first = client.get("/api/bootstrap")
+    etag = first.headers["ETag"]
+
+    assert client.put(f"/api/posts/{post.id}/tags", json={"tags": ["dog"]}).status_code == 200
+    response = client.get("/api/bootstrap", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    counts = {t["name"]: t["post_count"] for t in response.json()["tags"]}
+    assert (counts["dog"], counts.get("cat", 0)) == (1, 0)
+
+    add_post(db, "2")
+    again = client.get("/api/bootstrap", headers={"If-None-Match": response.headers["ETag"]})
+    assert again.status_code == 200
+    assert again.json()["total"] == 2
+
+
+def test_a_write_during_the_build_is_read_again(client, db, monkeypatch):
+    add_post(db, "1")
+    count_posts = crud.count_posts
+    writes = iter(["2"])
+
+    def count_while_writing(*args, **kwargs):
+        # 1 回目の組み立ての途中で別の書き込みが入る
+        tweet_id = next(writes, None)
+        if tweet_id is not None:
+            add_post(db, tweet_id)
+        return count_posts(*args, **kwargs)
+
+    monkeypatch.setattr(crud, "count_posts", count_while_writing)
+    response = client.get("/api/bootstrap")
+    data = response.json()
+    assert data["total"] == len(data["posts"]) == 2
+    assert data["version"] == counters.get_version(db)
+    assert response.headers["ETag"] == f'"bootstrap-{data["version"]}"'
+
+
+def test_continuous_writes_are_not_cached(client, db, monkeypatch):
+    add_post(db, "1")
+    count_posts = crud.count_posts
+    tweet_ids = iter(range(100, 200))
+
+    def count_while_writing(*args, **kwargs):
+        add_post(db, str(next(tweet_ids)))
+        return count_posts(*args, **kwargs)
+
+    monkeypatch.setattr(crud, "count_posts", count_while_writing)
+    response = client.get("/api/bootstrap")
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert response.headers["Cache-Control"] == "no-store"
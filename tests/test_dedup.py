@@ -0,0 +1,68 @@
+# /tests/test_dedup.py
+import numpy as np
+from fastapi.testclient import TestClient
+
+from api import backup, dedup, models
+from conftest import add_post, make_mhtml, reset_database
+from scripts import import_mhtml
+
+ORIGINAL = "今日は駅前の新しいカフェでチーズケーキを食べました。とても美味しかったのでまた行きたいです"
+COPY = "今日は駅前の新しいカフェでチーズケーキを食べました。とても美味しかったのでまた行きたいです！！ https://t.co/abc"
+OTHER = "週末は山に登って紅葉を見てきました。天気が良くて頂上からの景色が最高でした"
+
+
+def test_signatures_estimate_similarity():
+    signatures, present = dedup.compute_signatures(
+        [ORIGINAL, COPY, OTHER, "", None, "猫"],
+        [None, None, None, ["https://pbs.twimg.com/media/ABC.jpg?name=small"], None, None],
+    )
+    assert present.tolist() == [True, True, True, True, False, True]
+    assert dedup.similarity(signatures[0], signatures[1]) >= dedup.DUPLICATE_THRESHOLD
+    assert dedup.similarity(signatures[0], signatures[2]) < 0.2
+    # バッチの組み方で署名は変わらない
+    alone, _ = dedup.compute_signatures([COPY], [None])
+    assert np.array_equal(alone[0], signatures[1])
+
+
+def _import(tmp_path, tweet_id, text, author="alice"):
+    path = tmp_path / f"{tweet_id}.mhtml"
+    path.write_bytes(make_mhtml(tweet_id, text, author=author))
+    return import_mhtml.parse_and_import(str(path))
+
+
+def test_import_reports_the_older_near_duplicate(db, tmp_path):
+    first = _import(tmp_path, "101", ORIGINAL)
+    assert "duplicate_of" not in first
+    assert "duplicate_of" not in _import(tmp_path, "102", OTHER)
+    copy = _import(tmp_path, "103", COPY, author="bob")
+    assert copy["duplicate_of"] == first["post_id"]
+
+    assert dedup.find_clusters(db) == [[first["post_id"], copy["post_id"]]]
+
+
+def test_duplicates_endpoint_only_reads(db, tmp_path):
+    ids = [_import(tmp_path, tweet_id, text)["post_id"] for tweet_id, text in [("101", ORIGINAL), ("102", COPY)]]
+    # 署名のない投稿があっても GET では作らない
+    add_post(db, "103")
+    signatures = db.query(models.PostSignature).count()
+
+    from api.index import app
+    response = TestClient(app).get("/api/duplicates")
+    assert response.status_code == 200
+    assert [[p["id"] for p in c["posts"]] for c in response.json()] == [ids]
+    db.expire_all()
+    assert db.query(models.PostSignature).count() == signatures
+
+
+def test_restore_writes_signatures(db, tmp_path):
+    for tweet_id, text in [("101", ORIGINAL), ("102", COPY), ("103", OTHER)]:
+        _import(tmp_path, tweet_id, text)
+    exported = list(backup.iter_export_records(db))
+    db.close()
+
+    reset_database()
+    backup.restore_records(db, exported)
+    assert db.query(models.PostSignature).count() == 3
+    assert dedup.ensure_signatures(db) == 0
+    posts = {p.tweet_id: p.id for p in db.query(models.Post)}
+    assert dedup.find_clusters(db) == [[posts["101"], posts["102"]]]
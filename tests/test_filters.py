@@ -0,0 +1,95 @@
+# /tests/test_filters.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import crud, schemas
+from conftest import add_post
+
+TAGS = ["cat", "dog", "bird"]
+AUTHORS = ["alice", "bob", "carol"]
+
+
+@pytest.fixture
+def library(db):
+    """フォルダ・タグ・著者・投稿日時がばらばらな 90 件。同じ時刻の投稿と日時のない投稿も含む"""
+    folders = [crud.create_folder(db, schemas.FolderCreate(name=name)).id for name in ("inbox", "art")]
+    posts = []
+    for i in range(90):
+        tags = [t for j, t in enumerate(TAGS) if (i >> j) & 1]
+        posted_at = None if i % 17 == 0 else datetime(2022, 1, 1) + timedelta(hours=13 * (i // 2))
+        post = add_post(db, str(i), posted_at=posted_at, tags=tags, folder_id=folders[i % 3] if i % 3 < 2 else None,
+                        author=AUTHORS[i % 3 if i % 5 else 0], commit=False)
+        posts.append((post.id, posted_at, set(tags), post.folder_id, AUTHORS[i % 3 if i % 5 else 0]))
+    db.commit()
+    return folders, posts
+
+
+def _expected(posts, folder_id=None, tag_names=(), author=None, posted_from=None, posted_to=None, sort_order="desc"):
+    """条件に合う投稿を 1 件ずつ調べて並べる (日時のない投稿はどちらの順でも最後)"""
+    def to_utc(value):
+        return value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+
+    posted_from, posted_to = to_utc(posted_from), to_utc(posted_to)
+    matched = [
+        (post_id, posted_at) for post_id, posted_at, tags, folder, name in posts
+        if (folder_id is None or folder == folder_id)
+        and set(tag_names) <= tags
+        and (author is None or name == author)
+        and (posted_from is None or (posted_at is not None and posted_at >= posted_from))
+        and (posted_to is None or (posted_at is not None and posted_at <= posted_to))
+    ]
+    descending = sort_order == "desc"
+    dated = sorted((p for p in matched if p[1] is not None), key=lambda p: (p[1], p[0]), reverse=descending)
+    undated = sorted((p for p in matched if p[1] is None), key=lambda p: p[0], reverse=descending)
+    return [post_id for post_id, _ in dated + undated]
+
+
+CASES = [
+    {},
+    {"tag_names": ["cat"]},
+    {"tag_names": ["cat", "dog"]},
+    {"tag_names": ["cat", "dog", "bird"], "author": "alice"},
+    {"folder": 0, "tag_names": ["bird"]},
+    {"folder": 1, "author": "bob"},
+    {"folder": 0, "tag_names": ["dog"], "author": "alice",
+     "posted_from": datetime(2022, 1, 3, 9, tzinfo=timezone(timedelta(hours=9)))},
+    {"posted_from": datetime(2022, 1, 5), "posted_to": datetime(2022, 1, 12, 12)},
+    {"tag_names": ["missing"]},
+    {"author": "nobody"},
+]
+
+
+@pytest.mark.parametrize("case", CASES, ids=lambda c: "+".join(c) or "none")
+def test_combined_filters_match_a_direct_scan(db, library, case):
+    folders, posts = library
+    kwargs = dict(case)
+    if "folder" in kwargs:
+        kwargs["folder_id"] = folders[kwargs.pop("folder")]
+    filters = schemas.PostFilter(**kwargs)
+    expected = _expected(posts, **kwargs)
+
+    assert [p.id for p in crud.query_posts(db, filters, limit=1000)] == expected
+    assert [p.id for p in crud.query_posts(db, filters, limit=1000, sort_order="asc")] == _expected(
+        posts, sort_order="asc", **kwargs)
+    assert [p.id for p in crud.query_posts(db, filters, skip=3, limit=4)] == expected[3:7]
+    assert crud.count_posts(db, filters) == len(expected)
+
+
+def test_rarest_condition_is_planned_first(db, library):
+    folders, _posts = library
+    filters = schemas.PostFilter(tag_names=["cat", "dog", "bird"], folder_id=folders[0], author="alice")
+    predicates = crud._plan_predicates(db, filters)
+    assert [estimate for estimate, _kind, _value in predicates] == sorted(p[0] for p in predicates)
+    assert sorted(kind for _estimate, kind, _value in predicates) == ["author", "folder", "tag", "tag", "tag"]
+
+
+def test_filters_through_the_api(db, library):
+    folders, posts = library
+    from api.index import app
+    response = TestClient(app).get("/api/posts/", params={
+        "folder_id": folders[1], "tag_names": "cat, bird", "limit": 100, "with_total": True})
+    expected = _expected(posts, folder_id=folders[1], tag_names=["cat", "bird"])
+    assert [p["id"] for p in response.json()] == expected
+    assert response.headers["X-Total-Count"] == str(len(expected))
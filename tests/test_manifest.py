@@ -0,0 +1,71 @@
+# /tests/test_manifest.py
+import os
+
+from api import models
+from conftest import make_mhtml
+from scripts import import_mhtml
+
+
+def _write(path, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def _statuses(results):
+    return [(os.path.basename(r["file_path"]), r["status"]) for r in results]
+
+
+def test_unchanged_files_are_skipped_without_parsing(db, tmp_path, monkeypatch):
+    first = _write(tmp_path / "a.mhtml", make_mhtml("101", "first"))
+    second = _write(tmp_path / "b.mhtml", make_mhtml("102", "second"))
+    assert _statuses(import_mhtml.import_files([first, second])) == [("a.mhtml", "added"), ("b.mhtml", "added")]
+
+    parsed = []
+    monkeypatch.setattr(import_mhtml, "parse_and_import", lambda *args: parsed.append(args) or {"status": "added"})
+    results = import_mhtml.import_files([first, second])
+    assert _statuses(results) == [("a.mhtml", "skipped"), ("b.mhtml", "skipped")]
+    assert all(r["reason"] == "Unchanged since last import" for r in results)
+    assert parsed == []
+
+
+def test_force_reparses_known_files(db, tmp_path):
+    path = _write(tmp_path / "a.mhtml", make_mhtml("101", "first"))
+    import_mhtml.import_files([path])
+    results = import_mhtml.import_files([path], force=True)
+    # 再パースはするが、投稿は既にあるので追加はされない
+    assert results[0]["status"] == "skipped"
+    assert results[0]["reason"] == "Post already exists"
+
+
+def test_failed_files_are_retried_even_if_unchanged(db, tmp_path):
+    path = _write(tmp_path / "broken.mhtml", b"MIME-Version: 1.0\nContent-Type: text/plain\n\nnot a page")
+    assert import_mhtml.import_files([path])[0]["status"] == "failed"
+
+    # 同じサイズ・更新時刻のまま中身だけ直ったとしても、失敗した記録ではスキップしない
+    stat = os.stat(path)
+    _write(path, make_mhtml("101", "fixed"))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    entry = db.get(models.ImportManifest, path)
+    entry.size = os.stat(path).st_size
+    db.commit()
+
+    assert import_mhtml.import_files([path])[0]["status"] == "added"
+    db.expire_all()
+    assert db.get(models.ImportManifest, path).status == "added"
+
+
+def test_copy_of_imported_content_keeps_the_original_status(db, tmp_path):
+    data = make_mhtml("101", "first")
+    original = _write(tmp_path / "a.mhtml", data)
+    copy = _write(tmp_path / "copy-of-a.mhtml", data)
+
+    added = import_mhtml.import_files([original])[0]
+    result = import_mhtml.import_files([copy])[0]
+    assert result["status"] == "skipped"
+    assert result["reason"] == "Same content already imported"
+    assert result["post_id"] == added["post_id"]
+
+    entry = db.get(models.ImportManifest, copy)
+    assert entry.status == "added"
+    assert entry.post_id == added["post_id"]
@@ -0,0 +1,91 @@
+# /tests/test_media_store.py
+import hashlib
+import io
+import logging
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from api import media_store, models
+from conftest import make_page_mhtml, tweet_article
+from scripts import import_mhtml
+
+PHOTO_URL = "https://pbs.twimg.com/media/ABC.jpg?name=small"
+AVATAR_URL = "https://pbs.twimg.com/profile_images/1/alice_normal.jpg"
+
+
+def _png(size=(800, 400), color=(200, 30, 30)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_store, "MEDIA_ROOT", str(tmp_path / "media"))
+    yield tmp_path / "media"
+    media_store.wait_for_thumbnails()
+
+
+def _files(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _dirs, files in os.walk(root) for f in files)
+
+
+def test_store_bytes_is_content_addressed(store):
+    data = _png()
+    sha256 = media_store.store_bytes(data, "image/png")
+    assert sha256 == hashlib.sha256(data).hexdigest()
+    assert media_store.store_bytes(data, "image/png") == sha256
+    assert _files(store) == [os.path.join("originals", sha256[:2], sha256[2:4], sha256 + ".png")]
+
+
+def test_generate_thumbnail_shrinks_to_a_jpeg(store):
+    sha256 = media_store.store_bytes(_png(), "image/png")
+    assert media_store.generate_thumbnail(sha256, "image/png")
+    with Image.open(media_store.thumbnail_path(sha256)) as thumb:
+        assert thumb.format == "JPEG"
+        assert max(thumb.size) == media_store.THUMBNAIL_SIZE
+
+
+def test_broken_image_is_logged_and_counted(store, caplog):
+    sha256 = media_store.store_bytes(b"not an image", "image/png")
+    with caplog.at_level(logging.WARNING, logger=media_store.__name__):
+        assert media_store.generate_thumbnail(sha256, "image/png") is False
+    assert caplog.records[0].exc_info is not None
+    assert sha256 in caplog.records[0].getMessage()
+
+    good = media_store.store_bytes(_png(), "image/png")
+    media_store.schedule_thumbnail(sha256, "image/png")
+    media_store.schedule_thumbnail(good, "image/png")
+    assert media_store.wait_for_thumbnails() == 1
+    # 数えた失敗は次の呼び出しには持ち越さない
+    assert media_store.wait_for_thumbnails() == 0
+    # 書きかけの一時ファイルは残らない
+    assert not [f for f in _files(store) if ".tmp-" in f]
+
+
+def test_import_stores_embedded_images(db, store, tmp_path):
+    photo, avatar = _png(), _png((48, 48), (0, 0, 255))
+    article = tweet_article("101", "with photo", photos=[PHOTO_URL], avatar=AVATAR_URL)
+    path = tmp_path / "photo.mhtml"
+    path.write_bytes(make_page_mhtml("https://x.com/alice/status/101", article,
+                                     images={PHOTO_URL: photo, AVATAR_URL: avatar}))
+    result = import_mhtml.parse_and_import(str(path))
+    assert result["status"] == "added"
+    assert media_store.wait_for_thumbnails() == 0
+
+    post = db.get(models.Post, result["post_id"])
+    assert [(m.kind, m.asset.sha256) for m in post.local_media] == [
+        ("photo", hashlib.sha256(photo).hexdigest()), ("avatar", hashlib.sha256(avatar).hexdigest())]
+
+    from api.index import app
+    client = TestClient(app)
+    sha256 = post.local_media[0].asset.sha256
+    original = client.get(f"/api/media/{sha256}")
+    assert original.content == photo
+    assert "immutable" in original.headers["cache-control"]
+    thumb = client.get(f"/api/media/{sha256}/thumb")
+    assert thumb.headers["content-type"] == "image/jpeg"
+    assert client.get("/api/media/" + "0" * 64).status_code == 404
@@ -0,0 +1,64 @@
+# /tests/test_metrics.py
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import metrics
+from conftest import add_post
+
+
+@pytest.fixture
+def client(db):
+    from api.index import app
+    return TestClient(app)
+
+
+def _sample(text, name, **labels):
+    """Prometheus テキスト形式から 1 系列の値を読む (なければ 0)"""
+    body = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    pattern = re.escape(name + ("{" + body + "}" if labels else "")) + r" (\S+)"
+    match = re.search("^" + pattern + "$", text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("xlm_test_seconds", "Test.", labelnames=("path",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, 'a"b')
+    assert histogram.render() == [
+        "# HELP xlm_test_seconds Test.",
+        "# TYPE xlm_test_seconds histogram",
+        'xlm_test_seconds_bucket{path="a\\"b",le="0.1"} 1',
+        'xlm_test_seconds_bucket{path="a\\"b",le="1"} 3',
+        'xlm_test_seconds_bucket{path="a\\"b",le="+Inf"} 4',
+        'xlm_test_seconds_sum{path="a\\"b"} 4.05',
+        'xlm_test_seconds_count{path="a\\"b"} 4',
+    ]
+
+
+def test_requests_are_labelled_by_route_template(client):
+    labels = {"method": "GET", "endpoint": "/api/posts/{post_id}", "status": "404"}
+    before = _sample(metrics.render_metrics(), "xlm_http_request_duration_seconds_count", **labels)
+    unmatched = {"method": "GET", "endpoint": "unmatched", "status": "404"}
+    unmatched_before = _sample(metrics.render_metrics(), "xlm_http_request_duration_seconds_count", **unmatched)
+
+    assert client.get("/api/posts/123").status_code == 404
+    assert client.get("/api/posts/456").status_code == 404
+    assert client.get("/no/such/path").status_code == 404
+
+    text = client.get("/metrics").text
+    # 投稿 id ごとに系列が増えず、ルートのテンプレートでまとまる
+    assert _sample(text, "xlm_http_request_duration_seconds_count", **labels) == before + 2
+    assert _sample(text, "xlm_http_request_duration_seconds_count", **unmatched) == unmatched_before + 1
+    assert "/api/posts/123" not in text
+
+
+def test_server_timing_reports_the_request_queries(client, db):
+    add_post(db, "1", tags=["cat"])
+    response = client.get("/api/posts/", params={"tag_names": "cat"})
+    assert response.status_code == 200
+    match = re.fullmatch(r'db;dur=([\d.]+);desc="(\d+) queries", app;dur=([\d.]+)', response.headers["server-timing"])
+    assert match is not None
+    assert int(match.group(2)) > 0
+    assert float(match.group(1)) <= float(match.group(3))
@@ -0,0 +1,124 @@
+# /tests/test_migrations.py
+"""最初のリリースのスキーマで作られたデータベースを init_db が現在の定義に合わせられることを確かめる"""
+import pytest
+from sqlalchemy import inspect
+
+from api import counters, crud, database, models, schemas
+from conftest import clear_caches, reset_database
+
+# 最初のリリース (authors テーブル・name_norm・カウンタがない頃) の SQLite のスキーマ
+LEGACY_SCHEMA = [
+    "CREATE TABLE folders (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)",
+    "CREATE TABLE tags (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)",
+    """CREATE TABLE posts (
+        id INTEGER PRIMARY KEY, url VARCHAR NOT NULL, tweet_id VARCHAR UNIQUE, text TEXT,
+        author_name VARCHAR, author_screen_name VARCHAR, author_avatar_url VARCHAR,
+        posted_at DATETIME, media_urls JSON, favorite_count INTEGER, folder_id INTEGER REFERENCES folders (id),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP)""",
+    "CREATE TABLE post_tag (post_id INTEGER REFERENCES posts (id), tag_id INTEGER REFERENCES tags (id))",
+]
+
+LEGACY_POSTS = [
+    # id, tweet_id, author_name, author_screen_name, posted_at
+    (1, "101", "Alice", "alice", "2022-01-05 10:00:00.000000"),
+    (2, "102", None, "alice", "2022-01-20 10:00:00.000000"),
+    (3, "103", "Bob", "bob", "2022-02-01 10:00:00.000000"),
+    (4, "104", None, None, None),
+]
+
+
+@pytest.fixture
+def legacy_db():
+    database.Base.metadata.drop_all(database.engine)
+    with database.engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("INSERT INTO tags (id, name) VALUES (1, 'Ｃａｔ'), (2, 'dog')")
+        for post_id, tweet_id, name, screen_name, posted_at in LEGACY_POSTS:
+            conn.exec_driver_sql(
+                "INSERT INTO posts (id, url, tweet_id, text, author_name, author_screen_name, posted_at) "
+                "VALUES (?, ?, ?, 'text', ?, ?, ?)",
+                (post_id, f"https://x.com/{screen_name}/status/{tweet_id}", tweet_id, name, screen_name, posted_at),
+            )
+        conn.exec_driver_sql("INSERT INTO post_tag (post_id, tag_id) VALUES (1, 1), (2, 1), (3, 2)")
+
+    database.init_db()
+    clear_caches()
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        # 後のテストのために現在の定義で作り直す
+        reset_database()
+
+
+def test_adds_new_tables_and_columns(legacy_db):
+    inspector = inspect(database.engine)
+    assert {"authors", "post_counts", "data_version", "import_manifest"} <= set(inspector.get_table_names())
+    assert "author_id" in {c["name"] for c in inspector.get_columns("posts")}
+    assert "ix_posts_author_id_posted_at" in {i["name"] for i in inspector.get_indexes("posts")}
+
+
+def test_moves_author_strings_into_authors(legacy_db):
+    authors = {a.screen_name: a for a in legacy_db.query(models.Author)}
+    assert set(authors) == {"alice", "bob"}
+    # 同じ著者の行で空だった表示名は、他の行の値で埋まる
+    assert authors["alice"].name == "Alice"
+
+    posts = {p.id: p for p in legacy_db.query(models.Post)}
+    assert posts[1].author_id == posts[2].author_id == authors["alice"].id
+    assert posts[3].author_screen_name == "bob"
+    assert posts[4].author_id is None
+
+    with database.engine.connect() as conn:
+        leftovers = conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM posts WHERE author_screen_name IS NOT NULL OR author_name IS NOT NULL"
+        ).scalar()
+    assert leftovers == 0
+
+
+def test_counts_are_built_after_migration(legacy_db):
+    alice = crud.get_author_by_screen_name(legacy_db, "alice")
+    assert counters.get_count(legacy_db, "all") == 4
+    assert counters.get_count(legacy_db, counters.author_scope(alice.id)) == 2
+    assert crud.count_posts(legacy_db, schemas.PostFilter(author="alice")) == 2
+
+
+def test_init_db_is_idempotent(legacy_db):
+    counters.ensure_counts(legacy_db)
+    version = counters.get_version(legacy_db)
+    author_ids = sorted(a.id for a in legacy_db.query(models.Author))
+    legacy_db.commit()
+
+    database.init_db()
+    assert counters.get_version(legacy_db) == version
+    assert sorted(a.id for a in legacy_db.query(models.Author)) == author_ids
+    assert legacy_db.query(models.PostCount).count() > 0
+
+
+def test_backfills_tag_name_norm_and_post_count(legacy_db):
+    tags = {t.name: t for t in legacy_db.query(models.Tag)}
+    assert tags["Ｃａｔ"].name_norm == "cat"
+    counters.ensure_counts(legacy_db)
+    legacy_db.expire_all()
+    assert [(t.name, t.post_count) for t in crud.suggest_tags(legacy_db, "")] == [("Ｃａｔ", 2), ("dog", 1)]
+    assert [t.name for t in crud.suggest_tags(legacy_db, "CA")] == ["Ｃａｔ"]
+
+
+def test_tag_post_count_follows_counters(legacy_db):
+    counters.ensure_counts(legacy_db)
+    crud.update_post_tags(legacy_db, 3, ["dog", "Ｃａｔ"])
+    crud.update_post_tags(legacy_db, 1, [])
+    legacy_db.expire_all()
+    for tag in legacy_db.query(models.Tag):
+        assert tag.post_count == counters.get_count(legacy_db, counters.tag_scope(tag.id))
+
+
+def test_day_counts_are_built_after_migration(legacy_db):
+    counters.ensure_counts(legacy_db)
+    days = {(row.scope, row.day): row.count for row in legacy_db.query(models.PostDayCount)}
+    assert days[("all", "2022-01-05")] == 1
+    assert days[(counters.tag_scope(1), "2022-01-20")] == 1
+    assert crud.posts_histogram(legacy_db, schemas.PostFilter(), "month") == [("2022-01", 2), ("2022-02", 1)]
+    assert crud.posts_histogram(legacy_db, schemas.PostFilter(tag_names=["dog"]), "year") == [("2022", 1)]
@@ -0,0 +1,64 @@
+# /tests/test_page_cache.py
+import pytest
+from fastapi.testclient import TestClient
+
+from api import counters, page_cache
+from api.page_cache import PageCache
+from conftest import add_post
+
+
+def test_new_version_drops_older_pages():
+    cache = PageCache("test", max_bytes=1 << 20)
+    cache.put("a", 1, b"old", 3)
+    assert cache.get("a", 1) == (b"old", 3)
+
+    cache.put("b", 2, b"new")
+    assert cache.get("a", 1) is None
+    assert cache.get("a", 2) is None
+    assert cache.stats()["entries"] == 1
+    # 遅れて届いた古いバージョンの結果は入れない
+    cache.put("a", 1, b"stale")
+    assert cache.get("a", 1) is None
+    assert cache.stats()["version"] == 2
+
+
+def test_evicts_least_recently_used_within_the_byte_limit():
+    body = b"x" * 100
+    entry_size = PageCache._entry_size("a", body)
+    cache = PageCache("test", max_bytes=entry_size * 2)
+    cache.put("a", 1, body)
+    cache.put("b", 1, body)
+    cache.get("a", 1)
+    cache.put("c", 1, body)
+    assert [cache.get(k, 1) is not None for k in "abc"] == [True, False, True]
+    assert cache.stats()["bytes"] <= cache.max_bytes
+    # 上限を超える 1 件は入れない
+    cache.put("huge", 1, b"x" * entry_size * 3)
+    assert cache.get("huge", 1) is None
+
+
+@pytest.fixture
+def client(db):
+    from api.index import app
+    return TestClient(app)
+
+
+def test_post_list_is_served_from_cache_until_a_write(client, db):
+    # 起動時と同じくカウンタを作っておく (初回の集計でもデータバージョンが進むため)
+    counters.ensure_counts(db)
+    post = add_post(db, "1", tags=["cat"])
+    params = {"tag_names": "cat", "with_total": True}
+    first = client.get("/api/posts/", params=params)
+    hits = page_cache.post_list_cache.stats()["hits"]
+    again = client.get("/api/posts/", params=params)
+    assert page_cache.post_list_cache.stats()["hits"] == hits + 1
+    assert again.content == first.content
+    assert again.headers["X-Total-Count"] == "1"
+
+    # タグの付け替え・投稿の追加はデータバージョンを進めるので、次の読み出しは新しい結果になる
+    assert client.put(f"/api/posts/{post.id}/tags", json={"tags": ["dog"]}).status_code == 200
+    assert client.get("/api/posts/", params=params).json() == []
+    add_post(db, "2", tags=["cat"])
+    response = client.get("/api/posts/", params=params)
+    assert [p["tweet_id"] for p in response.json()] == ["2"]
+    assert response.headers["X-Total-Count"] == "1"
@@ -0,0 +1,72 @@
+# /tests/test_random.py
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+
+from api import counters, crud, models, schemas
+from conftest import add_post
+
+FILTERS = [
+    schemas.PostFilter(),
+    schemas.PostFilter(tag_names=["cat"]),
+    schemas.PostFilter(tag_names=["cat"], author="alice"),
+    schemas.PostFilter(posted_from=datetime(2022, 1, 10), posted_to=datetime(2022, 1, 20)),
+]
+
+
+@pytest.fixture
+def library(db):
+    for i in range(60):
+        add_post(db, str(i), posted_at=datetime(2022, 1, 1) + timedelta(days=i // 2),
+                 tags=["cat"] if i % 3 else [], author="alice" if i % 2 else "bob", commit=False)
+    db.commit()
+
+
+def _matching(db, filters):
+    return {p.id for p in crud.query_posts(db, filters, limit=1000)}
+
+
+@pytest.mark.parametrize("filters", FILTERS, ids=["none", "tag", "tag+author", "dates"])
+def test_samples_are_distinct_matching_and_repeatable(db, library, filters):
+    matching = _matching(db, filters)
+    sample = crud.sample_post_ids(db, filters, 5, seed=42)
+    assert len(sample) == len(set(sample)) == 5
+    assert set(sample) <= matching
+    assert crud.sample_post_ids(db, filters, 5, seed=42) == sample
+    assert any(crud.sample_post_ids(db, filters, 5, seed=seed) != sample for seed in range(5))
+    # 条件に合う件数より多くは返さない
+    assert sorted(crud.sample_post_ids(db, filters, 500, seed=1)) == sorted(matching)
+
+
+def test_sparse_id_ranges_fall_back_to_the_id_list(db, library):
+    ids = sorted(_matching(db, schemas.PostFilter()))
+    kept = {ids[0], ids[-1]}
+    doomed = [i for i in ids if i not in kept]
+    db.execute(delete(models.post_tag_association).where(models.post_tag_association.c.post_id.in_(doomed)))
+    db.execute(delete(models.PostSignature).where(models.PostSignature.post_id.in_(doomed)))
+    db.execute(delete(models.Post).where(models.Post.id.in_(doomed)))
+    counters.rebuild_counts(db)
+    assert crud._probe_random_ids(db, 2, random.Random(0)) is None
+    assert sorted(crud.sample_post_ids(db, schemas.PostFilter(), 5, seed=3)) == sorted(kept)
+
+
+def test_unfiltered_sampling_is_uniform(db):
+    posts = [add_post(db, str(i), commit=False).id for i in range(10)]
+    db.commit()
+    draws = Counter(crud.sample_post_ids(db, schemas.PostFilter(), 1, seed=seed)[0] for seed in range(2000))
+    assert set(draws) == set(posts)
+    assert all(120 <= n <= 280 for n in draws.values())
+
+
+def test_random_endpoint(db, library):
+    from api.index import app
+    client = TestClient(app)
+    response = client.get("/api/posts/random", params={"k": 3, "seed": 7, "tag_names": "cat"})
+    assert [p["id"] for p in response.json()] == crud.sample_post_ids(
+        db, schemas.PostFilter(tag_names=["cat"]), 3, seed=7)
+    assert client.get("/api/posts/random", params={"k": 0}).status_code == 400
+    assert client.get("/api/posts/random", params={"k": 101}).status_code == 400
@@ -0,0 +1,93 @@
+# /tests/test_related.py
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import crud, models, related
+from conftest import add_post
+
+
+@pytest.fixture
+def library(db):
+    """タグの組み合わせがばらばらな 40 件 (タグなしの投稿も含む)"""
+    posts = []
+    for i in range(40):
+        tags = [f"t{j}" for j in range(6) if (i * 7 + j * 3) % (j + 2) == 0]
+        posts.append(add_post(db, str(i), tags=tags, commit=False))
+    db.commit()
+    return posts
+
+
+def _tags_by_post(db):
+    db.expire_all()
+    return {post.id: {t.name for t in post.tags} for post in db.query(models.Post)}
+
+
+def _expected(db, post_id, limit):
+    """IDF で重み付けした Jaccard 係数を全投稿について 1 件ずつ計算する"""
+    tags = _tags_by_post(db)
+    tagged = [p for p, names in tags.items() if names]
+    df = {}
+    for p in tagged:
+        for name in tags[p]:
+            df[name] = df.get(name, 0) + 1
+    weight = {name: math.log((1 + len(tagged)) / (1 + n)) + 1 for name, n in df.items()}
+    scores = []
+    for other in tagged:
+        shared = tags[post_id] & tags[other]
+        if other != post_id and shared:
+            score = sum(weight[t] for t in shared) / sum(weight[t] for t in tags[post_id] | tags[other])
+            scores.append((other, score))
+    scores.sort(key=lambda s: (-round(s[1], 12), -s[0]))
+    return scores[:limit]
+
+
+def _assert_matches(actual, expected):
+    assert [post_id for post_id, _ in actual] == [post_id for post_id, _ in expected]
+    assert [score for _, score in actual] == pytest.approx([score for _, score in expected], rel=1e-9)
+
+
+def test_scores_match_a_direct_computation(db, library):
+    for post in library[:10]:
+        _assert_matches(related.get_related(db, post.id, limit=10), _expected(db, post.id, 10))
+    assert related.get_related(db, 10**6) == []
+
+
+def test_tag_edits_update_the_index_in_place(db, library):
+    target, unrelated = library[0], library[2]
+    tags = _tags_by_post(db)
+    # 対象とタグを共有する投稿の近傍リストはキャッシュ済みにしておく (書き換えで捨てられるべきもの)
+    neighbour = next(p for p in library[1:] if tags[p.id] & tags[target.id])
+    assert target.id in [post_id for post_id, _ in related.get_related(db, neighbour.id, limit=50)]
+    index = related._index
+
+    crud.update_post_tags(db, target.id, ["t0", "t1", "new"])
+    crud.update_post_tags(db, library[3].id, [])
+    crud.update_post_tags(db, unrelated.id, ["t5"])
+    added = add_post(db, "new", tags=["new", "t0"])
+
+    # 作り直さずに同じ索引を書き換えている
+    related.get_related(db, target.id)
+    assert related._index is index
+    for post in [target, neighbour, unrelated, library[3], added] + library[4:12]:
+        _assert_matches(related.get_related(db, post.id, limit=20), _expected(db, post.id, 20))
+    assert related.get_related(db, library[3].id) == []
+
+
+def test_rebuilds_when_another_process_changed_tags(db, library):
+    related.get_related(db, library[0].id)
+    index = related._index
+    # 別プロセスでの変更 (この索引には届かない) はタグのバージョンで気づく
+    related._index.version -= 1
+    _assert_matches(related.get_related(db, library[0].id, limit=10), _expected(db, library[0].id, 10))
+    assert related._index is not index
+
+
+def test_related_endpoint(db, library):
+    from api.index import app
+    client = TestClient(app)
+    post = library[5]
+    response = client.get(f"/api/posts/{post.id}/related", params={"limit": 3})
+    assert [item["post"]["id"] for item in response.json()] == [p for p, _ in _expected(db, post.id, 3)]
+    assert client.get("/api/posts/999999/related").status_code == 404
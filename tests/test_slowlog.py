@@ -0,0 +1,61 @@
+# /tests/test_slowlog.py
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from api import crud, database, slowlog
+
+
+@pytest.fixture
+def slow_queries(monkeypatch):
+    """すべての文をスロークエリとして記録する (conftest では SLOW_QUERY_MS=0 で無効にしている)"""
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_MS", 1e-9)
+    slowlog.instrument_engine(database.engine)
+    slowlog.clear()
+    yield
+    for name, listener in [("before_cursor_execute", slowlog._before_cursor_execute),
+                           ("after_cursor_execute", slowlog._after_cursor_execute),
+                           ("handle_error", slowlog._handle_error)]:
+        event.remove(database.engine, name, listener)
+    slowlog._explain_executor.shutdown(wait=True)
+    slowlog._explain_executor = None
+    slowlog.clear()
+
+
+def _app():
+    """メトリクスのミドルウェアなしで RequestContextMiddleware だけを付けたアプリ"""
+    app = FastAPI()
+    app.add_middleware(slowlog.RequestContextMiddleware)
+
+    def get_db():
+        db = database.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @app.get("/folders/{page}")
+    def read_folders(page: int, db=Depends(get_db)):
+        return {"count": len(crud.get_folders(db, skip=page)), "label": slowlog._source_label()}
+
+    return app
+
+
+def test_label_uses_the_route_template_without_metrics(db):
+    assert TestClient(_app()).get("/folders/0").json() == {"count": 0, "label": "GET /folders/{page}"}
+    assert slowlog._source_label().startswith("script:")
+
+
+def test_slow_queries_record_the_endpoint_and_caller(db, slow_queries):
+    TestClient(_app()).get("/folders/0")
+    crud.get_folders(db)
+    db.execute(database.Base.metadata.tables["folders"].select())  # crud.py を通らない文は記録しない
+
+    entries = slowlog.recent_entries()[::-1]
+    assert len(entries) == 2
+    assert entries[0]["endpoint"] == "GET /folders/{page}"
+    assert entries[1]["endpoint"].startswith("script:")
+    assert all(e["caller"].startswith("crud.py:") and "get_folders" in e["caller"] for e in entries)
+    # パラメータは SLOW_QUERY_DEBUG のときだけ残す
+    assert all(e["parameters"] is None for e in entries)
@@ -0,0 +1,64 @@
+# /tests/test_threads.py
+from api import extract, models
+from conftest import make_page_mhtml, quote_box, tweet_article
+from scripts import import_mhtml
+
+URL = "https://x.com/alice/status/102"
+
+
+def _thread_page() -> str:
+    """1 つ前の投稿への返信として開いたページ。後ろにセルフリプライと他人の返信、注目の投稿は引用付き"""
+    return "".join([
+        tweet_article("101", "first", posted_at="2023-03-01T09:00:00.000Z"),
+        tweet_article("102", "second", posted_at="2023-03-01T10:00:00.000Z", quote=quote_box("50", "quoted")),
+        tweet_article("103", "third", posted_at="2023-03-01T11:00:00.000Z"),
+        tweet_article("104", "reply", author="carol", posted_at="2023-03-01T12:00:00.000Z"),
+    ])
+
+
+def test_extract_posts_returns_the_thread_and_the_quote():
+    posts = extract.extract_posts(f"<html><body>{_thread_page()}</body></html>".encode(), URL)
+    assert [p["tweet_id"] for p in posts] == ["102", "101", "103", "104", "50"]
+    by_id = {p["tweet_id"]: p for p in posts}
+    assert by_id["102"]["reply_to_tweet_id"] == "101"
+    assert by_id["102"]["quoted_tweet_id"] == "50"
+    assert by_id["103"]["reply_to_tweet_id"] == "102"
+    # 他人の返信からはセルフスレッドが切れるので注目の投稿への返信になる
+    assert by_id["104"]["reply_to_tweet_id"] == "102"
+    assert by_id["50"]["author_screen_name"] == "bob"
+    # 引用の本文は引用した投稿に混ざらない
+    assert by_id["102"]["text"] == "second"
+
+
+def test_import_saves_every_post_and_links_them(db, tmp_path):
+    path = tmp_path / "thread.mhtml"
+    path.write_bytes(make_page_mhtml(URL, _thread_page()))
+    result = import_mhtml.parse_and_import(str(path))
+    assert result["status"] == "added"
+    assert len(result["added_post_ids"]) == 5
+
+    posts = {p.tweet_id: p for p in db.query(models.Post)}
+    assert result["post_id"] == posts["102"].id
+    assert posts["102"].parent_post_id == posts["101"].id
+    assert posts["102"].quoted_post_id == posts["50"].id
+    assert posts["104"].parent_post_id == posts["102"].id
+    assert posts["50"].author.screen_name == "bob"
+    # 同じページの投稿は同じアーカイブを指す
+    assert len({p.raw_html_sha256 for p in posts.values()}) == 1
+
+
+def test_reimport_only_fills_missing_links(db, tmp_path):
+    single = tmp_path / "single.mhtml"
+    single.write_bytes(make_page_mhtml(URL, tweet_article("102", "second")))
+    first = import_mhtml.parse_and_import(str(single))
+
+    path = tmp_path / "thread.mhtml"
+    path.write_bytes(make_page_mhtml(URL, _thread_page()))
+    result = import_mhtml.parse_and_import(str(path))
+    assert result["post_id"] == first["post_id"]
+    assert len(result["added_post_ids"]) == 4
+
+    db.expire_all()
+    post = db.get(models.Post, first["post_id"])
+    assert post.parent_post_id is not None and post.quoted_post_id is not None
+    assert import_mhtml.parse_and_import(str(path))["status"] == "skipped"
@@ -0,0 +1,91 @@
+# /tests/test_timeline.py
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import crud, models, schemas
+from conftest import add_post
+
+
+@pytest.fixture
+def timeline(db):
+    """2022-01 〜 2022-04 に 1 日おきの投稿。偶数番目に cat、3 の倍数に alice"""
+    start = datetime(2022, 1, 1, 12)
+    posts = []
+    for i in range(60):
+        tags = ["cat"] if i % 2 == 0 else []
+        posts.append(add_post(db, str(1000 + i), posted_at=start + timedelta(days=2 * i), tags=tags,
+                              author="alice" if i % 3 == 0 else "bob", commit=False))
+    db.commit()
+    return posts
+
+
+@pytest.fixture
+def client(db):
+    from api.index import app
+    return TestClient(app)
+
+
+def _tally(db, filters, width):
+    """期待値: 条件に合う投稿を 1 件ずつ数える"""
+    predicates = crud._plan_predicates(db, filters)
+    if predicates is None:
+        return []
+    query = crud.build_posts_query(db, filters, predicates, query=db.query(models.Post.posted_at))
+    buckets = {}
+    for (posted_at,) in query.filter(models.Post.posted_at.isnot(None)):
+        key = posted_at.strftime("%Y-%m-%d")[:width]
+        buckets[key] = buckets.get(key, 0) + 1
+    return sorted(buckets.items())
+
+
+def test_before_anchor_starts_at_the_requested_month(db, timeline):
+    posts = crud.query_posts(db, schemas.PostFilter(), limit=3, before=datetime(2022, 3, 1))
+    assert [p.posted_at for p in posts] == [datetime(2022, 2, 28, 12), datetime(2022, 2, 26, 12), datetime(2022, 2, 24, 12)]
+
+
+def test_after_anchor_in_ascending_order(db, timeline):
+    posts = crud.query_posts(db, schemas.PostFilter(tag_names=["cat"]), limit=2, sort_order="asc",
+                             after=datetime(2022, 2, 1, tzinfo=timezone.utc))
+    assert [p.posted_at for p in posts] == [datetime(2022, 2, 2, 12), datetime(2022, 2, 6, 12)]
+
+
+def test_anchors_through_the_api(client, timeline):
+    response = client.get("/api/posts/", params={"limit": 2, "before": "2022-03-01T09:00:00+09:00", "with_total": True})
+    assert response.status_code == 200
+    assert [p["posted_at"][:10] for p in response.json()] == ["2022-02-28", "2022-02-26"]
+    # 総件数はアンカーではなく絞り込み条件だけで決まる
+    assert response.headers["X-Total-Count"] == "60"
+
+
+@pytest.mark.parametrize("granularity", ["day", "month", "year"])
+@pytest.mark.parametrize("filters", [
+    schemas.PostFilter(),
+    schemas.PostFilter(tag_names=["cat"]),
+    schemas.PostFilter(author="alice"),
+    schemas.PostFilter(tag_names=["cat"], author="alice"),
+    schemas.PostFilter(posted_from=datetime(2022, 1, 15, 18, tzinfo=timezone(timedelta(hours=9))),
+                       posted_to=datetime(2022, 3, 9, 6)),
+    schemas.PostFilter(tag_names=["cat"], posted_from=datetime(2022, 2, 1), posted_to=datetime(2022, 2, 28, 23, 59)),
+], ids=["all", "tag", "author", "tag+author", "partial-days", "tag+range"])
+def test_histogram_matches_a_direct_tally(db, timeline, filters, granularity):
+    width = crud.HISTOGRAM_GRANULARITIES[granularity]
+    assert crud.posts_histogram(db, filters, granularity) == _tally(db, filters, width)
+
+
+def test_histogram_follows_tag_edits(db, timeline):
+    monthly = dict(crud.posts_histogram(db, schemas.PostFilter(tag_names=["cat"]), "month"))
+    crud.update_post_tags(db, timeline[1].id, ["cat"])  # 2022-01-03
+    crud.update_post_tags(db, timeline[0].id, [])  # 2022-01-01
+    crud.update_post_tags(db, timeline[-1].id, ["cat"])  # 2022-04-29
+    after = dict(crud.posts_histogram(db, schemas.PostFilter(tag_names=["cat"]), "month"))
+    assert after["2022-01"] == monthly["2022-01"]
+    assert after["2022-04"] == monthly["2022-04"] + 1
+    assert list(after.items()) == _tally(db, schemas.PostFilter(tag_names=["cat"]), 7)
+
+
+def test_histogram_endpoint(client, timeline):
+    response = client.get("/api/posts/histogram", params={"granularity": "year", "tag_names": "cat"})
+    assert response.json() == [{"period": "2022", "count": 30}]
+    assert client.get("/api/posts/histogram", params={"granularity": "week"}).status_code == 400
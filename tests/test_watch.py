@@ -0,0 +1,82 @@
+# /tests/test_watch.py
+import os
+import time
+
+import pytest
+from watchfiles import Change
+
+from api import models
+from conftest import make_mhtml
+from scripts import import_mhtml
+
+
+def _write(path, data: bytes, age: float = 10.0) -> str:
+    """書き込みが終わって age 秒たったファイル"""
+    path.write_bytes(data)
+    past = time.time() - age
+    os.utime(path, (past, past))
+    return str(path)
+
+
+@pytest.fixture
+def notifications(monkeypatch):
+    """OS のファイル通知の代わりに、テストが並べた変更を順に返す (空の集合は通知なしのタイムアウト)"""
+    batches = []
+
+    def fake_watch(path, watch_filter, **kwargs):
+        for batch in batches:
+            changes = batch() if callable(batch) else batch
+            yield {(change, p) for change, p in changes if watch_filter(change, p)}
+
+    monkeypatch.setattr(import_mhtml, "watch", fake_watch)
+    return batches
+
+
+def test_existing_files_are_imported_and_archived(db, tmp_path, notifications):
+    inbox, archive = tmp_path / "inbox", tmp_path / "archive"
+    inbox.mkdir()
+    _write(inbox / "a.mhtml", make_mhtml("101", "first"))
+    (inbox / "notes.txt").write_text("not an import")
+
+    summary = import_mhtml.watch_directory(str(inbox), archive_dir=str(archive))
+    assert summary["added"] == 1
+    assert sorted(os.listdir(inbox)) == ["notes.txt"]
+    assert os.listdir(archive) == ["a.mhtml"]
+
+    # 同じ名前のファイルはアーカイブ先で上書きしない
+    _write(inbox / "a.mhtml", make_mhtml("102", "second"))
+    import_mhtml.watch_directory(str(inbox), archive_dir=str(archive))
+    assert sorted(os.listdir(archive)) == ["a-1.mhtml", "a.mhtml"]
+
+
+def test_new_files_wait_until_they_stop_changing(db, tmp_path, notifications):
+    path = tmp_path / "b.mhtml"
+    imported = []
+
+    def write_more():
+        # 次の確認までにまだ書き足されている
+        _write(path, make_mhtml("201", "complete"))
+        return set()
+
+    def check():
+        imported.append(db.query(models.Post).count())
+        return set()
+
+    _write(path, b"partial")
+    notifications.extend([
+        {(Change.added, str(path)), (Change.added, str(tmp_path / "ignored.txt"))},
+        write_more,  # 前回からサイズが変わったので、まだ取り込まない
+        check,  # ここまでは何も取り込まれていない。変化がなく settle 秒を過ぎたのでこの回で取り込む
+    ])
+    summary = import_mhtml.watch_directory(str(tmp_path), settle_seconds=2.0, delete=True, process_existing=False)
+    assert imported == [0]
+    assert summary["added"] == 1 and summary["failed"] == 0
+    assert not path.exists()
+
+
+def test_failed_files_are_not_deleted(db, tmp_path, notifications):
+    path = _write(tmp_path / "broken.mhtml", b"MIME-Version: 1.0\nContent-Type: text/plain\n\nnot a page")
+    notifications.extend([{(Change.added, path)}, set()])
+    summary = import_mhtml.watch_directory(str(tmp_path), delete=True, process_existing=False)
+    assert summary["failed"] == 1
+    assert os.path.exists(path)